@@ -0,0 +1,116 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Compares two results of benchmarks.replay.
+
+    python -m benchmarks.compare baseline.json current.json --threshold 0.1
+
+Exits with 1 if a latency grew or the throughput dropped by more than the threshold.
+"""
+
+import argparse
+import json
+import sys
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Statistics of latency summaries which are compared, p99 is too noisy in short runs
+COMPARED_STATS = ["mean", "p90"]
+# Latencies shorter than this in seconds are too noisy to be compared
+MIN_LATENCY = 0.05
+
+
+def latencies(results: Dict) -> Iterator[Tuple[str, Dict]]:
+    """
+    :return: pairs of (name, summary) of all latency summaries in the results
+    """
+    yield "sync", results["sync"]
+    yield "push_to_mr", results["push_to_mr"]
+    for section in ["stages", "api", "git"]:
+        for name, summary in results.get(section, {}).items():
+            yield f"{section}.{name}", summary
+
+
+def compare(
+    baseline: Dict, current: Dict, threshold: float, min_latency: float = MIN_LATENCY
+) -> Tuple[List[str], List[str]]:
+    """
+    :return: lines of the report and regressions
+    """
+    report = []
+    regressions = []
+    if baseline["config"] != current["config"]:
+        report.append(f"WARNING: configurations differ {baseline['config']} {current['config']}")
+
+    def check(name: str, old: float, new: float, higher_is_better: bool = False):
+        change = (new - old) / old if old else 0.0
+        regressed = change < -threshold if higher_is_better else change > threshold
+        line = f"{name:50} {old:12.4f} {new:12.4f} {change:+8.1%}"
+        report.append(line + ("  REGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append(line)
+
+    check("throughput", baseline["throughput"], current["throughput"], higher_is_better=True)
+    current_latencies = dict(latencies(current))
+    for name, old in latencies(baseline):
+        new = current_latencies.get(name)
+        if not new or not old.get("count") or not new.get("count"):
+            continue
+        for stat in COMPARED_STATS:
+            if max(old[stat], new[stat]) < min_latency:
+                continue
+            check(f"{name}.{stat}", old[stat], new[stat])
+    if current["errors"]:
+        regressions.append(f"{len(current['errors'])} syncs failed")
+    return report, regressions
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.compare", description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument("baseline", help="JSON results of the baseline")
+    parser.add_argument("current", help="JSON results to compare")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="allowed relative change, 0.1 is 10%%"
+    )
+    parser.add_argument(
+        "--min-latency", type=float, default=MIN_LATENCY,
+        help="latencies below this number of seconds are not compared",
+    )
+    args = parser.parse_args(argv)
+    with open(args.baseline) as baseline, open(args.current) as current:
+        report, regressions = compare(
+            json.load(baseline), json.load(current), args.threshold, args.min_latency
+        )
+    print(f"{'':50} {'baseline':>12} {'current':>12} {'change':>8}")
+    print("\n".join(report))
+    if regressions:
+        print(f"\n{len(regressions)} regressions above {args.threshold:.0%}:", file=sys.stderr)
+        print("\n".join(regressions), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
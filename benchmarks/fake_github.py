@@ -0,0 +1,55 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Fake GitHub serving raw files of the betka repository, i.e. betka global configuration.
+"""
+
+from typing import Dict
+
+from aiohttp import web
+
+from benchmarks.server import FakeServer
+
+
+class FakeGitHub(FakeServer):
+    """
+    :param files: file name: content served as /sclorg/betka/raw/main/<file name>
+    """
+
+    def __init__(self, files: Dict[str, str]):
+        self.files = files
+        super().__init__()
+
+    def add_routes(self, router: web.UrlDispatcher):
+        router.add_get("/{owner}/{repo}/raw/{branch}/{name}", self.get_raw)
+
+    @property
+    def betka_url_base(self) -> str:
+        return f"{self.url}/sclorg/betka/raw/main/"
+
+    async def get_raw(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        if name not in self.files:
+            raise web.HTTPNotFound()
+        return web.Response(text=self.files[name])
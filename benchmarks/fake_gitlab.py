@@ -0,0 +1,293 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Fake GitLab REST and GraphQL API for the endpoints used by GitLabAPI,
+AsyncGitLabClient and GitLabGraphQL.
+
+Projects are backed by the local bare downstream repositories, so branches
+and bot-cfg.yml files pushed by betka are visible to the following requests.
+Merge requests are kept in memory.
+"""
+
+import asyncio
+import re
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+from aiohttp import web
+
+from benchmarks.fixtures import DOWNSTREAM_URL
+from benchmarks.server import ENDPOINT_KEY, FakeServer
+
+FIRST_PROJECT_ID = 1000
+USER = {"id": 1, "username": "betka-bench", "name": "Betka Benchmark"}
+
+# Resources below /api/v4/projects/<id or url-encoded path>
+PROJECT_ROUTES: List[Tuple[str, str, str]] = [
+    ("GET", r"", "get_project"),
+    ("GET", r"/repository/branches", "list_branches"),
+    ("GET", r"/protected_branches", "list_protected_branches"),
+    ("GET", r"/merge_requests", "list_merge_requests"),
+    ("POST", r"/merge_requests", "create_merge_request"),
+    ("GET", r"/forks", "list_forks"),
+    ("HEAD", r"/repository/files/(?P<file>[^/]+)", "head_file"),
+    ("GET", r"/repository/files/(?P<file>[^/]+)/raw", "get_raw_file"),
+]
+
+GRAPHQL_PROJECT = re.compile(r'(p\d+): project\(fullPath: ("[^"]*")\)')
+GRAPHQL_BLOB = re.compile(r'(b\d+): blobs\(ref: ("[^"]*"), paths: \[("[^"]*")\]\)')
+
+
+class FakeGitLab(FakeServer):
+    """
+    :param repos_dir: directory with bare repositories <image>.git
+    :param namespace: GitLab namespace of the images
+    :param images: image names, project ids are assigned in this order
+    """
+
+    def __init__(self, repos_dir: Path, namespace: str, images: List[str]):
+        self.repos_dir = repos_dir
+        self.namespace = namespace
+        self.projects: Dict[int, str] = {
+            FIRST_PROJECT_ID + idx: image for idx, image in enumerate(images)
+        }
+        self.by_path = {
+            f"{namespace}/{image}": project_id for project_id, image in self.projects.items()
+        }
+        self.merge_requests: Dict[int, List[Dict]] = {x: [] for x in self.projects}
+        super().__init__()
+
+    def add_routes(self, router: web.UrlDispatcher):
+        router.add_get("/api/v4/user", self.get_user)
+        router.add_post("/api/graphql", self.graphql)
+        router.add_route("*", "/api/v4/projects/{tail:.*}", self.dispatch_project)
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.url}/api/v4/"
+
+    @property
+    def merge_requests_created(self) -> int:
+        return sum(len(x) for x in self.merge_requests.values())
+
+    async def git(self, image: str, *args) -> Optional[str]:
+        process = await asyncio.create_subprocess_exec(
+            "git",
+            "--git-dir",
+            str(self.repos_dir / f"{image}.git"),
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await process.communicate()
+        if process.returncode != 0:
+            return None
+        return stdout.decode()
+
+    async def branch_names(self, image: str) -> List[str]:
+        output = await self.git(image, "for-each-ref", "--format=%(refname:short)", "refs/heads")
+        return output.split() if output else []
+
+    async def blob(self, image: str, branch: str, path: str) -> Optional[Tuple[str, str]]:
+        """
+        :return: blob id and content of the file in the branch or None
+        """
+        oid = await self.git(image, "rev-parse", "--verify", "-q", f"{branch}:{path}")
+        if not oid:
+            return None
+        content = await self.git(image, "cat-file", "blob", oid.strip())
+        return oid.strip(), content
+
+    def project_json(self, project_id: int) -> Dict[str, Any]:
+        image = self.projects[project_id]
+        return {
+            "id": project_id,
+            "name": image,
+            "path": image,
+            "path_with_namespace": f"{self.namespace}/{image}",
+            "ssh_url_to_repo": f"{DOWNSTREAM_URL.format(namespace=self.namespace)}{image}.git",
+            "web_url": f"{self.url}/{self.namespace}/{image}",
+        }
+
+    @staticmethod
+    def paginate(request: web.Request, items: List[Any]) -> web.Response:
+        """
+        GitLab offset pagination with X-Next-Page header
+        """
+        page = int(request.query.get("page", 1))
+        per_page = int(request.query.get("per_page", 20))
+        start = (page - 1) * per_page
+        total_pages = max((len(items) + per_page - 1) // per_page, 1)
+        headers = {
+            "X-Page": str(page),
+            "X-Per-Page": str(per_page),
+            "X-Total": str(len(items)),
+            "X-Total-Pages": str(total_pages),
+            "X-Next-Page": str(page + 1) if page < total_pages else "",
+        }
+        return web.json_response(items[start:start + per_page], headers=headers)
+
+    async def get_user(self, request: web.Request) -> web.Response:
+        return web.json_response(USER)
+
+    async def dispatch_project(self, request: web.Request) -> web.Response:
+        # %2F in project paths must not be decoded before routing
+        tail = request.rel_url.raw_path[len("/api/v4/projects/"):]
+        project, _, rest = tail.partition("/")
+        rest = f"/{rest}" if rest else ""
+        project = unquote(project)
+        project_id = int(project) if project.isdigit() else self.by_path.get(project)
+        for method, pattern, handler in PROJECT_ROUTES:
+            match = re.fullmatch(pattern, rest)
+            if match and request.method == method:
+                request[ENDPOINT_KEY] = "/api/v4/projects/{id}" + re.sub(
+                    r"\(\?P<(\w+)>[^)]*\)", r"{\1}", pattern
+                )
+                if project_id not in self.projects:
+                    raise web.HTTPNotFound()
+                return await getattr(self, handler)(
+                    request, project_id, **{k: unquote(v) for k, v in match.groupdict().items()}
+                )
+        raise web.HTTPNotFound()
+
+    async def get_project(self, request: web.Request, project_id: int) -> web.Response:
+        return web.json_response(self.project_json(project_id))
+
+    async def list_branches(self, request: web.Request, project_id: int) -> web.Response:
+        web_url = self.project_json(project_id)["web_url"]
+        branches = [
+            {"name": x, "web_url": f"{web_url}/-/tree/{x}", "protected": False}
+            for x in await self.branch_names(self.projects[project_id])
+        ]
+        return self.paginate(request, branches)
+
+    async def list_protected_branches(self, request: web.Request, project_id: int) -> web.Response:
+        return self.paginate(request, [])
+
+    async def list_forks(self, request: web.Request, project_id: int) -> web.Response:
+        return self.paginate(request, [])
+
+    async def list_merge_requests(self, request: web.Request, project_id: int) -> web.Response:
+        state = request.query.get("state")
+        merge_requests = [
+            x for x in self.merge_requests[project_id] if not state or x["state"] == state
+        ]
+        return self.paginate(request, merge_requests)
+
+    async def create_merge_request(self, request: web.Request, project_id: int) -> web.Response:
+        if request.content_type == "application/json":
+            data = await request.json()
+        else:
+            data = dict(await request.post())
+        merge_requests = self.merge_requests[project_id]
+        for mr in merge_requests:
+            if mr["source_branch"] == data["source_branch"] and mr["state"] == "opened":
+                return web.json_response(
+                    {"message": ["Another open merge request already exists"]}, status=409
+                )
+        iid = len(merge_requests) + 1
+        mr = {
+            "id": project_id * 1000 + iid,
+            "iid": iid,
+            "title": data["title"],
+            "description": data.get("description", ""),
+            "state": "opened",
+            "source_branch": data["source_branch"],
+            "target_branch": data["target_branch"],
+            "source_project_id": project_id,
+            "target_project_id": int(data.get("target_project_id") or project_id),
+            "author": USER,
+            "web_url": f"{self.project_json(project_id)['web_url']}/-/merge_requests/{iid}",
+        }
+        merge_requests.append(mr)
+        return web.json_response(mr, status=201)
+
+    async def head_file(self, request: web.Request, project_id: int, file: str) -> web.Response:
+        blob = await self.blob(self.projects[project_id], request.query["ref"], file)
+        if blob is None:
+            raise web.HTTPNotFound()
+        return web.Response(headers={"X-Gitlab-Blob-Id": blob[0]})
+
+    async def get_raw_file(self, request: web.Request, project_id: int, file: str) -> web.Response:
+        blob = await self.blob(self.projects[project_id], request.query["ref"], file)
+        if blob is None:
+            raise web.HTTPNotFound()
+        return web.Response(text=blob[1])
+
+    async def graphql_project(self, project_id: int, blobs: List[Tuple[str, str, str]]) -> Dict:
+        image = self.projects[project_id]
+        project = self.project_json(project_id)
+        repository: Dict[str, Any] = {"branchNames": await self.branch_names(image)}
+        for alias, ref, path in blobs:
+            blob = await self.blob(image, ref, path)
+            repository[alias] = {
+                "nodes": [{"oid": blob[0], "rawBlob": blob[1]}] if blob else []
+            }
+        return {
+            "id": f"gid://gitlab/Project/{project_id}",
+            "name": project["name"],
+            "sshUrlToRepo": project["ssh_url_to_repo"],
+            "webUrl": project["web_url"],
+            "repository": repository,
+            "branchRules": {"nodes": [], "pageInfo": {"hasNextPage": False}},
+            "mergeRequests": {
+                "pageInfo": {"hasNextPage": False},
+                "nodes": [
+                    {
+                        "iid": str(x["iid"]),
+                        "title": x["title"],
+                        "description": x["description"],
+                        "targetBranch": x["target_branch"],
+                        "sourceBranch": x["source_branch"],
+                        "author": {"username": x["author"]["username"]},
+                        "sourceProjectId": x["source_project_id"],
+                        "targetProjectId": x["target_project_id"],
+                        "webUrl": x["web_url"],
+                    }
+                    for x in self.merge_requests[project_id]
+                    if x["state"] == "opened"
+                ]
+            },
+        }
+
+    async def graphql(self, request: web.Request) -> web.Response:
+        """
+        Answers the aliased project query built by GitLabGraphQL.build_query
+        """
+        query = (await request.json())["query"]
+        matches = list(GRAPHQL_PROJECT.finditer(query))
+        data = {}
+        for idx, match in enumerate(matches):
+            end = matches[idx + 1].start() if idx + 1 < len(matches) else len(query)
+            blobs = [
+                (alias, ref.strip('"'), path.strip('"'))
+                for alias, ref, path in GRAPHQL_BLOB.findall(query, match.end(), end)
+            ]
+            project_id = self.by_path.get(match.group(2).strip('"'))
+            data[match.group(1)] = (
+                await self.graphql_project(project_id, blobs) if project_id else None
+            )
+        return web.json_response({"data": data})
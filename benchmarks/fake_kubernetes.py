@@ -0,0 +1,151 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Fake Kubernetes pods API used by OpenshiftDeployer.
+
+Instead of running the generator image, a pod copies the upstream sources
+of WORKDIR/<UPSTREAM_IMAGE_NAME> into WORKDIR/results, which is what
+the generator does for images without generated sources.
+"""
+
+import shutil
+import time
+
+from pathlib import Path
+from typing import Dict
+
+from aiohttp import web
+
+from benchmarks.server import FakeServer
+
+
+class FakePod(object):
+    def __init__(self, manifest: Dict, pod_seconds: float):
+        self.manifest = manifest
+        self.name: str = manifest["metadata"]["name"]
+        self.env: Dict[str, str] = {
+            x["name"]: x["value"] for x in manifest["spec"]["containers"][0]["env"]
+        }
+        self.finish_at = time.monotonic() + pod_seconds
+        self.log = ""
+
+    def generate(self) -> str:
+        """
+        Simulates the generator run once the pod is finished
+        :return: pod phase
+        """
+        workdir = Path(self.env["WORKDIR"])
+        source = workdir / self.env["UPSTREAM_IMAGE_NAME"]
+        results = workdir / "results"
+        if not source.is_dir() or not results.is_dir():
+            self.log = f"Missing {source} or {results}\n"
+            return "Failed"
+        shutil.copytree(
+            str(source), str(results), ignore=shutil.ignore_patterns(".git"), dirs_exist_ok=True
+        )
+        self.log = f"Generated {self.env['DOWNSTREAM_IMAGE_NAME']} from {source}\n"
+        return "Succeeded"
+
+    def phase(self) -> str:
+        if time.monotonic() < self.finish_at:
+            return "Running"
+        if not self.log:
+            self.manifest["status"] = {"phase": self.generate()}
+        return self.manifest["status"]["phase"]
+
+    def to_json(self) -> Dict:
+        return {
+            "apiVersion": "v1",
+            "kind": "Pod",
+            "metadata": self.manifest["metadata"],
+            "status": {"phase": self.phase()},
+        }
+
+
+class FakeKubernetes(FakeServer):
+    """
+    :param pod_seconds: seconds after which a created pod is finished
+    """
+
+    def __init__(self, pod_seconds: float = 0):
+        self.pod_seconds = pod_seconds
+        self.pods: Dict[str, Dict[str, FakePod]] = {}
+        self.pods_created = 0
+        super().__init__()
+
+    def add_routes(self, router: web.UrlDispatcher):
+        router.add_post("/api/v1/namespaces/{namespace}/pods", self.create_pod)
+        router.add_get("/api/v1/namespaces/{namespace}/pods/{name}", self.read_pod)
+        router.add_delete("/api/v1/namespaces/{namespace}/pods/{name}", self.delete_pod)
+        router.add_get("/api/v1/namespaces/{namespace}/pods/{name}/log", self.read_pod_log)
+
+    @staticmethod
+    def status(code: int, reason: str, message: str) -> web.Response:
+        return web.json_response(
+            {
+                "apiVersion": "v1",
+                "kind": "Status",
+                "status": "Failure",
+                "reason": reason,
+                "message": message,
+                "code": code,
+            },
+            status=code,
+        )
+
+    def get_pod(self, request: web.Request) -> FakePod:
+        namespace = request.match_info["namespace"]
+        return self.pods.get(namespace, {}).get(request.match_info["name"])
+
+    def not_found(self, request: web.Request) -> web.Response:
+        return self.status(404, "NotFound", f'pods "{request.match_info["name"]}" not found')
+
+    async def create_pod(self, request: web.Request) -> web.Response:
+        manifest = await request.json()
+        pods = self.pods.setdefault(request.match_info["namespace"], {})
+        name = manifest["metadata"]["name"]
+        if name in pods:
+            return self.status(409, "AlreadyExists", f'pods "{name}" already exists')
+        pods[name] = FakePod(manifest, self.pod_seconds)
+        self.pods_created += 1
+        return web.json_response(pods[name].to_json(), status=201)
+
+    async def read_pod(self, request: web.Request) -> web.Response:
+        pod = self.get_pod(request)
+        if pod is None:
+            return self.not_found(request)
+        return web.json_response(pod.to_json())
+
+    async def delete_pod(self, request: web.Request) -> web.Response:
+        pod = self.get_pod(request)
+        if pod is None:
+            return self.not_found(request)
+        del self.pods[request.match_info["namespace"]][pod.name]
+        return web.json_response(pod.to_json())
+
+    async def read_pod_log(self, request: web.Request) -> web.Response:
+        pod = self.get_pod(request)
+        if pod is None:
+            return self.not_found(request)
+        return web.Response(text=pod.log)
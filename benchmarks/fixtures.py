@@ -0,0 +1,176 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Local bare repositories of a synthetic fleet.
+
+Upstream repositories are reached by betka as https://github.com/sclorg/<image>-container
+and downstream ones as git@gitlab.com:<namespace>/<image>.git. Both URLs are rewritten
+to the local repositories by git `url.<base>.insteadOf`, see `git_config_env`.
+"""
+
+import os
+import random
+import string
+import subprocess
+
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, List
+
+UPSTREAM_URL = "https://github.com/sclorg/"
+DOWNSTREAM_URL = "git@gitlab.com:{namespace}/"
+
+BenchFleet = namedtuple(
+    "BenchFleet", ["root", "images", "branches", "upstream_urls", "upstream_heads"]
+)
+
+GIT_IDENTITY = {
+    "GIT_AUTHOR_NAME": "Betka Benchmark",
+    "GIT_AUTHOR_EMAIL": "benchmark@example.com",
+    "GIT_COMMITTER_NAME": "Betka Benchmark",
+    "GIT_COMMITTER_EMAIL": "benchmark@example.com",
+}
+
+BOT_CFG = """version: "1"
+{image_url}
+upstream-to-downstream:
+  enabled: true
+  master_checker: true
+  pr_checker: false
+  upstream_branch_name: main
+"""
+
+
+def git(*args, cwd: Path) -> str:
+    env = dict(os.environ, **GIT_IDENTITY)
+    result = subprocess.run(
+        ["git", *args],
+        cwd=str(cwd),
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+        check=True,
+    )
+    return result.stdout.strip()
+
+
+def image_names(images: int) -> List[str]:
+    return [f"bench-{idx:03d}" for idx in range(images)]
+
+
+def branch_names(branches: int) -> List[str]:
+    return [f"rhel-9.{idx}.0" for idx in range(branches)]
+
+
+def random_text(rnd: random.Random, size: int) -> str:
+    line = 79
+    chars = string.ascii_letters + string.digits + " "
+    return "".join(
+        "".join(rnd.choice(chars) for _ in range(line)) + "\n"
+        for _ in range(max(size // (line + 1), 1))
+    )
+
+
+def create_upstream_template(work_dir: Path, files: int, file_size: int, seed: int):
+    work_dir.mkdir(parents=True)
+    git("init", "-q", "-b", "main", cwd=work_dir)
+    rnd = random.Random(seed)
+    (work_dir / "README.md").write_text("Benchmark upstream repository\n")
+    for idx in range(files):
+        path = work_dir / "src" / f"dir-{idx % 10}" / f"file-{idx:05d}.txt"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(random_text(rnd, file_size))
+    git("add", "-A", cwd=work_dir)
+    git("commit", "-q", "-m", "Initial upstream content", cwd=work_dir)
+
+
+def create_downstream_template(work_dir: Path, branches: List[str], image_url: str):
+    work_dir.mkdir(parents=True)
+    git("init", "-q", "-b", "main", cwd=work_dir)
+    (work_dir / "README.md").write_text("Benchmark downstream repository\n")
+    git("add", "-A", cwd=work_dir)
+    git("commit", "-q", "-m", "Initial downstream content", cwd=work_dir)
+    # betka reads image_url from the top level of bot-cfg.yml
+    bot_cfg = BOT_CFG.format(image_url=f"image_url: {image_url}\n" if image_url else "")
+    for branch in branches:
+        git("checkout", "-q", "-b", branch, "main", cwd=work_dir)
+        (work_dir / "bot-cfg.yml").write_text(bot_cfg)
+        git("add", "bot-cfg.yml", cwd=work_dir)
+        git("commit", "-q", "-m", f"Enable betka in {branch}", cwd=work_dir)
+    git("checkout", "-q", "main", cwd=work_dir)
+
+
+def create_fleet(
+    root: Path,
+    images: int,
+    branches: int,
+    files: int,
+    file_size: int,
+    image_url: str = "",
+    seed: int = 0,
+) -> BenchFleet:
+    """
+    Creates `images` upstream repositories with `files` files of `file_size` bytes
+    and downstream repositories with `branches` branches containing bot-cfg.yml.
+    Every upstream repository has its own last commit, so each sync has changes.
+    :param image_url: generator image written into bot-cfg.yml, the source is copied if empty
+    """
+    names = image_names(images)
+    branch_list = branch_names(branches)
+    upstream_template = root / "templates" / "upstream"
+    downstream_template = root / "templates" / "downstream"
+    create_upstream_template(upstream_template, files, file_size, seed)
+    create_downstream_template(downstream_template, branch_list, image_url)
+    upstream_urls: Dict[str, str] = {}
+    upstream_heads: Dict[str, str] = {}
+    for name in names:
+        upstream_repo = root / "upstream" / f"{name}-container"
+        git("clone", "-q", "--bare", str(upstream_template), str(upstream_repo), cwd=root)
+        (upstream_template / "IMAGE").write_text(f"{name}\n")
+        git("add", "IMAGE", cwd=upstream_template)
+        git("commit", "-q", "-m", f"Update {name}", cwd=upstream_template)
+        git("push", "-q", "--force", str(upstream_repo), "HEAD:main", cwd=upstream_template)
+        upstream_heads[name] = git("rev-parse", "HEAD", cwd=upstream_template)
+        git("reset", "-q", "--hard", "HEAD~1", cwd=upstream_template)
+        upstream_urls[name] = f"{UPSTREAM_URL}{name}-container"
+        downstream_repo = root / "downstream" / f"{name}.git"
+        git("clone", "-q", "--bare", str(downstream_template), str(downstream_repo), cwd=root)
+    return BenchFleet(root, names, branch_list, upstream_urls, upstream_heads)
+
+
+def git_config_env(root: Path, namespace: str) -> Dict[str, str]:
+    """
+    Environment rewriting upstream and downstream URLs to the local repositories.
+    It is used instead of ~/.gitconfig, which is overwritten by betka.
+    """
+    rewrites = {
+        f"file://{root}/upstream/": UPSTREAM_URL,
+        f"file://{root}/downstream/": DOWNSTREAM_URL.format(namespace=namespace),
+    }
+    env = {"GIT_CONFIG_COUNT": str(len(rewrites))}
+    for idx, (base, url) in enumerate(rewrites.items()):
+        env[f"GIT_CONFIG_KEY_{idx}"] = f"url.{base}.insteadOf"
+        env[f"GIT_CONFIG_VALUE_{idx}"] = url
+    return env
@@ -0,0 +1,421 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Replays upstream push messages into `task.betka.master_sync` against
+the local fleet and the fake GitHub, GitLab and Kubernetes servers.
+
+    python -m benchmarks.replay --images 20 --branches 3 --workers 4 --output results.json
+
+Tasks run in `--workers` processes without Celery broker and Redis,
+so the results contain only the time spent by betka itself.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+from benchmarks.fake_github import FakeGitHub
+from benchmarks.fake_gitlab import FakeGitLab
+from benchmarks.fake_kubernetes import FakeKubernetes
+from benchmarks.fixtures import BenchFleet, create_fleet, git_config_env
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+TASKS_DIR = REPO_DIR / "files" / "home"
+TEMPLATES_DIR = TASKS_DIR / "templates"
+
+NAMESPACE = "bench/containers"
+PROJECT = "betka-bench"
+GENERATOR_IMAGE = "quay.io/rhscl/cwt-generator:latest"
+MASTER_MSG = "[betka-master-sync]"
+
+# Set in worker processes by init_worker
+TASK = None
+RECORDERS: Dict[str, "Recorder"] = {}
+OUTBOX = None
+
+
+class Recorder(object):
+    """
+    Replaces a prometheus_client metric of betka.metrics in worker processes.
+    Observed values are kept per label values until `drain` is called.
+    """
+
+    def __init__(self):
+        self.values: Dict[str, List[float]] = defaultdict(list)
+
+    def labels(self, *args, **kwargs) -> "RecorderChild":
+        return RecorderChild(self, "/".join(str(x) for x in (*args, *kwargs.values())))
+
+    def drain(self) -> Dict[str, List[float]]:
+        values, self.values = dict(self.values), defaultdict(list)
+        return values
+
+
+class RecorderChild(object):
+    def __init__(self, recorder: Recorder, key: str):
+        self.recorder = recorder
+        self.key = key
+
+    def observe(self, amount: float):
+        self.recorder.values[self.key].append(amount)
+
+    def inc(self, amount: float = 1):
+        self.recorder.values[self.key].append(amount)
+
+
+def init_worker(env: Dict[str, str]):
+    """
+    Prepares the worker process. betka reads its environment on import,
+    so it is imported only here.
+    """
+    global TASK, OUTBOX
+    os.environ.update(env)
+    sys.path.insert(0, str(TASKS_DIR))
+
+    import tasks
+    from betka import global_config, metrics, notifications
+
+    class RecordingOutbox(notifications.NotificationOutbox):
+        def __init__(self):
+            super().__init__(url=None)
+            self.kinds: Counter = Counter()
+
+        def publish(self, kind: str, payload: Dict[str, Any]) -> bool:
+            self.kinds[kind] += 1
+            return True
+
+    for name in [
+        "STAGE_DURATION",
+        "API_REQUESTS",
+        "API_DURATION",
+        "GIT_DURATION",
+        "PUSH_TO_MR",
+        "LOG_MESSAGES",
+    ]:
+        RECORDERS[name] = Recorder()
+        setattr(metrics, name, RECORDERS[name])
+    OUTBOX = notifications.OUTBOX = RecordingOutbox()
+    global_config.GLOBAL_CONFIG.redis_url = None
+    # Results of eagerly applied tasks are not stored in Redis
+    tasks.app.conf.result_backend = "cache+memory://"
+    TASK = tasks.master_sync
+
+
+def run_message(message: Dict) -> Dict[str, Any]:
+    """
+    Runs one master sync in the worker process
+    :return: duration of the task and everything recorded during it
+    """
+    for recorder in RECORDERS.values():
+        recorder.drain()
+    OUTBOX.kinds.clear()
+    start = time.perf_counter()
+    result = TASK.apply(args=(message,))
+    duration = time.perf_counter() - start
+    return {
+        "image": message["body"]["repository"]["full_name"],
+        "duration": duration,
+        "error": repr(result.result) if result.failed() else None,
+        "metrics": {name: x.drain() for name, x in RECORDERS.items()},
+        "notifications": dict(OUTBOX.kinds),
+    }
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of sorted values
+    """
+    idx = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(idx, len(values) - 1)]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "total": sum(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.5),
+        "p90": percentile(values, 0.9),
+        "p99": percentile(values, 0.99),
+        "max": values[-1],
+    }
+
+
+def environment() -> Dict[str, Any]:
+    def output(*cmd) -> Optional[str]:
+        try:
+            return subprocess.check_output(
+                cmd, cwd=str(REPO_DIR), stderr=subprocess.DEVNULL, universal_newlines=True
+            ).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "git": output("git", "--version"),
+        "betka_commit": output("git", "rev-parse", "HEAD"),
+        "betka_dirty": bool(output("git", "status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def betka_stage_yaml(fleet: BenchFleet) -> str:
+    config = {
+        "name": "Benchmark configuration file for betka.",
+        "version": "1",
+        "api_key": "",
+        "synchronize_branches": fleet.branches,
+        "dist_git_repos": {x: {"url": fleet.upstream_urls[x]} for x in fleet.images},
+        "master_commit_message": "Upstream master commit hash {hash}",
+        "downstream_master_msg": MASTER_MSG,
+        "downstream_pr_msg": "[betka-pr-sync]",
+    }
+    return yaml.safe_dump(config, sort_keys=False)
+
+
+def config_json(args, github: FakeGitHub, gitlab: FakeGitLab) -> Dict[str, Any]:
+    """
+    config.json of the repository pointed to the fake servers
+    """
+    with open(REPO_DIR / "config.json") as config_file:
+        config = json.load(config_file)
+    config.update(
+        {
+            "betka_url_base": github.betka_url_base,
+            "gitlab_web_url": gitlab.url,
+            "gitlab_host_url": gitlab.url,
+            "gitlab_api_url": gitlab.api_url,
+            "gitlab_graphql_url": f"{gitlab.url}/api/graphql",
+            "gitlab_namespace": NAMESPACE,
+            "gitlab_preflight": args.preflight,
+            "generator_url": "",
+            "use_gitlab_forks": "False",
+            "ssh_multiplexing": "False",
+            "slack_webhook_url": "BENCH_SLACK_WEBHOOK_URL",
+        }
+    )
+    return config
+
+
+def create_message(fleet: BenchFleet, image: str) -> Dict:
+    repo = f"sclorg/{image}-container"
+    return {
+        "body": {
+            "ref": "refs/heads/main",
+            "after": fleet.upstream_heads[image],
+            "repository": {
+                "html_url": fleet.upstream_urls[image],
+                "full_name": repo,
+            },
+            "head_commit": {
+                "id": fleet.upstream_heads[image],
+                "message": f"Update {image}",
+                "author": {"name": "Betka Benchmark"},
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+            },
+            "commits": [],
+        }
+    }
+
+
+def aggregate(runs: List[Dict], wall_time: float) -> Dict[str, Any]:
+    metrics: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    notifications: Counter = Counter()
+    for run in runs:
+        notifications.update(run["notifications"])
+        for name, values in run["metrics"].items():
+            for key, observed in values.items():
+                metrics[name][key].extend(observed)
+    durations = [x["duration"] for x in runs]
+    return {
+        "wall_time": wall_time,
+        "throughput": len(runs) / wall_time if wall_time else 0,
+        "sync": summarize(durations),
+        "stages": {k: summarize(v) for k, v in sorted(metrics["STAGE_DURATION"].items())},
+        "api": {k: summarize(v) for k, v in sorted(metrics["API_DURATION"].items())},
+        "api_requests": {k: len(v) for k, v in sorted(metrics["API_REQUESTS"].items())},
+        "git": {k: summarize(v) for k, v in sorted(metrics["GIT_DURATION"].items())},
+        "push_to_mr": summarize(
+            [x for values in metrics["PUSH_TO_MR"].values() for x in values]
+        ),
+        "log_messages": {k: len(v) for k, v in sorted(metrics["LOG_MESSAGES"].items())},
+        "notifications": dict(notifications),
+        "errors": [{"image": x["image"], "error": x["error"]} for x in runs if x["error"]],
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="betka-bench-"))
+    home = workdir / "home"
+    home.mkdir(parents=True, exist_ok=True)
+    logs = workdir / "logs"
+    logs.mkdir(exist_ok=True)
+    servers = []
+    try:
+        start = time.perf_counter()
+        fleet = create_fleet(
+            workdir / "fleet",
+            args.images,
+            args.branches,
+            args.files,
+            args.file_size,
+            image_url=GENERATOR_IMAGE if args.generator else "",
+        )
+        setup_time = time.perf_counter() - start
+
+        github = FakeGitHub({"betka-stage.yaml": betka_stage_yaml(fleet)})
+        gitlab = FakeGitLab(fleet.root / "downstream", NAMESPACE, fleet.images)
+        servers.extend([github, gitlab])
+        github.start()
+        gitlab.start()
+        env = {
+            "HOME": str(home),
+            "BETKA_CONFIG_JSON": str(workdir / "config.json"),
+            "BETKA_TEMPLATES": str(TEMPLATES_DIR),
+            "DEPLOYMENT": "test",
+            "DEVEL_MODE": "false",
+            "PROJECT": PROJECT,
+            "GITHUB_API_TOKEN": "bench-github-token",
+            "GITLAB_API_TOKEN": "bench-gitlab-token",
+            "GITLAB_USER": "betka-bench",
+            "LOG_LEVEL": args.log_level,
+            "LOGS_DIR": str(logs),
+            **git_config_env(fleet.root, NAMESPACE),
+        }
+        if args.generator:
+            kubernetes = FakeKubernetes(pod_seconds=args.pod_seconds)
+            servers.append(kubernetes)
+            env["BETKA_KUBERNETES_API_URL"] = kubernetes.start()
+        with open(env["BETKA_CONFIG_JSON"], "w") as config_file:
+            json.dump(config_json(args, github, gitlab), config_file, indent=2)
+
+        images = [fleet.images[idx % len(fleet.images)] for idx in range(args.messages)]
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=get_context("spawn"),
+            initializer=init_worker,
+            initargs=(env,),
+        ) as executor:
+            # Workers import betka before the clock starts
+            list(executor.map(time.sleep, [0.1] * args.workers))
+            start = time.perf_counter()
+            runs = list(executor.map(run_message, [create_message(fleet, x) for x in images]))
+            wall_time = time.perf_counter() - start
+    finally:
+        for server in servers:
+            server.stop()
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "config": {
+            "images": args.images,
+            "branches": args.branches,
+            "files": args.files,
+            "file_size": args.file_size,
+            "messages": args.messages,
+            "workers": args.workers,
+            "preflight": args.preflight,
+            "generator": args.generator,
+            "pod_seconds": args.pod_seconds,
+        },
+        "environment": environment(),
+        "setup_time": setup_time,
+        **aggregate(runs, wall_time),
+        "merge_requests_created": gitlab.merge_requests_created,
+        "server_requests": {
+            type(x).__name__: dict(sorted(x.requests.items())) for x in servers
+        },
+    }
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.replay", description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument("--images", type=int, default=5, help="number of images in the fleet")
+    parser.add_argument("--branches", type=int, default=2, help="downstream branches per image")
+    parser.add_argument("--files", type=int, default=100, help="files in each upstream repository")
+    parser.add_argument("--file-size", type=int, default=4096, help="size of upstream files")
+    parser.add_argument(
+        "--messages", type=int, help="number of replayed messages, one per image by default"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument(
+        "--preflight", choices=["rest", "async", "graphql"], default="graphql",
+        help="gitlab_preflight mode of config.json",
+    )
+    parser.add_argument(
+        "--generator", action="store_true",
+        help="run the generator pod on the fake Kubernetes instead of copying the sources",
+    )
+    parser.add_argument(
+        "--pod-seconds", type=float, default=0, help="seconds a generator pod is running"
+    )
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL of betka")
+    parser.add_argument("--workdir", help="directory for the fleet, it is kept")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    parser.add_argument("--output", help="write JSON results into the file instead of stdout")
+    args = parser.parse_args(argv)
+    if args.messages is None:
+        args.messages = args.images
+    return args
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    results = run(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+    if results["errors"]:
+        print(f"{len(results['errors'])} of {args.messages} syncs failed", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
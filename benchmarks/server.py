@@ -0,0 +1,98 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import asyncio
+import threading
+
+from collections import Counter
+from typing import Optional
+
+from aiohttp import web
+
+# Endpoint of requests routed by the handler itself, see FakeServer.endpoint
+ENDPOINT_KEY = web.RequestKey("endpoint", str) if hasattr(web, "RequestKey") else "endpoint"
+
+
+class FakeServer(object):
+    """
+    aiohttp application served from a background thread of the benchmark driver.
+    Requests are counted per `<METHOD> <endpoint>`, see `endpoint`.
+    """
+
+    def __init__(self):
+        self.app = web.Application(middlewares=[self.count_requests])
+        self.requests: Counter = Counter()
+        self.url: Optional[str] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.runner: Optional[web.AppRunner] = None
+        self.thread: Optional[threading.Thread] = None
+        self.add_routes(self.app.router)
+
+    def add_routes(self, router: web.UrlDispatcher):
+        raise NotImplementedError
+
+    def endpoint(self, request: web.Request) -> str:
+        if ENDPOINT_KEY in request:
+            return request[ENDPOINT_KEY]
+        resource = request.match_info.route.resource
+        return resource.canonical if resource is not None else request.path
+
+    @web.middleware
+    async def count_requests(self, request: web.Request, handler):
+        try:
+            return await handler(request)
+        finally:
+            self.requests[f"{request.method} {self.endpoint(request)}"] += 1
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        :return: base URL of the server
+        """
+        started = threading.Event()
+
+        async def serve():
+            self.runner = web.AppRunner(self.app, access_log=None)
+            await self.runner.setup()
+            site = web.TCPSite(self.runner, host, port)
+            await site.start()
+            bound_port = self.runner.addresses[0][1]
+            self.url = f"http://{host}:{bound_port}"
+            started.set()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(serve())
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.runner.cleanup())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        started.wait()
+        return self.url
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
@@ -13,10 +13,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+
 from logging import CRITICAL, ERROR, WARNING, INFO, DEBUG
 
 from betka.config import fetch_config, load_configuration
 from betka.logger import Logger
+from betka.metrics import count_log
 
 
 class Bot:
@@ -34,7 +37,9 @@ class Bot:
         :param logger: if a Bot (subclass) instance wants to use differently configured Logger
         :param task_name: str, for logging purposes, name of task which created this Bot instance
         """
-        self.logger = logger or Logger(task_name=task_name, level=DEBUG)
+        self.logger = logger or Logger(
+            task_name=task_name, level=os.getenv("LOG_LEVEL", "DEBUG").upper()
+        )
         self.config = None
 
     def is_enabled(self, config_url=None, config_path=None):
@@ -71,6 +76,9 @@ class Bot:
         :param msg: message to log
         :param args: arguments to msg
         """
+        count_log(level)
+        if not self.logger.is_enabled_for(level):
+            return
         report_dict = {"message": self.logger.format(msg, args)}
         self.logger.log(level, report_dict)
 
@@ -0,0 +1,140 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import copy
+import hashlib
+import logging
+import yaml
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from jsonschema.validators import validator_for
+
+from betka.constants import BOT_CFG_CACHE_SIZE
+from betka.schemas import BotCfg
+
+try:
+    # libyaml based loader is much faster, it is not available everywhere
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+logger = logging.getLogger(__name__)
+
+
+def git_blob_sha(content: bytes) -> str:
+    """
+    Computes the same SHA as `git hash-object` does for the content
+    """
+    header = f"blob {len(content)}\0".encode()
+    return hashlib.sha1(header + content).hexdigest()
+
+
+class BotCfgLoader(object):
+    """
+    Parses and validates bot-cfg.yml once per git blob SHA.
+
+    Parsed configurations are kept in a bounded LRU cache shared by all
+    branches and images of the worker, so the same bot-cfg.yml is parsed
+    and validated exactly once. Callers get their own copy of the cached config.
+    """
+
+    _validator = None
+
+    def __init__(self, maxsize: int = BOT_CFG_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.cache: OrderedDict = OrderedDict()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    @classmethod
+    def validator(cls):
+        """
+        Validator compiled from BotCfg schema, it is compiled only once
+        """
+        if cls._validator is None:
+            schema = BotCfg.get_schema()
+            cls._validator = validator_for(schema)(schema)
+        return cls._validator
+
+    def __contains__(self, sha: str) -> bool:
+        return sha in self.cache
+
+    def validate(self, config: Dict) -> List[str]:
+        """
+        :return: list of validation error messages
+        """
+        if not isinstance(config, dict):
+            return ["bot-cfg.yml is not a mapping"]
+        return [
+            f"{'/'.join(str(x) for x in error.path)}: {error.message}"
+            for error in self.validator().iter_errors(config)
+        ]
+
+    def parse(self, content: str) -> Optional[Dict]:
+        """
+        Parses bot-cfg.yml.
+        :return: parsed config, None if it does not match the schema
+        """
+        config = yaml.load(content, Loader=SafeLoader)
+        errors = self.validate(config) if config else []
+        if errors:
+            logger.error(f"bot-cfg.yml does not match the schema: {errors}")
+            return None
+        return config
+
+    def load(self, content: Optional[str], sha: Optional[str] = None) -> Optional[Dict]:
+        """
+        Gets parsed bot-cfg.yml.
+        :param content: bot-cfg.yml content, can be None if it was already parsed
+        :param sha: git blob SHA of the content, computed if not known
+        :return: copy of parsed config, None if neither content nor parsed config
+                 is available or the config does not match the schema
+        """
+        if sha is None and content is not None:
+            sha = git_blob_sha(content.encode())
+        if sha in self.cache:
+            self.stats["hits"] += 1
+            self.cache.move_to_end(sha)
+            return copy.deepcopy(self.cache[sha])
+        if content is None:
+            return None
+        self.stats["misses"] += 1
+        config = self.parse(content)
+        if sha:
+            self.cache[sha] = config
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return copy.deepcopy(config)
+
+    def load_file(self, path: Path) -> Optional[Dict]:
+        """
+        Gets parsed bot-cfg.yml from the checked out repository
+        """
+        content = Path(path).read_bytes()
+        return self.load(content.decode(), sha=git_blob_sha(content))
+
+
+# Worker wide bot-cfg.yml cache
+BOT_CFG_LOADER = BotCfgLoader()
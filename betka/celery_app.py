@@ -14,11 +14,17 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from celery import Celery
+import logging
+
+from celery import Celery, signals
 from os import getenv
 from raven import Client
 from raven.contrib.celery import register_signal, register_logger_signal
 
+from betka import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
 
 def configure_sentry(dsn=None):
     dsn = dsn or getenv("SENTRY_DSN")
@@ -32,6 +38,66 @@ def configure_sentry(dsn=None):
     register_signal(client)
 
 
+def configure_metrics():
+    """
+    Hook Prometheus metrics into Celery signals.
+    See betka/metrics.py for details.
+    """
+    signals.before_task_publish.connect(metrics.on_before_task_publish, weak=False)
+    signals.task_received.connect(metrics.on_task_received, weak=False)
+    signals.task_prerun.connect(metrics.on_task_prerun, weak=False)
+    signals.task_success.connect(metrics.on_task_success, weak=False)
+    signals.task_failure.connect(metrics.on_task_failure, weak=False)
+    signals.worker_process_shutdown.connect(
+        metrics.on_worker_process_shutdown, weak=False
+    )
+
+
+def configure_tracing():
+    """
+    Propagate OpenTelemetry trace context through Celery task headers.
+    See betka/tracing.py for details.
+    """
+    signals.worker_process_init.connect(tracing.configure_tracer_provider, weak=False)
+    signals.before_task_publish.connect(tracing.on_before_task_publish, weak=False)
+    signals.task_prerun.connect(tracing.on_task_prerun, weak=False)
+    signals.task_failure.connect(tracing.on_task_failure, weak=False)
+    signals.task_postrun.connect(tracing.on_task_postrun, weak=False)
+    signals.worker_process_shutdown.connect(
+        tracing.on_worker_process_shutdown, weak=False
+    )
+
+
+def redis_url():
+    """
+    Redis URL taken from environment, shared by Celery and betka caches.
+    """
+    redis_host = getenv("REDIS_SERVICE_HOST", "redis")
+    redis_port = getenv("REDIS_SERVICE_PORT", "6379")
+    redis_db = getenv("REDIS_SERVICE_DB", "0")
+    return "redis://{host}:{port}/{db}".format(
+        host=redis_host, port=redis_port, db=redis_db
+    )
+
+
+def redis_client(url, fallback, **options):
+    """
+    Connects betka caches and queues to Redis.
+    :param url: Redis URL, see redis_url
+    :param fallback: logged when the redis module is not installed
+    :param options: passed to redis.Redis.from_url, like socket_timeout
+    :return: Redis client or None when Redis is not available
+    """
+    if not url:
+        return None
+    try:
+        import redis
+    except ImportError:
+        logger.info(f"redis module is not installed, {fallback}")
+        return None
+    return redis.Redis.from_url(url, **options)
+
+
 def celery_app(include=None):
     """
     Create Celery instance. Take broker/backend url from environment.
@@ -40,16 +106,13 @@ def celery_app(include=None):
     you don't need to specify anything in 'include'. But if the xyz is a package then you need to
     specify all modules from the package here.
     """
-    redis_host = getenv("REDIS_SERVICE_HOST", "redis")
-    redis_port = getenv("REDIS_SERVICE_PORT", "6379")
-    redis_db = getenv("REDIS_SERVICE_DB", "0")
-    redis_url = "redis://{host}:{port}/{db}".format(
-        host=redis_host, port=redis_port, db=redis_db
-    )
+    url = redis_url()
 
     # http://docs.celeryproject.org/en/latest/reference/celery.html#celery.Celery
-    return Celery(backend=redis_url, broker=redis_url, include=include)
+    return Celery(backend=url, broker=url, include=include)
 
 
 app = celery_app()
 configure_sentry()
+configure_metrics()
+configure_tracing()
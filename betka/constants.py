@@ -20,12 +20,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import os
 
 GIT_PATH = "/{u}/{n}/{r}/git/"
 PAGURE_NEW_PR = "/{u}/{n}/{r}/pull-request/new"
 NAME = "betka"
 HOME = "/home/{n}".format(n=NAME)
-TEMPLATES = "{h}/templates".format(h=HOME)
+# BETKA_TEMPLATES points to another template directory, e.g. in benchmarks
+TEMPLATES = os.getenv("BETKA_TEMPLATES", "{h}/templates".format(h=HOME))
 COMMIT_REPO = "UpstreamRepository: {repo}"
 COMMIT_MASTER_MSG = (
     "\n\nUpstreamCommitID: {hash}\n"
@@ -38,3 +40,104 @@ SYNCHRONIZE_BRANCHES = "synchronize_branches"
 SYNC_INTERVAL = 60 * 60 * 5
 
 RETRY_CREATE_POD = 10
+
+# Maximum number of parallel connections used by GitLab pre-flight lookups
+GITLAB_POOL_SIZE = 10
+# Timeout in seconds for a single GitLab pre-flight request
+GITLAB_REQUEST_TIMEOUT = 60
+# Number of projects aliased into one GitLab GraphQL query.
+# Keeps the query below GitLab's complexity limit.
+GITLAB_GRAPHQL_CHUNK = 10
+
+# Directory with SSH ControlMaster sockets
+SSH_CONTROL_DIR = "~/.ssh/control"
+# Keep the master connection open until the worker exits
+SSH_CONTROL_PERSIST = "yes"
+# Timeout in seconds of ssh control commands and remote URL lookups
+SSH_CONTROL_TIMEOUT = 60
+
+# Redis key of the cached global configuration
+GLOBAL_CONFIG_REDIS_KEY = "betka:global-config:{url}"
+# Cached global configuration is used during GitHub outage up to one day
+GLOBAL_CONFIG_MAX_STALE = 60 * 60 * 24
+# Redis pub/sub channel announcing a pushed global configuration
+GLOBAL_CONFIG_INVALIDATE_CHANNEL = "betka:global-config:invalidate"
+# Seconds to wait before the invalidation listener connects again
+GLOBAL_CONFIG_LISTENER_RETRY = 10
+# Global configuration files in the betka repository
+GLOBAL_CONFIG_FILES = ["betka-prod.yaml", "betka-stage.yaml"]
+# Number of parsed bot-cfg.yml files kept in memory
+BOT_CFG_CACHE_SIZE = 256
+
+# Number of repositories with a running git cat-file co-process
+CAT_FILE_POOL_SIZE = 4
+# Objects bigger than this are not read by git cat-file co-process
+CAT_FILE_MAX_OBJECT_SIZE = 10 * 1024 * 1024
+# Chunk used to drain skipped objects
+CAT_FILE_CHUNK = 64 * 1024
+
+# Number of output characters kept for each executed command
+COMMAND_OUTPUT_LIMIT = 64 * 1024
+# Seconds between SIGTERM and SIGKILL of a timed out command
+COMMAND_KILL_GRACE = 5
+# Seconds to wait for the rest of the output after the command exited.
+# A descendant, e.g. a daemonized ssh master, can keep the pipe open forever.
+COMMAND_OUTPUT_GRACE = 2
+# Wall-clock timeouts in seconds of git subcommands
+GIT_TIMEOUTS = {
+    "clone": 60 * 60,
+    "fetch": 30 * 60,
+    "push": 30 * 60,
+    "remote": 30 * 60,
+    "ls-remote": 5 * 60,
+}
+GIT_DEFAULT_TIMEOUT = 10 * 60
+
+# Upper bounds in seconds of git command duration histograms
+GIT_TIMING_BUCKETS = [0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, float("inf")]
+# Number of the slowest git commands logged by each task
+GIT_SLOWEST_KEPT = 20
+
+# Bare repository with objects of upstream submodules shared by all clones in the worker
+SUBMODULE_CACHE_DIR = "/var/tmp/betka-submodules.git"
+# Seconds after which a submodule URL is fetched into the cache again
+SUBMODULE_CACHE_REFRESH = 10 * 60
+# Number of submodules fetched in parallel
+SUBMODULE_JOBS = 4
+
+# Redis stream used as a durable outbox of emails and Slack messages
+NOTIFICATION_STREAM = "betka:notifications"
+# Consumer group of notification delivery workers
+NOTIFICATION_GROUP = "betka-notifiers"
+# Redis stream keeping notifications which could not be delivered
+NOTIFICATION_DEAD_LETTER_STREAM = "betka:notifications:dead"
+# Approximate maximum number of entries kept in the dead-letter stream
+NOTIFICATION_DEAD_LETTER_MAXLEN = 10000
+# Number of delivery attempts before the entry is moved into the dead-letter stream
+NOTIFICATION_MAX_DELIVERIES = 5
+# Celery queue and task delivering notifications from the outbox
+NOTIFICATION_QUEUE = "queue.betka.notifications"
+NOTIFICATION_TASK = "task.betka.deliver_notifications"
+# Number of outbox entries read at once
+NOTIFICATION_BATCH = 50
+# Seconds after which an undelivered entry is claimed by another delivery
+NOTIFICATION_CLAIM_IDLE = 5 * 60
+# Redis key set while a delivery retry of failed entries is scheduled
+NOTIFICATION_RETRY_KEY = "betka:notifications:retry"
+# Timeout in seconds of SMTP connections
+SMTP_TIMEOUT = 30
+
+# Directory with compiled bytecode of Jinja templates shared by worker processes
+TEMPLATE_BYTECODE_CACHE = "/var/tmp/betka-jinja-cache"
+
+# Port of the Prometheus exporter serving metrics of all worker processes
+METRICS_PORT = 8000
+# Upper bounds in seconds of sync stage duration histograms
+METRICS_STAGE_BUCKETS = [1, 5, 10, 30, 60, 120, 300, 600, 1200, 3600, float("inf")]
+# Upper bounds in seconds of API call duration histograms
+METRICS_API_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf")]
+# Upper bounds in seconds of queue wait and push to merge request latency histograms
+METRICS_LATENCY_BUCKETS = [1, 10, 30, 60, 300, 600, 1800, 3600, 7200, 21600, float("inf")]
+
+# Name of the service in exported traces
+TRACING_SERVICE_NAME = "betka"
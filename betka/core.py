@@ -20,21 +20,22 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import logging
 import shutil
 import subprocess
 import os
 
 import yaml
-import time
 import traceback
 import requests
 
 from os import getenv
 from datetime import datetime
+from urllib.parse import urlparse
 from tempfile import TemporaryDirectory
 from pprint import pformat
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
 from betka.bot import Bot
 from betka.emails import BetkaEmails
@@ -43,17 +44,26 @@ from betka.git import Git
 from betka.github import GitHubAPI
 from betka.utils import copy_upstream2downstream
 from betka.gitlab import GitLabAPI
-from betka.constants import SYNCHRONIZE_BRANCHES
+from betka.global_config import GLOBAL_CONFIG
+from betka.fleet import Fleet, get_fleet
+from betka.bot_cfg import BOT_CFG_LOADER
+from betka.ssh import enable_multiplexing, get_multiplexer
+from betka.git_backend import close_backend, set_backend
+from betka.git_timing import GIT_TIMINGS
+from betka.digest import DIGEST
+from betka.template_registry import get_registry
+from betka.metrics import count_log, observe_push_to_mr, stage
+from betka.tracing import span
+from betka.constants import SYNCHRONIZE_BRANCHES, GLOBAL_CONFIG_FILES, DOWNSTREAM_CONFIG_FILE
 from betka.exception import BetkaNetworkException
 from betka.constants import (
     GENERATOR_DIR,
     COMMIT_MASTER_MSG,
     NAME,
     TEMPLATES,
-    SYNC_INTERVAL,
 )
-from betka.utils import FileUtils
-from betka.named_tuples import ProjectMR, ProjectFork, ProjectInfo
+from betka.utils import FileUtils, nested_get
+from betka.named_tuples import ProjectMR, ProjectFork, ProjectInfo, PreparedBranch
 
 
 requests.packages.urllib3.disable_warnings()
@@ -87,7 +97,6 @@ class Betka(Bot):
         self._github_api = self._gitlab_api = None
         self.upstream_message: str = None
         self.upstream_pr_comment: str = None
-        self.last_sync: int = 0
         self.headers = None
         self.betka_config: Dict = {}
         self.msg_artifact: Dict = {}
@@ -96,6 +105,8 @@ class Betka(Bot):
         self.readme_url = ""
         self.description = "Bot for syncing upstream to downstream"
         self.existing_mr: ProjectMR = None
+        # Git command timings are reported per task
+        GIT_TIMINGS.reset()
 
     def set_environment_variables(self):
         for variable in ["PROJECT", "DEVEL_MODE", "GITHUB_API_TOKEN", "GITLAB_USER", "GITLAB_API_TOKEN"]:
@@ -154,8 +165,12 @@ class Betka(Bot):
 
         :param level: logging level as defined in logging module
         :param msg: message to log
-        :param args: arguments to msg
+        :param args: arguments to msg, `betka.logger.lazy` arguments
+                     are evaluated only if the level is enabled
         """
+        count_log(level)
+        if not self.logger.is_enabled_for(level):
+            return
         report_dict: Dict = {
             "message": self.logger.format(msg, args),
             "upstream_hash": self.upstream_hash,
@@ -171,20 +186,15 @@ class Betka(Bot):
 
 
     def refresh_betka_yaml(self):
-        if time.time() > self.last_sync + SYNC_INTERVAL:
-            self.betka_config.update(self.get_betka_yaml_config())
-            self.last_sync = time.time()
+        self.betka_config.update(self.get_betka_yaml_config())
 
     def get_betka_yaml_config(self):
         """
         Get betka main configuration file
-        It is downloaded during betka start
+        It is shared by all tasks and refreshed once SYNC_INTERVAL expires
         :return: dict
         """
-        result = requests.get(self.betka_config["betka_yaml_url"], verify=False)
-        result.raise_for_status()
-        if result.status_code == 200:
-            return yaml.safe_load(result.text)
+        return GLOBAL_CONFIG.get(self.betka_config["betka_yaml_url"])
 
     @staticmethod
     def load_yaml_configuration(path):
@@ -195,14 +205,27 @@ class Betka(Bot):
         """
         return yaml.safe_load(open(path))
 
+    @stage("clone")
     def prepare_upstream_git(self):
         """
         Clone upstream git repository to self.upstream_cloned_dir
         :return:
         """
-        self.upstream_cloned_dir = Git.clone_repo(
-            self.msg_upstream_url, self.betka_tmp_dir.name
-        )
+        self.upstream_cloned_dir = None
+        if self.is_sparse_clone_enabled() and self.upstream_hash:
+            try:
+                self.upstream_cloned_dir = Git.sparse_clone_repo(
+                    self.msg_upstream_url, self.betka_tmp_dir.name, self.upstream_hash
+                )
+            except subprocess.CalledProcessError:
+                self.info("Sparse clone of %s failed, cloning the whole repository.",
+                          self.msg_upstream_url)
+                reponame = Git.strip_dot_git(self.msg_upstream_url.split("/")[-1])
+                shutil.rmtree(Path(self.betka_tmp_dir.name) / reponame, ignore_errors=True)
+        if self.upstream_cloned_dir is None:
+            self.upstream_cloned_dir = Git.clone_repo(
+                self.msg_upstream_url, self.betka_tmp_dir.name
+            )
         if self.upstream_cloned_dir is None:
             self.error("!!!! Cloning upstream repo %s FAILED.", self.msg_upstream_url)
             return False
@@ -278,7 +301,8 @@ class Betka(Bot):
                     subject=f"[betka-run-sync] Upstream path {ups_path} for {self.image} does not exist.",
                 )
                 return True
-            copy_upstream2downstream(src_parent, self.downstream_dir)
+            with stage("copy"):
+                copy_upstream2downstream(src_parent, self.downstream_dir)
         return True
 
     def slack_notification(self):
@@ -348,11 +372,13 @@ class Betka(Bot):
             return False
 
         # git {add,commit,push} all files in local dist-git repo
-        git_status = Git.git_add_all(
-            upstream_msg=self.upstream_message,
-            related_msg=Git.get_msg_from_jira_ticket(self.config),
-
-        )
+        with stage("commit"):
+            git_status = Git.git_add_all(
+                upstream_msg=self.upstream_message,
+                related_msg=Git.get_msg_from_jira_ticket(self.config),
+                # the diff is logged only when LOG_LEVEL of the bot is DEBUG
+                show_diff=self.logger.is_enabled_for(logging.DEBUG),
+            )
         if not git_status:
             self.info(
                f"There were no changes in the repository. Do not file a pull request."
@@ -365,19 +391,64 @@ class Betka(Bot):
             return False
         return True
 
-    def update_gitlab_merge_request(self, branch, origin_branch: str = ""):
-        self.debug(f"update_gitlab_merge_request: Devel mode is enabled: {self.betka_config['devel_mode']}")
+    def is_devel_mode(self) -> bool:
+        self.debug(f"Devel mode is enabled: {self.betka_config['devel_mode']}")
         if self.betka_config["devel_mode"] == "true":
             BetkaEmails.send_email(
                 text="Devel mode is enabled. See logs in devel project.",
                 receivers=["phracek@redhat.com"],
                 subject="[betka-devel] Devel mode is enabled.",
             )
+            return True
+        return False
+
+    def is_ssh_multiplexing_enabled(self) -> bool:
+        value = self.config_json.get("ssh_multiplexing", "false").lower()
+        return value in ["true", "yes"]
+
+    def is_branch_cleanup_enabled(self) -> bool:
+        value = self.config_json.get("cleanup_betka_branches", "false").lower()
+        return value in ["true", "yes"]
+
+    def is_sparse_clone_enabled(self) -> bool:
+        """
+        Upstream is fetched as a single commit without blobs
+        and only `upstream_git_path` of synced branches is checked out.
+        The generator gets the whole tree, so with `generator_url` set
+        only history and blob transfer are limited.
+        """
+        value = self.config_json.get("upstream_clone_mode", "full").lower()
+        return value == "sparse"
+
+    def extend_upstream_checkout(self):
+        """
+        Checks out `upstream_git_path` of the current branch in a sparse upstream clone.
+        The whole tree is checked out for betka-generator
+        or if upstream_git_path is not defined.
+        """
+        if not Git.is_sparse_checkout(self.upstream_cloned_dir):
+            return
+        ups_path = self.config.get("upstream_git_path")
+        if self._get_image_url() or not ups_path:
+            # the generator may read any file of the upstream repository
+            self.debug("Checking out the whole upstream tree.")
+            Git.sparse_checkout_disable(self.upstream_cloned_dir)
+        else:
+            Git.sparse_checkout_add(self.upstream_cloned_dir, [ups_path])
+
+    def is_batch_push_enabled(self) -> bool:
+        value = self.config_json.get("batch_push", "false").lower()
+        return value in ["true", "yes"]
+
+    def update_gitlab_merge_request(self, branch, origin_branch: str = ""):
+        if self.is_devel_mode():
             return False
-        description_msg = COMMIT_MASTER_MSG.format(
-            hash=self.upstream_hash, repo=self.repo
-        )
-        git_push_status = Git.git_push(fork_enabled=self.is_fork_enabled(), source_branch=branch)
+        with stage("push"):
+            git_push_status = Git.git_push(
+                fork_enabled=self.is_fork_enabled(),
+                source_branch=branch,
+                force_with_lease=self.is_reused_branch(self.existing_mr, branch),
+            )
         if not git_push_status:
             self.info(
                f"Pushing to dist-git was not successful {branch}. Original_branch {origin_branch}."
@@ -388,6 +459,50 @@ class Betka(Bot):
                 subject="[betka-push] Pushing was not successful.",
             )
             return False
+        self.file_gitlab_merge_request(branch=branch, origin_branch=origin_branch)
+        return True
+
+    def push_prepared_branches(self, prepared_branches: List[PreparedBranch]) -> bool:
+        """
+        Pushes commits of all prepared branches of the image in one atomic push
+        and files merge requests only after the push succeeded.
+        :param prepared_branches: branches committed locally by sync_to_downstream_branches
+        :return: True if branches were pushed, False otherwise
+        """
+        if self.is_devel_mode():
+            return False
+        branches = [x.branch for x in prepared_branches]
+        leased = [
+            x.branch for x in prepared_branches if self.is_reused_branch(x.existing_mr, x.branch)
+        ]
+        with stage("push"):
+            pushed = Git.git_push_atomic(
+                branches, set_upstream=not self.is_fork_enabled(), leased=leased
+            )
+        if not pushed:
+            self.info(f"Atomic push of branches {branches} to dist-git was not successful.")
+            BetkaEmails.send_email(
+                text=f"Atomic push of {branches} for {self.image} failed. "
+                f"None of the branches was updated. See logs from the bot.",
+                receivers=["phracek@redhat.com"],
+                subject="[betka-push] Pushing was not successful.",
+            )
+            return False
+        for prepared in prepared_branches:
+            self.downstream_git_branch = prepared.branch
+            self.downstream_git_origin_branch = prepared.origin_branch
+            self.existing_mr = prepared.existing_mr
+            self.config = prepared.config
+            self.file_gitlab_merge_request(
+                branch=prepared.branch, origin_branch=prepared.origin_branch
+            )
+        return True
+
+    @stage("merge_request")
+    def file_gitlab_merge_request(self, branch, origin_branch: str = ""):
+        description_msg = COMMIT_MASTER_MSG.format(
+            hash=self.upstream_hash, repo=self.repo
+        )
         # Prepare betka_schema used for sending mail and Pagure Pull Request
         # The function also checks if the downstream does not already contain pull request
         betka_schema = self.gitlab_api.file_merge_request(
@@ -397,8 +512,15 @@ class Betka(Bot):
             mr=self.existing_mr,
             origin_branch=origin_branch,
         )
+        observe_push_to_mr(self.image, nested_get(self.message, "head_commit", "timestamp"))
         self.send_result_email(betka_schema=betka_schema)
-        return True
+
+    @property
+    def fleet(self) -> Fleet:
+        return get_fleet(
+            self.betka_config["dist_git_repos"],
+            self.betka_config.get(SYNCHRONIZE_BRANCHES, []),
+        )
 
     def get_synced_images(self) -> Dict:
         """
@@ -406,15 +528,11 @@ class Betka(Bot):
         See betka.yaml for format.
         :return: dict of synced images in format image_name: project_id
         """
-        synced_images = {}
-        for key in self.betka_config["dist_git_repos"]:
-            values = self.betka_config["dist_git_repos"][key]
-            if values["url"] != self.msg_upstream_url:
-                continue
-            synced_images[key] = values
-            self.debug(f"Synced images {synced_images}.")
+        synced_images = self.fleet.get_images(self.msg_upstream_url)
+        self.debug(f"Synced images {synced_images}.")
         return synced_images
 
+    @stage("generator_pod")
     def deploy_image(self, image_url):
 
         # Sources are generated in another OpenShift POD
@@ -438,6 +556,41 @@ class Betka(Bot):
         copy_upstream2downstream(self.timestamp_dir / results_dir, self.downstream_dir)
         return True
 
+    def handle_global_config_push(self, message) -> bool:
+        """
+        Refreshes global configuration if the message is a push into
+        betka repository which changes betka-prod.yaml or betka-stage.yaml.
+        All workers are told to drop their copies.
+        :param message: fedmsg message
+        :return: True if the message was a global configuration push
+        """
+        body = message.get("body", {})
+        betka_url_base = FileUtils.load_config_json()["betka_url_base"]
+        # betka_url_base looks like https://github.com/<owner>/<repo>/raw/<branch>/
+        url_parts = urlparse(betka_url_base).path.strip("/").split("/")
+        if len(url_parts) < 4:
+            return False
+        owner, repo, _, branch = url_parts[:4]
+        if nested_get(body, "repository", "full_name") != f"{owner}/{repo}":
+            return False
+        if body.get("ref") != f"refs/heads/{branch}":
+            return False
+        changed = set()
+        for commit in body.get("commits", []):
+            for key in ["added", "modified", "removed"]:
+                changed.update(commit.get(key, []))
+        config_files = [x for x in GLOBAL_CONFIG_FILES if x in changed]
+        if not config_files:
+            return False
+        commit_url_base = betka_url_base.replace(f"/raw/{branch}/", f"/raw/{body['after']}/")
+        for config_file in config_files:
+            self.info(f"Global configuration {config_file} was changed by push {body['after']}")
+            GLOBAL_CONFIG.refresh(
+                f"{betka_url_base}{config_file}", f"{commit_url_base}{config_file}"
+            )
+        GLOBAL_CONFIG.publish_invalidate()
+        return True
+
     def get_master_fedmsg_info(self, message):
         """
         Parse fedmsg message and check for proper values.
@@ -517,6 +670,10 @@ class Betka(Bot):
             user_name=self.betka_config["gitlab_user"], user_email="non@existing"
         )
 
+        set_backend(self.config_json.get("git_backend", "subprocess"))
+        if self.is_ssh_multiplexing_enabled():
+            enable_multiplexing(urlparse(self.config_json["gitlab_host_url"]).hostname)
+
         if not self.mandatory_variables_set():
             return False
 
@@ -530,6 +687,7 @@ class Betka(Bot):
             return False
         return True
 
+    @stage("clone")
     def prepare_fork_downstream_git(self, project_fork: ProjectFork) -> bool:
 
         """
@@ -551,6 +709,7 @@ class Betka(Bot):
 
         return True
 
+    @stage("clone")
     def prepare_downstream_git(self, project_info: ProjectInfo) -> bool:
 
         """
@@ -596,10 +755,10 @@ class Betka(Bot):
         )
 
     def _get_bot_cfg(self, branch: str = "main") -> bool:
-        # Use bot-cfg.yml from cloned directory
-        with open(f"{str(self.downstream_dir)}/bot-cfg.yml") as stream:
-            self.config = yaml.safe_load(stream)
-        # self.config = self.gitlab_api.get_bot_cfg_yaml(branch=branch)
+        # Use bot-cfg.yml read before cloning, otherwise from cloned directory
+        self.config = self.gitlab_api.get_prefetched_bot_cfg(branch=branch)
+        if self.config is None:
+            self.config = BOT_CFG_LOADER.load_file(self.downstream_dir / DOWNSTREAM_CONFIG_FILE)
         self.debug(f"Downstream 'bot-cfg.yml' file '{self.config}'.")
         if not self.config:
             self.error(
@@ -621,10 +780,12 @@ class Betka(Bot):
         Delete synced and temporary directory
         """
         self.debug("Remove timestamp and upstream cloned directories.")
+        close_backend()
         self.delete_timestamp_dir()
         if self.upstream_cloned_dir.is_dir():
             shutil.rmtree(str(self.upstream_cloned_dir))
 
+    @stage("copy")
     def create_and_copy_timestamp_dir(self):
         """
         Creates self.timestamp_dir and copy upstream_dir into it
@@ -635,6 +796,7 @@ class Betka(Bot):
             f"{Git.get_reponame_from_git_url(self.msg_upstream_url)}"
         )
         self.timestamp_dir = Path(GENERATOR_DIR) / timestamp_id
+        self.extend_upstream_checkout()
         self._copy_cloned_upstream_dir()
 
     def _update_valid_branches(self):
@@ -649,6 +811,7 @@ class Betka(Bot):
         Git.sync_fork_with_upstream(branch_list_to_sync)
         return branch_list_to_sync
 
+    @stage("branch_discovery")
     def _get_valid_origin_branches(self, branch_list=None):
         if self.is_fork_enabled():
             all_branches = Git.get_valid_remote_branches()
@@ -680,136 +843,306 @@ class Betka(Bot):
         except subprocess.CalledProcessError:
             self.error(f"!!!! Cloning upstream repo {self.msg_upstream_url} FAILED")
             raise
+        prepared_branches: List[PreparedBranch] = []
+        synced_branches: List[str] = []
         for branch in valid_branches:
-            self.timestamp_dir: Path = None
-            if self.is_fork_enabled():
-                self.downstream_git_branch = branch
-                self.downstream_git_origin_branch = ""
-                Git.call_git_cmd(f"checkout {branch}", msg="Change downstream branch")
+            with span("betka.branch", image=self.image, branch=branch):
+                self._sync_branch(branch, prepared_branches, synced_branches)
+        if prepared_branches:
+            self.push_prepared_branches(prepared_branches)
+        if not self.is_fork_enabled() and self.is_branch_cleanup_enabled():
+            self.delete_orphaned_branches(keep=synced_branches)
+
+    def _sync_branch(
+        self,
+        branch: str,
+        prepared_branches: List[PreparedBranch],
+        synced_branches: List[str],
+    ):
+        """
+        Syncs the upstream repository into one downstream branch
+        :param branch: downstream branch to sync
+        :param prepared_branches: branches committed for the batch push
+        :param synced_branches: branches used by the current run
+        """
+        self.timestamp_dir: Path = None
+        self.set_sync_context(branch=branch)
+        if self.is_fork_enabled():
+            self.downstream_git_branch = branch
+            self.downstream_git_origin_branch = ""
+            Git.call_git_cmd(f"checkout {branch}", msg="Change downstream branch")
+        else:
+            self.downstream_git_origin_branch = branch
+            mr_branch = self.get_existing_mr_branch(branch)
+            if mr_branch:
+                # Existing merge request is updated, its branch is rebuilt
+                # on top of the target branch and pushed with --force-with-lease
+                self.downstream_git_branch = mr_branch
+                Git.call_git_cmd(
+                    f"checkout -B {self.downstream_git_branch} --track origin/{branch}",
+                    msg="Reuse the branch of the existing merge request"
+                )
             else:
                 self.downstream_git_branch = f"betka-{datetime.now().strftime('%Y%m%d%H%M%S')}-{branch}"
-                self.downstream_git_origin_branch = branch
                 Git.call_git_cmd(
                     f"checkout -b {self.downstream_git_branch} --track origin/{branch}",
                     msg="Create a new downstream branch"
                 )
-            try:
-                if not self._get_bot_cfg(branch=branch):
-                    self.error("Fetching bot-cfg.yaml failed.")
-                    BetkaEmails.send_email(
-                        text=f"Get 'bot-cfg.yml' for {self.image} and {branch} were not read properly or does not exist."
-                             f"by upstream2downstream-bot.\n"
-                             f"Inform phracek@redhat.com",
-                        receivers=["phracek@redhat.com"],
-                        subject=f"[betka-sync] Get 'bot-cfg' for {self.image} and {branch} does not exist or is wrong.",
+            synced_branches.append(self.downstream_git_branch)
+        try:
+            if not self._get_bot_cfg(branch=branch):
+                self.error("Fetching bot-cfg.yaml failed.")
+                BetkaEmails.send_email(
+                    text=f"Get 'bot-cfg.yml' for {self.image} and {branch} were not read properly or does not exist."
+                         f"by upstream2downstream-bot.\n"
+                         f"Inform phracek@redhat.com",
+                    receivers=["phracek@redhat.com"],
+                    subject=f"[betka-sync] Get 'bot-cfg' for {self.image} and {branch} does not exist or is wrong.",
+                )
+                return
+        except BetkaNetworkException as bne:
+            self.debug(f"Betka Network Exception: {bne}.")
+            return
+        except requests.exceptions.HTTPError as htpe:
+            self.debug(f"HTTPError: It looks like URL is not valid: {htpe}.")
+            return
+
+        # Gets repo url without .git for cloning
+        self.repo = Git.strip_dot_git(self.msg_upstream_url)
+        self.info("SYNCING UPSTREAM TO DOWNSTREAM.")
+        # if not self.config.get("master_checker"):
+        #     return
+        self.create_and_copy_timestamp_dir()
+        if self.sync_to_downstream_branches(
+            self.downstream_git_branch, self.downstream_git_origin_branch
+        ):
+            if self.is_batch_push_enabled():
+                # Commit is pushed later together with other branches of the image
+                prepared_branches.append(
+                    PreparedBranch(
+                        self.downstream_git_branch,
+                        self.downstream_git_origin_branch,
+                        self.existing_mr,
+                        self.config,
                     )
-                    continue
-            except BetkaNetworkException as bne:
-                self.debug(f"Betka Network Exception: {bne}.")
-                continue
-            except requests.exceptions.HTTPError as htpe:
-                self.debug(f"HTTPError: It looks like URL is not valid: {htpe}.")
-                continue
-
-            # Gets repo url without .git for cloning
-            self.repo = Git.strip_dot_git(self.msg_upstream_url)
-            self.info("SYNCING UPSTREAM TO DOWNSTREAM.")
-            # if not self.config.get("master_checker"):
-            #     continue
-            self.create_and_copy_timestamp_dir()
-            if self.sync_to_downstream_branches(
-                self.downstream_git_branch, self.downstream_git_origin_branch
-            ):
+                )
+            else:
                 self.update_gitlab_merge_request(
                     branch=self.downstream_git_branch,
                     origin_branch=self.downstream_git_origin_branch
                 )
-            self.delete_timestamp_dir()
+        self.delete_timestamp_dir()
+
+    def get_existing_mr_branch(self, branch: str) -> Optional[str]:
+        """
+        Gets source branch of the opened betka merge request against the branch.
+        :param branch: target branch of the merge request
+        :return: branch name or None if there is no betka merge request
+        """
+        mr = self.gitlab_api.check_gitlab_merge_requests(branch=branch, target_branch=branch)
+        if mr and mr.source_branch and mr.source_branch.startswith("betka-"):
+            self.info(f"Merge request {mr.iid} exists, reusing branch {mr.source_branch}")
+            return mr.source_branch
+        return None
+
+    @staticmethod
+    def is_reused_branch(mr: ProjectMR, branch: str) -> bool:
+        return mr is not None and mr.source_branch == branch
+
+    def delete_orphaned_branches(self, keep: List[str]):
+        """
+        Deletes betka branches left behind by closed merge requests
+        :param keep: branches used by the current run
+        """
+        if self.betka_config["devel_mode"] == "true":
+            return
+        orphaned = self.gitlab_api.get_orphaned_branches(keep=keep)
+        if not orphaned:
+            return
+        self.info(f"Deleting orphaned branches {orphaned} from {self.image}")
+        if not Git.delete_remote_branches(orphaned):
+            self.info(f"Deleting orphaned branches from {self.image} failed.")
+
+    def log_git_timings(self):
+        """
+        Appends histograms of git command durations and the slowest
+        git commands of this task to the JSON log.
+        See `python -m betka.git_report` for the summary over all tasks.
+        """
+        report_dict = {"message": "Git command timings"}
+        report_dict.update(GIT_TIMINGS.report())
+        self.logger.log(logging.INFO, report_dict)
+
+    def set_sync_context(self, **kwargs):
+        """
+        Image and branch being synced, used by git timings and the notification digest.
+        """
+        GIT_TIMINGS.set_context(**kwargs)
+        DIGEST.set_context(**kwargs)
+
+    def is_digest_enabled(self) -> bool:
+        value = self.config_json.get("notification_digest", "false").lower()
+        return value in ["true", "yes"]
+
+    def send_notification_digest(self):
+        """
+        Sends emails and Slack messages collected during the sync run
+        """
+        DIGEST.stop()
+        for email, receivers in DIGEST.emails():
+            BetkaEmails.send_email(
+                text=email.text,
+                receivers=receivers,
+                subject=email.subject,
+                sender=email.sender,
+                smtp_server=email.smtp_server,
+            )
+        for url, message in DIGEST.slack_messages():
+            SlackNotifications.send_webhook_notification(url=url, message=message)
+
+    def log_template_timings(self):
+        """
+        Appends render timings of email templates of this worker to the JSON log.
+        """
+        report_dict = {"message": "Template render timings"}
+        report_dict["template_timings"] = get_registry().report()
+        self.logger.log(logging.INFO, report_dict)
 
     def run_sync(self):
         """
         Execute betka either for master sync from upstream repository into a downstream dist-git
         repository or pull request sync from upstream pull request into a downstream pull request
         """
+        if self.is_digest_enabled():
+            DIGEST.start(title=self.msg_upstream_url)
         try:
-            self._run_sync()
+            with span("betka.sync", upstream=self.msg_upstream_url, commit=self.upstream_hash):
+                self._run_sync()
         except Exception as ex:
             text = (
                 f"{str(traceback.format_exc())}\n"
                 f"Locals:\n{pformat(locals())}\nGlobals:\n{pformat(globals())}"
             )
             raise ex
+        finally:
+            if DIGEST.active:
+                self.send_notification_digest()
 
-    def _run_sync(self):
-        self.refresh_betka_yaml()
-        list_synced_images = self.get_synced_images()
-        if list_synced_images:
-            self.debug(f"Let's sync these images {list_synced_images}")
-        for self.image, values in list_synced_images.items():
-            self.gitlab_api.set_variables(image=self.image)
-            # Checks if gitlab already contains a fork for the image self.image
-            # The image name is defined in the betka.yaml configuration file
-            # variable dist_git_repos
+    def _get_branch_list(self, image: str) -> List[str]:
+        """
+        Branches to synchronize for the image.
+        Image specific `synchronize_branches` overrides the global one.
+        :param image: image name from dist_git_repos
+        """
+        return self.fleet.get_branches(image)
 
-            try:
-                project_id = self.gitlab_api.get_project_id_from_url()
-            except requests.exceptions.HTTPError as htpe:
+    def _sync_image(self, values):
+        """
+        Syncs the upstream repository into all branches of the image self.image
+        :param values: configuration of the image from dist_git_repos
+        """
+        self.gitlab_api.set_variables(image=self.image)
+        self.set_sync_context(image=self.image, branch=None)
+        # Checks if gitlab already contains a fork for the image self.image
+        # The image name is defined in the betka.yaml configuration file
+        # variable dist_git_repos
+
+        try:
+            project_id = self.gitlab_api.get_project_id_from_url()
+        except requests.exceptions.HTTPError as htpe:
+            BetkaEmails.send_email(
+                text=f"Get project from URL {self.image} were not successful"
+                f"by upstream2downstream-bot. See {values} {htpe.response}\n"
+                f"Inform phracek@redhat.com",
+                receivers=["phracek@redhat.com"],
+                subject=f"[betka-sync] Get project from URL project {self.image} were not successful.",
+            )
+            return
+        branch_list = self._get_branch_list(self.image)
+        # Branches with bot-cfg.yml are known before cloning, if it was read remotely
+        eligible_branches = self.gitlab_api.get_eligible_branches(branch_list)
+        if eligible_branches is not None:
+            if not eligible_branches:
+                self.info(
+                    f"{self.image} does not contain any branch with bot-cfg.yml file. "
+                    f"Skipping clone of downstream repository."
+                )
+                return
+            branch_list = eligible_branches
+        if self.is_fork_enabled():
+            self.gitlab_api.init_projects()
+            project_fork = self.gitlab_api.check_and_create_fork()
+            if not project_fork:
                 BetkaEmails.send_email(
-                    text=f"Get project from URL {self.image} were not successful"
-                    f"by upstream2downstream-bot. See {values} {htpe.response}\n"
+                    text=f"Fork for project {self.image} were not successful"
+                    f"by upstream2downstream-bot. See {values}\n"
                     f"Inform phracek@redhat.com",
                     receivers=["phracek@redhat.com"],
-                    subject=f"[betka-sync] Get project from URL project {self.image} were not successful.",
+                    subject=f"[betka-sync] Fork for project {self.image} were not successful.",
                 )
-                continue
-            branch_list = values.get(SYNCHRONIZE_BRANCHES) if SYNCHRONIZE_BRANCHES in values else self.betka_config.get(SYNCHRONIZE_BRANCHES, [])
-            if self.is_fork_enabled():
-                self.gitlab_api.init_projects()
-                project_fork = self.gitlab_api.check_and_create_fork()
-                if not project_fork:
-                    BetkaEmails.send_email(
-                        text=f"Fork for project {self.image} were not successful"
-                        f"by upstream2downstream-bot. See {values}\n"
-                        f"Inform phracek@redhat.com",
-                        receivers=["phracek@redhat.com"],
-                        subject=f"[betka-sync] Fork for project {self.image} were not successful.",
-                    )
-                    continue
-                self.ssh_url_to_repo = project_fork.ssh_url_to_repo
-                self.debug(f"Clone URL is: {self.ssh_url_to_repo}")
-                os.chdir(self.betka_tmp_dir.name)
-                if not self.prepare_fork_downstream_git(project_fork):
-                    continue
-                branch_list_to_sync = self._update_valid_remote_branches(branch_list=branch_list)
-            else:
-                self.gitlab_api.init_projects()
-                project_info = self.gitlab_api.get_project_info()
-                self.ssh_url_to_repo = project_info.ssh_url_to_repo
-                self.debug(f"Clone URL is: {self.ssh_url_to_repo}")
-                os.chdir(self.betka_tmp_dir.name)
-                if not self.prepare_downstream_git(project_info):
-                    continue
-                branch_list_to_sync = self._get_valid_origin_branches(branch_list=branch_list)
-            self.info(
-                f"Trying to sync image {self.image} to GitLab project_id {self.gitlab_api.project_id}."
-            )
+                return
+            self.ssh_url_to_repo = project_fork.ssh_url_to_repo
+            self.debug(f"Clone URL is: {self.ssh_url_to_repo}")
+            os.chdir(self.betka_tmp_dir.name)
+            if not self.prepare_fork_downstream_git(project_fork):
+                return
+            branch_list_to_sync = self._update_valid_remote_branches(branch_list=branch_list)
+        else:
+            self.gitlab_api.init_projects()
+            project_info = self.gitlab_api.get_project_info()
+            self.ssh_url_to_repo = project_info.ssh_url_to_repo
+            self.debug(f"Clone URL is: {self.ssh_url_to_repo}")
+            os.chdir(self.betka_tmp_dir.name)
+            if not self.prepare_downstream_git(project_info):
+                return
+            branch_list_to_sync = self._get_valid_origin_branches(branch_list=branch_list)
+        self.info(
+            f"Trying to sync image {self.image} to GitLab project_id {self.gitlab_api.project_id}."
+        )
 
-            valid_branches = Git.get_valid_branches(
-                self.image, self.downstream_dir, branch_list_to_sync
-            )
+        if eligible_branches is None:
+            with stage("branch_discovery"):
+                valid_branches = Git.get_valid_branches(
+                    self.image, self.downstream_dir, branch_list_to_sync
+                )
+        else:
+            valid_branches = branch_list_to_sync
 
-            if not valid_branches:
-                msg = "There are no valid branches with bot-cfg.yaml file"
-                self.info(msg)
-                if self.downstream_dir.is_dir():
-                    shutil.rmtree(str(self.downstream_dir))
-                continue
+        if not valid_branches:
+            msg = "There are no valid branches with bot-cfg.yaml file"
+            self.info(msg)
+            if self.downstream_dir.is_dir():
+                shutil.rmtree(str(self.downstream_dir))
+            return
 
-            try:
-                self._sync_valid_branches(valid_branches)
-            finally:
-                self.delete_cloned_directories()
+        try:
+            self._sync_valid_branches(valid_branches)
+        finally:
+            self.delete_cloned_directories()
+
+    def _run_sync(self):
+        self.refresh_betka_yaml()
+        list_synced_images = self.get_synced_images()
+        if list_synced_images:
+            self.debug(f"Let's sync these images {list_synced_images}")
+            images_branches = {
+                image: self._get_branch_list(image)
+                for image in list_synced_images
+            }
+            # All per-image GitLab lookups are done concurrently before any git work
+            self.gitlab_api.load_preflight(images_branches)
+            self.gitlab_api.load_bot_cfgs(images_branches)
+        for self.image, values in list_synced_images.items():
+            with span("betka.image", image=self.image):
+                self._sync_image(values)
+
+        multiplexer = get_multiplexer()
+        if multiplexer is not None:
+            self.info(multiplexer.report())
+        self.log_git_timings()
+        self.log_template_timings()
 
+        close_backend()
         # Deletes temporary directory.
         # It is created during each upstream2downstream task.
         if Path(self.betka_tmp_dir.name).is_dir():
@@ -0,0 +1,141 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import logging
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import jinja2
+
+from betka.constants import NAME, TEMPLATES
+from betka.named_tuples import DigestEvent
+from betka.template_registry import get_registry
+
+logger = logging.getLogger(__name__)
+
+# Image of notifications not related to any image
+GENERAL = "general"
+
+
+class NotificationDigest(object):
+    """
+    Collects emails and Slack messages of one sync run while it is active.
+    At the end of the run every recipient gets one email with all
+    their notifications grouped by image and branch, and every Slack
+    webhook gets one aggregated message.
+    """
+
+    def __init__(self, template_dir: str = TEMPLATES):
+        self.template_dir = template_dir
+        self.active = False
+        self.title = ""
+        self.context: Dict[str, Optional[str]] = {"image": None, "branch": None}
+        self.events: List[DigestEvent] = []
+        self.receivers: Dict[str, List[DigestEvent]] = {}
+        self.slack: Dict[str, List[str]] = {}
+
+    def start(self, title: str):
+        self.__init__(self.template_dir)
+        self.title = title
+        self.active = True
+
+    def stop(self):
+        self.active = False
+
+    def set_context(self, **kwargs):
+        """
+        Tags the following notifications, e.g. set_context(image="s2i-base", branch=None)
+        """
+        self.context.update(kwargs)
+
+    def add_email(self, text: str, receivers: List[str], subject: str, sender: str, smtp_server: str):
+        event = DigestEvent(
+            self.context.get("image"),
+            self.context.get("branch"),
+            subject,
+            text,
+            sender,
+            smtp_server,
+        )
+        self.events.append(event)
+        for receiver in receivers:
+            self.receivers.setdefault(receiver, []).append(event)
+
+    def add_slack(self, url: str, message: str):
+        self.slack.setdefault(url, []).append(message)
+
+    @staticmethod
+    def group_events(events: List[DigestEvent]) -> Dict[str, Dict[str, List[DigestEvent]]]:
+        groups: Dict[str, Dict[str, List[DigestEvent]]] = {}
+        for event in events:
+            groups.setdefault(event.image or GENERAL, {}).setdefault(
+                event.branch or "", []
+            ).append(event)
+        return groups
+
+    def render(self, events: List[DigestEvent]) -> str:
+        try:
+            return get_registry(self.template_dir).render(
+                "digest_template",
+                template_data={
+                    "title": self.title,
+                    "count": len(events),
+                    "groups": self.group_events(events),
+                },
+            )
+        except jinja2.TemplateError as te:
+            # notifications must not be lost because of the template
+            logger.error(f"Rendering digest_template failed: {te!r}")
+            return "\n\n".join(f"* {x.subject}\n{x.text}" for x in events)
+
+    def emails(self) -> Iterator[Tuple[DigestEvent, List[str]]]:
+        """
+        Yields one email per recipient. A single notification is sent as it is.
+        Recipients getting the same notifications share one email.
+        :return: iterator of (DigestEvent with the email, receivers)
+        """
+        by_events: Dict[Tuple[int, ...], List[str]] = {}
+        for receiver, events in self.receivers.items():
+            key = tuple(id(event) for event in events)
+            by_events.setdefault(key, []).append(receiver)
+        for receivers in by_events.values():
+            events = self.receivers[receivers[0]]
+            if len(events) == 1:
+                yield events[0], receivers
+                continue
+            yield DigestEvent(
+                None,
+                None,
+                f"[{NAME}] Sync digest of {self.title}: {len(events)} notifications",
+                self.render(events),
+                events[0].sender,
+                events[0].smtp_server,
+            ), receivers
+
+    def slack_messages(self) -> Iterator[Tuple[str, str]]:
+        for url, messages in self.slack.items():
+            yield url, "\n".join(messages)
+
+
+# Digest of the sync run executed by this worker
+DIGEST = NotificationDigest()
@@ -1,9 +1,10 @@
 from logging import getLogger
-from smtplib import SMTP
 from email.mime.multipart import MIMEMultipart
 from email.utils import formatdate
 from email.mime.text import MIMEText
 
+from betka.digest import DIGEST
+from betka.notifications import notify
 from betka.utils import text_from_template
 
 logger = getLogger(__name__)
@@ -17,13 +18,20 @@ class BetkaEmails(object):
     @staticmethod
     def send_email(text, receivers, subject, sender="phracek@redhat.com", smtp_server="smtp.redhat.com"):
         """
-        Send an email from SENDER_EMAIL to all provided receivers
+        Send an email from SENDER_EMAIL to all provided receivers.
+        The email is stored into the notification outbox and sent
+        by the notification worker, the caller does not wait for SMTP.
+        During a sync run the email is collected into the run digest.
         :param text: string, body of email
         :param receivers: list, email receivers
         :param subject: string, email subject
         :param sender: string, sender email
         :param smtp_server: string, smtp server hostname
         """
+        if DIGEST.active:
+            logger.info("Adding email '%s' to the digest for: %s", subject, str(receivers))
+            DIGEST.add_email(text, receivers, subject, sender, smtp_server)
+            return
         logger.info("Sending email to: %s", str(receivers))
 
         msg = MIMEMultipart()
@@ -33,7 +41,12 @@ class BetkaEmails(object):
         msg["Subject"] = subject
         msg.attach(MIMEText(text))
 
-        smtp = SMTP(smtp_server)
-        smtp.sendmail(sender, receivers, msg.as_string())
-        smtp.close()
-        logger.debug("Email sent")
+        notify(
+            "email",
+            {
+                "sender": sender,
+                "receivers": receivers,
+                "message": msg.as_string(),
+                "smtp_server": smtp_server,
+            },
+        )
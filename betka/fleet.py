@@ -0,0 +1,121 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import logging
+
+from collections import defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from betka.constants import SYNCHRONIZE_BRANCHES
+from betka.git import Git
+from betka.named_tuples import FleetImage
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_url(url: str) -> Optional[str]:
+    """
+    Normalizes repository URL, so different spellings of the same repository match.
+    https://www.github.com/sclorg/s2i-base-container.git,
+    git@github.com:sclorg/s2i-base-container and
+    github.com/sclorg/s2i-base-container/ -> github.com/sclorg/s2i-base-container
+    :return: normalized URL or None for an empty URL
+    """
+    if not url:
+        return None
+    url = url.strip().lower()
+    # git@host:owner/repo -> ssh://git@host/owner/repo
+    if "://" not in url and "@" in url and ":" in url:
+        url = "ssh://" + url.replace(":", "/", 1)
+    if "://" not in url:
+        url = "https://" + url
+    parsed = urlparse(url)
+    host = parsed.hostname or ""
+    if host.startswith("www."):
+        host = host[len("www."):]
+    path = parsed.path.strip("/")
+    if path.endswith(".git"):
+        path = path[: -len(".git")]
+    return f"{host}/{path}"
+
+
+class Fleet(object):
+    """
+    Compiled `dist_git_repos` section of betka global configuration.
+    Images are indexed by normalized upstream URL and have their
+    `synchronize_branches` resolved against the global default.
+    """
+
+    def __init__(self, dist_git_repos: Dict, default_branches: List[str]):
+        self.dist_git_repos = dist_git_repos
+        self.default_branches = default_branches
+        self.images: Dict[str, FleetImage] = {}
+        self.by_url: Dict[str, List[str]] = defaultdict(list)
+        for name, values in dist_git_repos.items():
+            url = values.get("url", "")
+            owner_repo = Git.parse_git_repo(url) or (None, None)
+            image = FleetImage(
+                name=name,
+                url=url,
+                normalized_url=normalize_url(url),
+                owner=owner_repo[0],
+                repo=owner_repo[1],
+                synchronize_branches=values.get(SYNCHRONIZE_BRANCHES, default_branches),
+                values=values,
+            )
+            self.images[name] = image
+            self.by_url[image.normalized_url].append(name)
+        logger.debug(f"Fleet with {len(self.images)} images compiled.")
+
+    def get_images(self, url: str) -> Dict[str, Dict]:
+        """
+        Gets images synced from the upstream repository
+        :param url: upstream repository URL in any spelling
+        :return: dict in format image: values from dist_git_repos
+        """
+        return {
+            name: self.images[name].values
+            for name in self.by_url.get(normalize_url(url), [])
+        }
+
+    def get_branches(self, image: str) -> List[str]:
+        return self.images[image].synchronize_branches
+
+
+_FLEET: Optional[Fleet] = None
+
+
+def get_fleet(dist_git_repos: Dict, default_branches: List[str]) -> Fleet:
+    """
+    Returns the compiled fleet, it is compiled again only when
+    the global configuration was reloaded.
+    """
+    global _FLEET
+    if (
+        _FLEET is None
+        or _FLEET.dist_git_repos is not dist_git_repos
+        or _FLEET.default_branches != default_branches
+    ):
+        _FLEET = Fleet(dist_git_repos, default_branches)
+    return _FLEET
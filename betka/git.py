@@ -19,16 +19,30 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import hashlib
+import shlex
 import subprocess
+import time
 
+from functools import lru_cache
 from urllib.parse import urlparse
-from logging import getLogger
+from logging import DEBUG, getLogger
 from pathlib import Path
 from subprocess import CalledProcessError
-from typing import Dict, List
-
-from betka.utils import run_cmd
-from betka.constants import DOWNSTREAM_CONFIG_FILE
+from typing import Dict, List, Optional
+
+from betka.logger import lazy
+from betka.tracing import span
+from betka.utils import run_argv, run_cmd
+from betka import git_backend, git_timing, ssh
+from betka.constants import (
+    DOWNSTREAM_CONFIG_FILE,
+    GIT_DEFAULT_TIMEOUT,
+    GIT_TIMEOUTS,
+    SUBMODULE_CACHE_DIR,
+    SUBMODULE_CACHE_REFRESH,
+    SUBMODULE_JOBS,
+)
 
 logger = getLogger(__name__)
 
@@ -59,28 +73,32 @@ class Git(object):
         return msg
 
     @staticmethod
-    def git_add_all(upstream_msg: str, related_msg: str) -> bool:
+    def git_add_all(upstream_msg: str, related_msg: str, show_diff: bool = False) -> bool:
         """
         Add and push all files into the fork.
         :param upstream_msg:
         :param related_msg:
+        :param show_diff: log the diff of the changes, it can be large
         :param fork_enabled:
         :param source_branch:
         """
-        git_show_status = Git.call_git_cmd(
-           "diff HEAD", ignore_error=True, msg="Check git status"
-        )
-        logger.debug(f"Show git diff {git_show_status}")
+        if show_diff and logger.isEnabledFor(DEBUG):
+            git_show_status = Git.call_git_cmd(
+                "diff HEAD", ignore_error=True, msg="Check git status"
+            )
+            logger.debug(f"Show git diff {git_show_status}")
         Git.call_git_cmd("add -A", msg="Add all")
 
         upstream_msg += f"\n{related_msg}\n"
         try:
             upstream_msg = Git.update_upstream_msg(upstream_msg)
-            commit_msg = " ".join(
-                [f"-m '{msg}'" for msg in upstream_msg.split("\n") if msg != ""]
-            )
+            # every line is passed as a separate argument, no quoting is needed
+            commit_args = ["commit"]
+            for msg in upstream_msg.split("\n"):
+                if msg != "":
+                    commit_args += ["-m", msg]
             status = Git.call_git_cmd(
-                f"commit {commit_msg}",
+                commit_args,
                 msg="Commit into distgit",
                 return_output=False,
                 ignore_error=True,
@@ -93,7 +111,18 @@ class Git(object):
         return True
 
     @staticmethod
-    def git_push(fork_enabled: bool = False, source_branch: str = "") -> bool:
+    def lease_option(branch: str) -> str:
+        """
+        --force-with-lease option expecting origin branch at the SHA seen by the last fetch.
+        Branch which did not exist is expected to be still missing.
+        """
+        expected = Git.get_ref_sha(f"refs/remotes/origin/{branch}") or ""
+        return f"--force-with-lease={branch}:{expected}"
+
+    @staticmethod
+    def git_push(
+        fork_enabled: bool = False, source_branch: str = "", force_with_lease: bool = False
+    ) -> bool:
 
         if fork_enabled:
             try:
@@ -101,12 +130,55 @@ class Git(object):
             except CalledProcessError:
                 return False
         else:
+            lease = f"{Git.lease_option(source_branch)} " if force_with_lease else ""
             try:
-                Git.call_git_cmd(f"push -u origin {source_branch}", msg="Push changes into git")
+                Git.call_git_cmd(
+                    f"push {lease}-u origin {source_branch}", msg="Push changes into git"
+                )
             except CalledProcessError:
                 return False
         return True
 
+    @staticmethod
+    def git_push_atomic(
+        branches: List[str], set_upstream: bool = False, leased: List[str] = None
+    ) -> bool:
+        """
+        Push several branches to origin in one atomic push.
+        Either all branches are updated or none of them.
+        :param branches: list of local branches to push
+        :param set_upstream: set origin as upstream of pushed branches
+        :param leased: branches rewritten with --force-with-lease
+        :return: True if push succeeded
+        """
+        upstream_opt = " -u" if set_upstream else ""
+        for branch in leased or []:
+            upstream_opt += f" {Git.lease_option(branch)}"
+        try:
+            Git.call_git_cmd(
+                f"push --atomic{upstream_opt} origin {' '.join(branches)}",
+                msg="Push changes of all branches into git",
+            )
+        except CalledProcessError:
+            return False
+        return True
+
+    @staticmethod
+    def delete_remote_branches(branches: List[str]) -> bool:
+        """
+        Deletes branches from origin with one push
+        :param branches: list of branches to delete
+        :return: True if branches were deleted
+        """
+        try:
+            Git.call_git_cmd(
+                f"push origin --delete {' '.join(branches)}",
+                msg=f"Delete branches {branches} from origin",
+            )
+        except CalledProcessError:
+            return False
+        return True
+
     @staticmethod
     def clone_repo(clone_url: str, tempdir: str) -> Path:
         """
@@ -118,21 +190,114 @@ class Git(object):
         # clone_url can be url as well as path to directory, try to get the last part (strip .git)
         reponame = Git.strip_dot_git(clone_url.split("/")[-1])
         cloned_dir = Path(tempdir) / reponame
-        clone_success = True
+        Git.call_git_cmd(f"clone {clone_url} {str(cloned_dir)}")
+        Git.update_submodules(cloned_dir)
+        return cloned_dir
+
+    @staticmethod
+    def update_submodules(repo_dir: Path, shallow: bool = False) -> bool:
+        """
+        Initializes submodules declared in .gitmodules. Objects are borrowed
+        from the worker wide SUBMODULE_CACHE and submodules are fetched in parallel.
+        Repository without submodules is left untouched.
+        :param repo_dir: checked out repository
+        :param shallow: fetch only the recorded commit of submodules
+        :return: False if submodules were not updated
+        """
+        if not Git.get_submodule_paths(repo_dir):
+            return True
         try:
-            Git.call_git_cmd(
-                f"clone --recurse-submodules {clone_url} {str(cloned_dir)}"
+            # init resolves relative submodule URLs
+            Git.call_git_cmd("submodule init", cwd=repo_dir)
+            output = Git.call_git_cmd(
+                ["config", "--get-regexp", r"^submodule\..*\.url$"],
+                cwd=repo_dir,
+                ignore_error=True,
             )
+            urls = [line.split(" ", 1)[1] for line in output.splitlines() if " " in line]
+            cmd = ["submodule", "update", "--init", "--recursive", f"--jobs={SUBMODULE_JOBS}"]
+            reference = SUBMODULE_CACHE.prepare(urls)
+            if reference:
+                # objects are copied, the clone does not depend on the cache
+                cmd += ["--reference", str(reference), "--dissociate"]
+            if shallow:
+                cmd.append("--depth=1")
+            Git.call_git_cmd(cmd, cwd=repo_dir, msg=f"Update submodules in {repo_dir}")
         except CalledProcessError:
-            # clone git repository w/o submodule. In case submodules does not exist
-            clone_success = False
-        if not clone_success:
-            try:
-                Git.call_git_cmd(f"clone {clone_url} {str(cloned_dir)}")
-            except CalledProcessError:
-                raise
+            logger.warning(f"Updating submodules in {repo_dir} failed.")
+            return False
+        return True
+
+    @staticmethod
+    def get_submodule_paths(repo_dir: Path) -> List[str]:
+        """
+        Paths of submodules declared in .gitmodules of the checked out tree
+        """
+        if not (Path(repo_dir) / ".gitmodules").is_file():
+            return []
+        output = Git.call_git_cmd(
+            ["config", "--file", str(Path(repo_dir) / ".gitmodules"), "--get-regexp", "path"],
+            ignore_error=True,
+        )
+        # lines are in format "submodule.<name>.path <path>"
+        return [line.split(" ", 1)[1] for line in output.splitlines() if " " in line]
+
+    @staticmethod
+    def sparse_clone_repo(clone_url: str, tempdir: str, sha: str) -> Path:
+        """
+        Fetches only the commit `sha` without any history and without blobs.
+        Only files in the root directory and shallow submodules are checked out,
+        further directories are added by `sparse_checkout_add`
+        and their blobs are fetched on demand.
+        :param clone_url: url to clone from
+        :param tempdir: temporary directory, where the git is cloned
+        :param sha: commit to check out
+        :return: directory with cloned repo
+        """
+        reponame = Git.strip_dot_git(clone_url.split("/")[-1])
+        cloned_dir = Path(tempdir) / reponame
+        Git.call_git_cmd(f"init --quiet {str(cloned_dir)}")
+        Git.call_git_cmd(f"remote add origin {clone_url}", git_dir=cloned_dir)
+        Git.call_git_cmd(
+            f"fetch --depth=1 --filter=blob:none origin {sha}",
+            git_dir=cloned_dir,
+            msg=f"Fetch {sha} of {clone_url} without blobs",
+        )
+        Git.call_git_cmd("sparse-checkout set --cone", git_dir=cloned_dir)
+        Git.call_git_cmd(f"checkout --quiet --detach {sha}", git_dir=cloned_dir)
+        # submodules are populated independently on sparse-checkout patterns
+        Git.update_submodules(cloned_dir, shallow=True)
         return cloned_dir
 
+    @staticmethod
+    def is_sparse_checkout(repo_dir: Path) -> bool:
+        output = Git.call_git_cmd(
+            "config --bool core.sparseCheckout", git_dir=repo_dir, ignore_error=True
+        )
+        return output.strip() == "true"
+
+    @staticmethod
+    def sparse_checkout_add(repo_dir: Path, paths: List[str]):
+        """
+        Adds directories into the sparse checkout, missing blobs are fetched.
+        The whole tree is checked out if adding the directories fails.
+        """
+        try:
+            Git.call_git_cmd(["sparse-checkout", "add"] + paths, git_dir=repo_dir)
+        except CalledProcessError:
+            logger.warning(
+                f"Adding {paths} into sparse checkout of {repo_dir} failed, "
+                f"checking out the whole tree."
+            )
+            Git.sparse_checkout_disable(repo_dir)
+
+    @staticmethod
+    def sparse_checkout_disable(repo_dir: Path):
+        """
+        Checks out the whole tree, missing blobs are fetched.
+        """
+        Git.call_git_cmd("sparse-checkout disable", git_dir=repo_dir)
+
     @staticmethod
     def fetch_pr_origin(number: str, msg: str):
         """
@@ -152,14 +317,9 @@ class Git(object):
         * fetch upstream
         :param url: Str: URL which is adds upstream into origin
         """
-        Git.call_git_cmd("remote -v")
-        remote_defined: bool = False
-        try:
-            remote_defined = Git.call_git_cmd("config remote.upstream.url")
-        except subprocess.CalledProcessError:
-            pass
+        logger.debug("Git remotes: %s", lazy(git_backend.BACKEND.get_remotes))
         # add git remote upstream if it is not defined
-        if not remote_defined:
+        if not git_backend.BACKEND.get_config("remote.upstream.url"):
             Git.call_git_cmd(f"remote add upstream {url}")
         all_braches = Git.call_git_cmd("remote update upstream")
         return all_braches
@@ -170,10 +330,34 @@ class Git(object):
         Push changes into dist_git branch
         * Reset commit with the latest downstream origin
         * push changes back to origin
+        Both steps are skipped if the branch already matches upstream.
         :param branch: str: Name of branch to sync
         """
-        Git.call_git_cmd(f"reset --hard upstream/{branch}")
-        Git.call_git_cmd(f"push origin {branch} --force")
+        upstream_sha = Git.get_ref_sha(f"refs/remotes/upstream/{branch}")
+        if Git.get_ref_sha("HEAD") != upstream_sha:
+            Git.call_git_cmd(f"reset --hard upstream/{branch}")
+        if Git.get_ref_sha(f"refs/remotes/origin/{branch}") != upstream_sha:
+            Git.call_git_cmd(f"push origin {branch} --force")
+        else:
+            logger.debug(f"Fork branch {branch} already matches upstream.")
+
+    @staticmethod
+    def get_ref_sha(ref: str) -> Optional[str]:
+        """
+        :param ref: git reference
+        :return: commit SHA the reference points to or None if it does not exist
+        """
+        return git_backend.BACKEND.get_ref_sha(ref)
+
+    @staticmethod
+    def get_remote_refs(remote: str) -> Dict[str, str]:
+        """
+        Reads remote-tracking branches of the remote in one query.
+        They are up to date right after clone or `remote update`.
+        :param remote: name of the remote, like origin or upstream
+        :return: dict in format branch: commit SHA
+        """
+        return git_backend.BACKEND.get_refs(f"refs/remotes/{remote}/")
 
     @staticmethod
     def get_valid_remote_branches(default_string: str = "remotes/upstream/") -> List[str]:
@@ -192,7 +376,7 @@ class Git(object):
         Returns list of all branches as for origin as for upstream
         :return: List of all branches
         """
-        return Git.call_git_cmd("branch -a", return_output=True)
+        return "\n".join(git_backend.BACKEND.list_branches())
 
     @staticmethod
     def get_msg_from_jira_ticket(config: Dict) -> str:
@@ -220,13 +404,33 @@ class Git(object):
 
     @staticmethod
     def sync_fork_with_upstream(branches_to_sync):
+        """
+        Sync fork branches with upstream.
+        Only branches whose fork SHA differs from upstream are pushed,
+        all of them by one multi-refspec push.
+        :param branches_to_sync: list of branches to sync
+        """
+        upstream_refs = Git.get_remote_refs("upstream")
+        origin_refs = Git.get_remote_refs("origin")
+        refspecs = []
         for brn in branches_to_sync:
+            if brn not in upstream_refs:
+                logger.debug(f"Branch {brn} does not exist in upstream.")
+                continue
             try:
-                logger.debug(f"Let's try to checkout to {brn} branch.")
-                Git.call_git_cmd(f"checkout -b {brn} upstream/{brn}")
+                # Local branch is needed for later checkout, origin and upstream both contain it
+                Git.call_git_cmd(f"branch {brn} upstream/{brn}")
             except subprocess.CalledProcessError:
                 pass
-            Git.call_git_cmd(f"push origin {brn} --force")
+            if origin_refs.get(brn) == upstream_refs[brn]:
+                logger.debug(f"Fork branch {brn} already matches upstream.")
+                continue
+            refspecs.append(f"refs/remotes/upstream/{brn}:refs/heads/{brn}")
+        if not refspecs:
+            return
+        Git.call_git_cmd(
+            f"push --force origin {' '.join(refspecs)}", msg="Sync fork with upstream"
+        )
 
     @staticmethod
     def branches_to_synchronize(
@@ -241,42 +445,74 @@ class Git(object):
 
     @staticmethod
     def call_git_cmd(
-        cmd, return_output=True, ignore_error=False, msg=None, git_dir=None, shell=True
+        cmd,
+        return_output=True,
+        ignore_error=False,
+        msg=None,
+        git_dir=None,
+        timeout=None,
+        cwd=None,
     ):
         """
-        Runs the GIT command with specified arguments
-        :param cmd: list or string, git subcommand for execution
+        Runs the GIT command with specified arguments. Git is executed without shell,
+        so arguments are never interpreted by it.
+        :param cmd: list of arguments or string split into arguments like shell does
         :param return_output: bool, return output of the command ?
         :param ignore_error: bool, do not fail in case nonzero return code
         :param msg: log this before running the command
         :param git_dir: run the command in another directory
-        :param shell: bool, run git commands in shell by default
-        :return: output of the git command
+        :param timeout: timeout in seconds, GIT_TIMEOUTS of the subcommand by default
+        :param cwd: run the command in this directory, needed by commands
+                    which does not work with git_dir, like `submodule`
+        :return: output of the git command or its return code
         """
         if msg:
             logger.info(msg)
 
-        command = "git"
-        # use git_dir as work-tree git parameter and git-dir parameter (with added git.postfix)
-        if git_dir:
-            command += f" --git-dir {git_dir}/.git"
-            command += f" --work-tree {git_dir}"
         if isinstance(cmd, str):
-            command += f" {cmd}"
+            args = shlex.split(cmd)
         elif isinstance(cmd, list):
-            command += f" {' '.join(cmd)}"
+            args = [str(x) for x in cmd]
         else:
             raise ValueError(f"{cmd} is not a list nor a string")
-
-        output = run_cmd(
-            command, return_output=return_output, ignore_error=ignore_error, shell=shell
+        argv = ["git"]
+        # use git_dir as work-tree git parameter and git-dir parameter (with added git.postfix)
+        if git_dir:
+            argv += ["--git-dir", f"{git_dir}/.git", "--work-tree", str(git_dir)]
+        argv += args
+        subcommand = args[0] if args else ""
+        ssh.before_git_command(args, cwd=str(git_dir or cwd or "") or None)
+
+        if timeout is None:
+            timeout = GIT_TIMEOUTS.get(subcommand, GIT_DEFAULT_TIMEOUT)
+        label = git_timing.subcommand_label(args)
+        with span(f"git {label}", subcommand=label, cwd=git_dir or cwd) as git_span:
+            result = run_argv(argv, timeout=timeout, cwd=str(cwd) if cwd else None)
+            git_span.set_attributes(
+                {"returncode": result.returncode, "timed_out": result.timed_out}
+            )
+        timing = git_timing.GIT_TIMINGS.record(
+            label,
+            result.duration,
+            result.returncode,
+            timed_out=result.timed_out,
+            repo=str(git_dir or cwd or "") or None,
         )
-        logger.debug(output)
-        return output
+        logger.debug(
+            f"git {timing.subcommand} in {timing.repo} returned {result.returncode} "
+            f"in {timing.duration:.2f}s"
+        )
+        if result.returncode != 0 and not ignore_error:
+            logger.error(
+                f"failed with code {result.returncode} and output:\n{result.output}"
+            )
+            raise CalledProcessError(result.returncode, argv, output=result.output)
+        return result.output if return_output else result.returncode
 
     """Class for working with git."""
 
     @staticmethod
+    @lru_cache(maxsize=1024)
     def parse_git_repo(potential_url):
         """Cover the following variety of URL forms for Github/Gitlab repo referencing.
 
@@ -376,12 +612,12 @@ class Git(object):
         :return: True if config file exists
                  False is config file does not exist
         """
-        try:
-            Git.call_git_cmd(f"checkout {branch}", msg="Change downstream branch")
-        except CalledProcessError:
+        # downstream_dir is the current directory, the branch is not checked out
+        ref = git_backend.BACKEND.resolve_branch(branch)
+        if not ref:
             logger.debug(f"It looks like {branch} does not exist yet. ")
             return False
-        if (downstream_dir / DOWNSTREAM_CONFIG_FILE).exists():
+        if git_backend.BACKEND.has_file(ref, DOWNSTREAM_CONFIG_FILE):
             logger.info(
                 "Configuration file %r exists in branch.", DOWNSTREAM_CONFIG_FILE
             )
@@ -419,3 +655,49 @@ class Git(object):
 \tfetch = +refs/pull/*/head:refs/remotes/origin/pr/*
 """
         (Path.home() / ".gitconfig").write_text(content)
+
+
+class SubmoduleCache(object):
+    """
+    Bare repository shared by all clones in the worker, which holds objects
+    of submodules like sclorg `common`. Every submodule URL is fetched
+    into its own ref namespace at most once per `refresh` seconds,
+    the cache is then used as --reference for submodule clones.
+    """
+
+    def __init__(self, path: str = SUBMODULE_CACHE_DIR, refresh: int = SUBMODULE_CACHE_REFRESH):
+        self.path = Path(path).expanduser()
+        self.refresh = refresh
+        self.fetched: Dict[str, float] = {}
+
+    @staticmethod
+    def url_key(url: str) -> str:
+        return hashlib.sha1(url.encode()).hexdigest()[:12]
+
+    def prepare(self, urls: List[str]) -> Optional[Path]:
+        """
+        Fetches the submodule URLs into the cache.
+        :return: path to the cache or None if it is not usable
+        """
+        try:
+            if not (self.path / "HEAD").is_file():
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                Git.call_git_cmd(f"init --quiet --bare {str(self.path)}")
+            for url in urls:
+                if time.monotonic() - self.fetched.get(url, -self.refresh) < self.refresh:
+                    continue
+                key = self.url_key(url)
+                Git.call_git_cmd(
+                    ["fetch", "--quiet", "--no-tags", url, f"+refs/heads/*:refs/cache/{key}/*"],
+                    cwd=self.path,
+                    msg=f"Update submodule cache from {url}",
+                )
+                self.fetched[url] = time.monotonic()
+        except (CalledProcessError, OSError) as ex:
+            logger.warning(f"Submodule cache {self.path} is not usable: {ex}")
+            return None
+        return self.path
+
+
+# Worker wide submodule object cache
+SUBMODULE_CACHE = SubmoduleCache()
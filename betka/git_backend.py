@@ -0,0 +1,429 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import logging
+import os
+import subprocess
+import threading
+
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from betka.constants import (
+    CAT_FILE_CHUNK,
+    CAT_FILE_MAX_OBJECT_SIZE,
+    CAT_FILE_POOL_SIZE,
+)
+from betka.exception import BetkaException
+from betka.named_tuples import CatFileObject
+
+logger = logging.getLogger(__name__)
+
+
+class GitBackend(object):
+    """
+    Read-only queries of the git repository in the current directory.
+
+    Network operations and writes (clone, fetch, push, checkout, commit)
+    always go through `Git.call_git_cmd`.
+    """
+
+    name = "subprocess"
+
+    @staticmethod
+    def _git(*args) -> Optional[bytes]:
+        """
+        Runs git without shell.
+        :return: stdout or None if git failed
+        """
+        result = subprocess.run(
+            ["git", *args], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        if result.returncode != 0:
+            return None
+        return result.stdout
+
+    def get_ref_sha(self, ref: str) -> Optional[str]:
+        """
+        :param ref: git reference
+        :return: commit SHA the reference points to or None if it does not exist
+        """
+        output = self._git("rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}")
+        if not output:
+            return None
+        return output.decode().strip() or None
+
+    def get_refs(self, prefix: str) -> Dict[str, str]:
+        """
+        :param prefix: reference prefix, like refs/remotes/upstream/
+        :return: dict in format reference without the prefix: SHA
+        """
+        output = self._git("for-each-ref", "--format=%(objectname) %(refname)", prefix)
+        refs = {}
+        for line in (output or b"").decode().splitlines():
+            sha, refname = line.split(" ", 1)
+            refs[refname[len(prefix):]] = sha
+        return refs
+
+    def get_config(self, key: str) -> Optional[str]:
+        """
+        :param key: config key, like remote.upstream.url
+        :return: value or None if the key is not set
+        """
+        output = self._git("config", key)
+        return output.decode().strip() if output else None
+
+    def get_remotes(self) -> Dict[str, str]:
+        """
+        :return: dict in format remote name: URL
+        """
+        output = self._git("config", "--get-regexp", r"^remote\..*\.url$")
+        remotes = {}
+        for line in (output or b"").decode().splitlines():
+            key, url = line.split(" ", 1)
+            remotes[key[len("remote."):-len(".url")]] = url
+        return remotes
+
+    def read_blob(self, ref: str, path: str) -> Optional[bytes]:
+        """
+        :param ref: git reference
+        :param path: path of the file in the tree
+        :return: file content or None if the file does not exist in the ref
+        """
+        return self._git("cat-file", "blob", f"{ref}:{path}")
+
+    def has_file(self, ref: str, path: str) -> bool:
+        return self.read_blob(ref, path) is not None
+
+    def close(self):
+        """
+        Releases resources held for repositories, like co-processes
+        """
+
+    def resolve_branch(self, branch: str) -> Optional[str]:
+        """
+        Gets the reference of the branch, the local branch is preferred
+        over the origin remote-tracking branch, like `git checkout` does.
+        """
+        for ref in [f"refs/heads/{branch}", f"refs/remotes/origin/{branch}"]:
+            if self.get_ref_sha(ref):
+                return ref
+        return None
+
+    def list_branches(self) -> List[str]:
+        """
+        :return: local and remote-tracking branches in `git branch -a` naming
+        """
+        local = list(self.get_refs("refs/heads/"))
+        remote = [
+            f"remotes/{x}" for x in self.get_refs("refs/remotes/") if not x.endswith("/HEAD")
+        ]
+        return local + remote
+
+
+class DulwichBackend(GitBackend):
+    """
+    In-process implementation of read-only queries based on dulwich,
+    no git process is started.
+    """
+
+    name = "dulwich"
+
+    def __init__(self):
+        from dulwich.repo import Repo
+
+        self.repo_class = Repo
+
+    def open(self):
+        return self.repo_class(os.getcwd())
+
+    @staticmethod
+    def _peel(repo, sha: bytes) -> Optional[bytes]:
+        """
+        Peels annotated tags down to the commit
+        """
+        obj = repo[sha]
+        while obj.type_name == b"tag":
+            obj = repo[obj.object[1]]
+        if obj.type_name != b"commit":
+            return None
+        return obj.id
+
+    @staticmethod
+    def _candidates(ref: str) -> List[bytes]:
+        if ref == "HEAD" or ref.startswith("refs/"):
+            return [ref.encode()]
+        return [f"refs/{x}{ref}".encode() for x in ["", "heads/", "tags/", "remotes/"]]
+
+    def get_ref_sha(self, ref: str) -> Optional[str]:
+        with self.open() as repo:
+            for name in self._candidates(ref):
+                try:
+                    sha = self._peel(repo, repo.refs[name])
+                except KeyError:
+                    continue
+                return sha.decode() if sha else None
+        return None
+
+    def get_refs(self, prefix: str) -> Dict[str, str]:
+        with self.open() as repo:
+            refs = repo.refs.as_dict(prefix.rstrip("/").encode())
+            return {name.decode(): sha.decode() for name, sha in refs.items()}
+
+    def get_config(self, key: str) -> Optional[str]:
+        section, _, name = key.rpartition(".")
+        section_parts = tuple(x.encode() for x in section.split(".", 1))
+        with self.open() as repo:
+            try:
+                return repo.get_config().get(section_parts, name.encode()).decode()
+            except KeyError:
+                return None
+
+    def get_remotes(self) -> Dict[str, str]:
+        remotes = {}
+        with self.open() as repo:
+            config = repo.get_config()
+            for section in config.sections():
+                if len(section) != 2 or section[0] != b"remote":
+                    continue
+                try:
+                    remotes[section[1].decode()] = config.get(section, b"url").decode()
+                except KeyError:
+                    continue
+        return remotes
+
+    def read_blob(self, ref: str, path: str) -> Optional[bytes]:
+        from dulwich.object_store import tree_lookup_path
+
+        sha = self.get_ref_sha(ref)
+        if not sha:
+            return None
+        with self.open() as repo:
+            try:
+                _, blob_sha = tree_lookup_path(
+                    repo.__getitem__, repo[sha.encode()].tree, path.encode()
+                )
+                return repo[blob_sha].data
+            except KeyError:
+                return None
+
+
+class CatFile(object):
+    """
+    Long-lived `git cat-file --batch-check` and `git cat-file --batch`
+    co-processes of one repository.
+
+    Each request is one line written to stdin and one response read from
+    stdout, so an object lookup does not start a new git process.
+    Objects bigger than `max_size` are drained in chunks and not returned.
+    """
+
+    # git cat-file option answering each request type
+    MODES = {"info": "--batch-check", "contents": "--batch"}
+
+    def __init__(self, repo_dir: str, max_size: int = CAT_FILE_MAX_OBJECT_SIZE):
+        self.repo_dir = repo_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # co-processes are started by the first request of their type
+        self.processes: Dict[str, subprocess.Popen] = {}
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def is_alive(self) -> bool:
+        return not self.closed and all(x.poll() is None for x in self.processes.values())
+
+    def _process(self, command: str) -> subprocess.Popen:
+        if command not in self.processes:
+            self.processes[command] = subprocess.Popen(
+                ["git", "cat-file", self.MODES[command]],
+                cwd=self.repo_dir,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        return self.processes[command]
+
+    def _request(self, command: str, name: str) -> Optional[List[bytes]]:
+        """
+        Sends one object name to the co-process of the command and reads the response header.
+        :param command: "info" or "contents"
+        :return: [sha, type, size] or None if the object is missing
+        """
+        if "\n" in name:
+            raise ValueError(f"Invalid object name {name!r}")
+        process = self._process(command)
+        process.stdin.write(f"{name}\n".encode())
+        process.stdin.flush()
+        header = process.stdout.readline()
+        if not header:
+            raise BetkaException(f"git cat-file in {self.repo_dir} exited unexpectedly")
+        parts = header.split()
+        if len(parts) != 3:
+            # <name> missing or <name> ambiguous
+            return None
+        return parts
+
+    def _read_data(self, size: int) -> Optional[bytes]:
+        """
+        Reads object content followed by a newline.
+        Content bigger than max_size is drained and dropped.
+        """
+        stdout = self.processes["contents"].stdout
+        if size <= self.max_size:
+            data = stdout.read(size + 1)
+            return data[:-1]
+        remaining = size + 1
+        while remaining:
+            remaining -= len(stdout.read(min(remaining, CAT_FILE_CHUNK)))
+        logger.warning(f"Object with size {size} exceeds {self.max_size} bytes, skipped.")
+        return None
+
+    def info(self, name: str) -> Optional[CatFileObject]:
+        """
+        :param name: object name, like a SHA, ref^{commit} or ref:path
+        :return: CatFileObject without data or None if the object does not exist
+        """
+        with self.lock:
+            parts = self._request("info", name)
+        if not parts:
+            return None
+        return CatFileObject(parts[0].decode(), parts[1].decode(), int(parts[2]), None)
+
+    def contents(self, name: str) -> Optional[CatFileObject]:
+        """
+        :param name: object name, like a SHA, ref^{commit} or ref:path
+        :return: CatFileObject or None if the object does not exist
+        """
+        with self.lock:
+            parts = self._request("contents", name)
+            if not parts:
+                return None
+            size = int(parts[2])
+            data = self._read_data(size)
+        return CatFileObject(parts[0].decode(), parts[1].decode(), size, data)
+
+    def close(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.stdin.close()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+            process.stdout.close()
+        self.processes = {}
+        self.closed = True
+
+
+class CatFileBackend(GitBackend):
+    """
+    Reads objects through `git cat-file` co-processes of each repository,
+    other queries use subprocess git.
+    """
+
+    name = "cat-file"
+
+    def __init__(self, pool_size: int = CAT_FILE_POOL_SIZE):
+        self.pool_size = pool_size
+        self.processes: OrderedDict = OrderedDict()
+
+    def cat_file(self) -> CatFile:
+        """
+        Gets the co-process of the repository in the current directory.
+        The least recently used co-process is closed if the pool is full.
+        """
+        repo_dir = os.getcwd()
+        process = self.processes.get(repo_dir)
+        if process is not None and not process.is_alive():
+            self.processes.pop(repo_dir)
+            process = None
+        if process is None:
+            process = CatFile(repo_dir)
+            self.processes[repo_dir] = process
+            if len(self.processes) > self.pool_size:
+                self.processes.popitem(last=False)[1].close()
+        self.processes.move_to_end(repo_dir)
+        return process
+
+    def get_ref_sha(self, ref: str) -> Optional[str]:
+        obj = self.cat_file().info(f"{ref}^{{commit}}")
+        return obj.sha if obj else None
+
+    def read_blob(self, ref: str, path: str) -> Optional[bytes]:
+        obj = self.cat_file().contents(f"{ref}:{path}")
+        if not obj or obj.type != "blob":
+            return None
+        return obj.data
+
+    def has_file(self, ref: str, path: str) -> bool:
+        obj = self.cat_file().info(f"{ref}:{path}")
+        return obj is not None and obj.type == "blob"
+
+    def close(self):
+        while self.processes:
+            self.processes.popitem()[1].close()
+
+
+BACKENDS = {
+    GitBackend.name: GitBackend,
+    DulwichBackend.name: DulwichBackend,
+    CatFileBackend.name: CatFileBackend,
+}
+
+# Backend used by Git static methods, see set_backend
+BACKEND: GitBackend = GitBackend()
+
+
+def set_backend(name: str) -> GitBackend:
+    """
+    Selects the backend for read-only git queries.
+    Falls back to subprocess git if the backend is unknown or not installed.
+    """
+    global BACKEND
+    if BACKEND.name == name:
+        return BACKEND
+    BACKEND.close()
+    try:
+        BACKEND = BACKENDS[name]()
+    except KeyError:
+        logger.warning(f"Unknown git backend {name}, using subprocess git.")
+        BACKEND = GitBackend()
+    except ImportError as ie:
+        logger.warning(f"Git backend {name} is not available ({ie}), using subprocess git.")
+        BACKEND = GitBackend()
+    logger.info(f"Using {BACKEND.name} git backend for repository queries.")
+    return BACKEND
+
+
+def close_backend():
+    """
+    Closes long running processes and repositories opened by the current backend.
+    """
+    BACKEND.close()
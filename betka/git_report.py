@@ -0,0 +1,160 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Summary of git command timings logged by betka tasks, see Betka.log_git_timings.
+
+    python -m betka.git_report [--date YYYYMMDD] [--logs-dir DIR] [--top N] [--json]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+# Entries of older logs were pretty printed with raw newlines in strings
+DECODER = json.JSONDecoder(strict=False)
+
+
+def iter_log_entries(text: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yields JSON objects from a log file. Both single-line and older indented
+    multi-line entries are read, lines which do not start an object are skipped.
+    """
+    pos = 0
+    while True:
+        pos = text.find("{", pos)
+        if pos == -1:
+            return
+        if pos and text[pos - 1] != "\n":
+            pos += 1
+            continue
+        try:
+            entry, end = DECODER.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            pos += 1
+            continue
+        if isinstance(entry, dict):
+            yield entry
+        pos = end
+
+
+def log_files(logs_dir: Path, date: str) -> List[Path]:
+    return sorted(x for x in logs_dir.glob(f"*.log-{date}") if x.is_file())
+
+
+def merge_histograms(total: Dict[str, Dict], histograms: Dict[str, Dict]):
+    for subcommand, histogram in histograms.items():
+        merged = total.setdefault(
+            subcommand, {"count": 0, "failed": 0, "sum": 0.0, "max": 0.0, "buckets": {}}
+        )
+        merged["count"] += histogram.get("count", 0)
+        merged["failed"] += histogram.get("failed", 0)
+        merged["sum"] = round(merged["sum"] + histogram.get("sum", 0.0), 3)
+        merged["max"] = max(merged["max"], histogram.get("max", 0.0))
+        for bucket, count in histogram.get("buckets", {}).items():
+            merged["buckets"][bucket] = merged["buckets"].get(bucket, 0) + count
+
+
+def summarize(files: List[Path], top: int) -> Dict[str, Any]:
+    histograms: Dict[str, Dict] = {}
+    slowest: List[Dict] = []
+    tasks = 0
+    for path in files:
+        for entry in iter_log_entries(path.read_text(errors="replace")):
+            if "git_timings" not in entry:
+                continue
+            tasks += 1
+            merge_histograms(histograms, entry["git_timings"])
+            for timing in entry.get("git_slowest", []):
+                slowest.append(dict(timing, task=entry.get("task"), time=entry.get("time")))
+    slowest.sort(key=lambda x: x.get("duration", 0), reverse=True)
+    for histogram in histograms.values():
+        histogram["mean"] = (
+            round(histogram["sum"] / histogram["count"], 3) if histogram["count"] else 0.0
+        )
+    return {"tasks": tasks, "git_timings": histograms, "git_slowest": slowest[:top]}
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    lines = [f"Tasks with git timings: {summary['tasks']}", ""]
+    lines.append(
+        f"{'subcommand':<16} {'count':>7} {'failed':>7} {'total':>10} {'mean':>8} {'max':>8}"
+    )
+    by_total = sorted(
+        summary["git_timings"].items(), key=lambda x: x[1]["sum"], reverse=True
+    )
+    for subcommand, h in by_total:
+        lines.append(
+            f"{subcommand:<16} {h['count']:>7} {h['failed']:>7} "
+            f"{h['sum']:>9.1f}s {h['mean']:>7.2f}s {h['max']:>7.2f}s"
+        )
+    lines.extend(["", "Slowest git commands:"])
+    for timing in summary["git_slowest"]:
+        failed = "" if timing.get("returncode") == 0 else f" rc={timing.get('returncode')}"
+        if timing.get("timed_out"):
+            failed += " TIMEOUT"
+        lines.append(
+            f"{timing.get('duration', 0):>9.2f}s  {timing.get('subcommand')} "
+            f"repo={timing.get('repo')} image={timing.get('image')} "
+            f"branch={timing.get('branch')} task={timing.get('task')}{failed}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Summarize the slowest git operations of betka tasks."
+    )
+    parser.add_argument(
+        "--logs-dir",
+        default=os.getenv("LOGS_DIR") or "/var/log/bots",
+        help="directory with betka logs, LOGS_DIR by default",
+    )
+    parser.add_argument(
+        "--date",
+        default=datetime.now().strftime("%Y%m%d"),
+        help="day of logs in format YYYYMMDD, today by default",
+    )
+    parser.add_argument("--top", type=int, default=20, help="number of slowest commands")
+    parser.add_argument("--json", action="store_true", help="print summary as JSON")
+    args = parser.parse_args(argv)
+
+    files = log_files(Path(args.logs_dir), args.date)
+    if not files:
+        print(f"No logs for {args.date} in {args.logs_dir}", file=sys.stderr)
+        return 1
+    summary = summarize(files, args.top)
+    if args.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        print(format_summary(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import logging
+import os
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from betka import metrics
+from betka.constants import GIT_SLOWEST_KEPT, GIT_TIMING_BUCKETS
+from betka.named_tuples import GitTiming
+
+logger = logging.getLogger(__name__)
+
+# git subcommands whose first argument is an action, e.g. `remote update`
+GIT_ACTION_COMMANDS = ["remote", "submodule", "stash", "worktree"]
+
+
+def bucket_label(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else f"{bound:g}"
+
+
+def subcommand_label(args: List[str]) -> str:
+    """
+    Name of the git operation used in reports, e.g. `clone` or `remote update`.
+    Options are skipped, so `add -A` is reported as `add`.
+    """
+    if not args:
+        return ""
+    if args[0] in GIT_ACTION_COMMANDS and len(args) > 1 and not args[1].startswith("-"):
+        return f"{args[0]} {args[1]}"
+    return args[0]
+
+
+class GitTimings(object):
+    """
+    Collects durations of git commands executed by one task.
+
+    Every command is tagged by its subcommand, repository and by
+    the image and branch betka is working on, see `set_context`.
+    Durations are aggregated into cumulative histograms per subcommand
+    and the slowest commands are kept for the slow-operation report.
+    """
+
+    def __init__(self):
+        self.context: Dict[str, Optional[str]] = {"image": None, "branch": None}
+        self.histograms: Dict[str, Dict[str, Any]] = {}
+        self.slowest: List[GitTiming] = []
+
+    def reset(self):
+        self.__init__()
+
+    def set_context(self, **kwargs):
+        """
+        Tags the following commands, e.g. set_context(image="s2i-base", branch=None)
+        """
+        self.context.update(kwargs)
+
+    def record(
+        self,
+        subcommand: str,
+        duration: float,
+        returncode: int,
+        timed_out: bool = False,
+        repo: Optional[str] = None,
+    ) -> GitTiming:
+        """
+        :param repo: repository directory, current working directory by default
+        """
+        if repo is None:
+            try:
+                repo = os.getcwd()
+            except FileNotFoundError:
+                # working directory was already deleted
+                pass
+        metrics.GIT_DURATION.labels(subcommand=subcommand).observe(duration)
+        timing = GitTiming(
+            subcommand,
+            round(duration, 3),
+            returncode,
+            timed_out,
+            Path(repo).name if repo else None,
+            self.context.get("image"),
+            self.context.get("branch"),
+        )
+        histogram = self.histograms.setdefault(
+            subcommand,
+            {
+                "count": 0,
+                "failed": 0,
+                "sum": 0.0,
+                "max": 0.0,
+                "buckets": {bucket_label(b): 0 for b in GIT_TIMING_BUCKETS},
+            },
+        )
+        histogram["count"] += 1
+        histogram["failed"] += int(returncode != 0)
+        histogram["sum"] = round(histogram["sum"] + duration, 3)
+        histogram["max"] = max(histogram["max"], timing.duration)
+        for bound in GIT_TIMING_BUCKETS:
+            if duration <= bound:
+                histogram["buckets"][bucket_label(bound)] += 1
+        self.slowest.append(timing)
+        self.slowest.sort(key=lambda x: x.duration, reverse=True)
+        del self.slowest[GIT_SLOWEST_KEPT:]
+        return timing
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Per-task summary appended to the JSON log
+        """
+        return {
+            "git_timings": self.histograms,
+            "git_slowest": [x._asdict() for x in self.slowest],
+        }
+
+
+# Timings of the task running in this worker process, reset by each task
+GIT_TIMINGS = GitTimings()
@@ -26,6 +26,7 @@ import requests
 from typing import Dict
 
 from betka.exception import BetkaException
+from betka.metrics import requests_hook
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +57,7 @@ class GitHubAPI(object):
             url=self.config_json["git_hub_api_4"],
             json={"query": query},
             headers=self.headers,
+            hooks={"response": requests_hook("github")},
         )
 
     def query_repository(self, query: str) -> requests.Response:
@@ -27,7 +27,7 @@ import time
 import requests
 
 from requests.exceptions import HTTPError
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
 from betka.git import Git
 from betka.emails import BetkaEmails
@@ -39,9 +39,16 @@ from betka.named_tuples import (
     ProjectMR,
     ForkProtectedBranches,
     ProjectInfo,
+    ProjectSnapshot,
+    BotCfgBlob,
 )
+from betka.bot_cfg import BOT_CFG_LOADER
+from betka.gitlab_async import fetch_snapshots, fetch_bot_cfgs
+from betka.gitlab_graphql import GitLabGraphQL
 from betka.utils import nested_get
 from betka.exception import BetkaException
+from betka.metrics import requests_hook
+from betka.tracing import span
 
 requests.packages.urllib3.disable_warnings()
 
@@ -65,12 +72,13 @@ class GitLab(gitlab.Gitlab):
         project_id: int = 0,
         project_id_fork: int = 0,
         fork: bool = False,
+        lazy: bool = False,
     ) -> Any:
         logger.debug(f"get project_id for component: {component}")
         if fork:
-            return self.projects.get(project_id_fork)
+            return self.projects.get(project_id_fork, lazy=lazy)
         else:
-            return self.projects.get(project_id)
+            return self.projects.get(project_id, lazy=lazy)
 
 
 class GitLabAPI(object):
@@ -78,11 +86,15 @@ class GitLabAPI(object):
         self.betka_config = betka_config
         self.config_json = config_json
         self.gitlab_api_url: str = f"{self.config_json['gitlab_api_url']}"
+        self.gitlab_url: str = self.config_json.get(
+            "gitlab_host_url", "https://gitlab.com"
+        ).rstrip("/")
         self.git = Git()
         self.ssh_url_to_repo: str = ""
         self.forked_ssh_url_to_repo: str = ""
         self.image: str = ""
         self._gitlab_api = None
+        self._graphql_api: Optional[GitLabGraphQL] = None
         self.gitlab_user = ""
         self.image_config: dict = {}
         self.target_project: Any = None
@@ -90,6 +102,8 @@ class GitLabAPI(object):
         self.fork_id = 0
         self.current_user: CurrentUser = None
         self.project_id = None
+        self.snapshots: Dict[str, ProjectSnapshot] = {}
+        self.bot_cfgs: Dict[str, Dict[str, Optional[BotCfgBlob]]] = {}
 
     def __str__(self) -> str:
         return f"betka_config:{self.betka_config}\n" f"config_json:{self.config_json}"
@@ -99,16 +113,131 @@ class GitLabAPI(object):
         self.image = image
         self.image_config = nested_get(self.betka_config, "dist_git_repos", self.image)
 
+    def preflight_mode(self) -> str:
+        return self.config_json.get("gitlab_preflight", "rest").lower()
+
+    @span("gitlab.load_preflight")
+    def load_preflight(self, images: Dict[str, List[str]]):
+        """
+        Fetches GitLab state of all images before any git work starts.
+        The REST lookups below are then served from the snapshot.
+        Mode is selected by `gitlab_preflight` in config.json:
+          async ... concurrent REST lookups
+          graphql ... one GraphQL query, including bot-cfg.yml of candidate branches
+        :param images: dict in format image: candidate branches to synchronize
+        """
+        self.snapshots = {}
+        mode = self.preflight_mode()
+        if mode not in ["async", "graphql"] or not images:
+            return
+        full_paths = {
+            image: f"{self.config_json['gitlab_namespace']}/{image}" for image in images
+        }
+        try:
+            if mode == "graphql":
+                self.snapshots = self.graphql_api.get_snapshots(
+                    full_paths=full_paths, branches=images
+                )
+            else:
+                self.snapshots = fetch_snapshots(
+                    api_url=self.gitlab_api_url,
+                    token=self.betka_config["gitlab_api_token"],
+                    full_paths=full_paths,
+                    fork=self.is_fork_enabled(),
+                )
+        except Exception as ex:
+            logger.warning(f"GitLab pre-flight failed, falling back to REST: {ex!r}")
+        logger.debug(f"GitLab pre-flight snapshots loaded for {list(self.snapshots)}")
+
+    def is_bot_cfg_precheck_enabled(self) -> bool:
+        value = self.config_json.get("precheck_bot_cfg", "false").lower()
+        return value in ["true", "yes"]
+
+    @span("gitlab.load_bot_cfgs")
+    def load_bot_cfgs(self, images: Dict[str, List[str]]):
+        """
+        Reads bot-cfg.yml of all candidate branches of all images before cloning.
+        Configs already present in the GraphQL snapshot are not fetched again.
+        :param images: dict in format image: candidate branches to synchronize
+        """
+        self.bot_cfgs = {}
+        if not self.is_bot_cfg_precheck_enabled() or not images:
+            return
+        missing = {}
+        for image, branches in images.items():
+            snapshot = self.snapshots.get(image)
+            if snapshot and snapshot.bot_cfgs is not None:
+                self.bot_cfgs[image] = snapshot.bot_cfgs
+            else:
+                missing[image] = branches
+        if not missing:
+            return
+        full_paths = {
+            image: f"{self.config_json['gitlab_namespace']}/{image}" for image in missing
+        }
+        try:
+            self.bot_cfgs.update(
+                fetch_bot_cfgs(
+                    api_url=self.gitlab_api_url,
+                    token=self.betka_config["gitlab_api_token"],
+                    full_paths=full_paths,
+                    branches=missing,
+                )
+            )
+        except Exception as ex:
+            logger.warning(f"Reading remote bot-cfg.yml files failed: {ex!r}")
+
+    def get_eligible_branches(self, branch_list: List[str]) -> Optional[List[str]]:
+        """
+        Filters branches of the current image to those containing bot-cfg.yml
+        :param branch_list: candidate branches
+        :return: list of branches or None in case remote bot-cfg.yml files are unknown
+        """
+        bot_cfgs = self.bot_cfgs.get(self.image)
+        if bot_cfgs is None:
+            return None
+        if any(brn not in bot_cfgs for brn in branch_list):
+            return None
+        return [brn for brn in branch_list if bot_cfgs[brn]]
+
+    def get_prefetched_bot_cfg(self, branch: str) -> Optional[Dict]:
+        """
+        :return: parsed bot-cfg.yml of the branch read before cloning or None
+        """
+        blob = nested_get(self.bot_cfgs, self.image, branch)
+        if not blob:
+            return None
+        return BOT_CFG_LOADER.load(blob.content, sha=blob.sha)
+
+    def snapshot(self) -> Any:
+        """
+        :return: ProjectSnapshot for current image or None
+        """
+        return self.snapshots.get(self.image)
+
+    @property
+    def graphql_api(self) -> GitLabGraphQL:
+        if not self._graphql_api:
+            graphql_url = self.config_json.get("gitlab_graphql_url")
+            if not graphql_url:
+                graphql_url = self.gitlab_api_url.rstrip("/").replace("/v4", "/graphql")
+            self._graphql_api = GitLabGraphQL(
+                graphql_url, self.betka_config["gitlab_api_token"]
+            )
+        return self._graphql_api
+
     @property
     def gitlab_api(self):
         if not self._gitlab_api:
             self._gitlab_api = GitLab(
-                "https://gitlab.com",
+                self.gitlab_url,
                 private_token=self.betka_config["gitlab_api_token"].strip(),
                 ssl_verify=False,
             )
+            self._gitlab_api.session.hooks["response"].append(requests_hook("gitlab"))
         return self._gitlab_api
 
+    @span("gitlab.check_authentication")
     def check_authentication(self):
         try:
             self.gitlab_api.auth()
@@ -119,6 +248,7 @@ class GitLabAPI(object):
             logger.error(f"Authentication failed with reason {gae}.")
             return None
 
+    @span("gitlab.load_project")
     def load_project(self, fork=False):
         if fork:
             self.source_project = self.gitlab_api.projects.get(self.fork_id)
@@ -143,8 +273,12 @@ class GitLabAPI(object):
             return False
         return True
 
+    @span("gitlab.get_project_forks")
     def get_project_forks(self) -> List[ProjectFork]:
         logger.debug(f"Get forks for project {self.image}")
+        snapshot = self.snapshot()
+        if snapshot and snapshot.forks is not None:
+            return snapshot.forks
         return [
             ProjectFork(
                 x.id,
@@ -154,24 +288,42 @@ class GitLabAPI(object):
                 x.forked_from_project["id"],
                 x.forked_from_project["ssh_url_to_repo"],
             )
-            for x in self.target_project.forks.list()
+            for x in self.target_project.forks.list(get_all=True)
         ]
 
+    @span("gitlab.get_project_branches")
     def get_project_branches(self) -> List[ProjectBranches]:
-        logger.debug(f"Get branches for project {self.image}: {self.target_project.branches.list()}")
-        return [
+        snapshot = self.snapshot()
+        if snapshot and snapshot.branches is not None:
+            return snapshot.branches
+        branches = [
             ProjectBranches(x.name, x.web_url, x.protected)
-            for x in self.target_project.branches.list()
+            for x in self.target_project.branches.list(get_all=True)
         ]
+        logger.debug("Get branches for project %s: %s", self.image, branches)
+        return branches
 
+    @span("gitlab.get_target_protected_branches")
     def get_target_protected_branches(self) -> List[ForkProtectedBranches]:
-        logger.debug(f"Get protected branches for project {self.image}: {self.target_project.protectedbranches.list()}")
-        protected_branches = self.target_project.protectedbranches.list()
-        return [ForkProtectedBranches(x.name) for x in protected_branches]
+        snapshot = self.snapshot()
+        if snapshot and snapshot.protected_branches is not None:
+            return snapshot.protected_branches
+        protected_branches = [
+            ForkProtectedBranches(x.name)
+            for x in self.target_project.protectedbranches.list(get_all=True)
+        ]
+        logger.debug(
+            "Get protected branches for project %s: %s", self.image, protected_branches
+        )
+        return protected_branches
 
+    @span("gitlab.get_project_mergerequests")
     def get_project_mergerequests(self) -> List[ProjectMR]:
         logger.debug(f"Get mergerequests for project {self.image}")
-        project_mr = self.target_project.mergerequests.list(state="opened")
+        snapshot = self.snapshot()
+        if snapshot and snapshot.merge_requests is not None:
+            return snapshot.merge_requests
+        project_mr = self.target_project.mergerequests.list(state="opened", get_all=True)
         return [
              ProjectMR(
                 x.iid,
@@ -182,10 +334,12 @@ class GitLabAPI(object):
                 x.source_project_id,
                 x.target_project_id,
                 x.web_url,
+                x.source_branch,
             )
             for x in project_mr
         ]
 
+    @span("gitlab.create_project_fork")
     def create_project_fork(self) -> ProjectFork:
         logger.debug(f"Create fork for project {self.project_id}")
         assert self.target_project
@@ -203,6 +357,7 @@ class GitLabAPI(object):
             project_mr.forked_from_project["ssh_url_to_repo"],
         )
 
+    @span("gitlab.load_forked_project")
     def load_forked_project(self):
         for cnt in range(0, 20):
             try:
@@ -221,9 +376,10 @@ class GitLabAPI(object):
 
     def get_protected_branches(self) -> List[ForkProtectedBranches]:
         logger.debug(f"Get protected branches for fork {self.fork_id}")
-        protected_branches = self.source_project.protectedbranches.list()
+        protected_branches = self.source_project.protectedbranches.list(get_all=True)
         return [ForkProtectedBranches(x.name) for x in protected_branches]
 
+    @span("gitlab.fork_project")
     def fork_project(self) -> Any:
         logger.debug(f"Create fork for project {self.project_id}")
         fork: ProjectFork
@@ -264,7 +420,11 @@ class GitLabAPI(object):
             self.source_project.protectedbranches.delete(brn.name)
         return fork
 
+    @span("gitlab.get_project_info")
     def get_project_info(self) -> ProjectInfo:
+        snapshot = self.snapshot()
+        if snapshot and snapshot.info is not None:
+            return snapshot.info
         logger.debug(
             f"Get information for project {self.target_project.name} with id {self.target_project.id}"
         )
@@ -275,6 +435,7 @@ class GitLabAPI(object):
             self.target_project.web_url,
         )
 
+    @span("gitlab.create_project_mergerequest")
     def create_project_mergerequest(self, data) -> ProjectMR:
         logger.debug(f"Create mergerequest for project {self.image} with data {data}")
         try:
@@ -291,6 +452,7 @@ class GitLabAPI(object):
                 mr.source_project_id,
                 mr.target_project_id,
                 mr.web_url,
+                mr.source_branch,
             )
         except gitlab.exceptions.GitlabCreateError as gce:
             logger.error(f"{gce.error_message} and {gce.response_code}")
@@ -309,6 +471,7 @@ class GitLabAPI(object):
             return True
         return False
 
+    @span("gitlab.file_merge_request")
     def file_merge_request(
         self,
         pr_msg: str,
@@ -371,9 +534,15 @@ class GitLabAPI(object):
         betka_schema["namespace_containers"] = self.config_json["gitlab_namespace"]
         return betka_schema
 
+    @span("gitlab.init_projects")
     def init_projects(self) -> bool:
+        # Project attributes are served from the pre-flight snapshot,
+        # so the project object does not need to be fetched
         self.target_project = self.gitlab_api.get_component_project_from_config(
-            image_config=self.image_config, component=self.image, project_id=self.project_id
+            image_config=self.image_config,
+            component=self.image,
+            project_id=self.project_id,
+            lazy=self.snapshot() is not None,
         )
         if self.fork_id != 0:
             self.source_project = self.gitlab_api.get_component_project_from_config(
@@ -407,6 +576,7 @@ class GitLabAPI(object):
             data["target_branch"] = origin_branch
         return self.create_project_mergerequest(data)
 
+    @span("gitlab.check_gitlab_merge_requests")
     def check_gitlab_merge_requests(self, branch: str, target_branch: str):
         """
         Checks if downstream already contains pull request. Check is based in the msg_to_check
@@ -444,10 +614,29 @@ class GitLabAPI(object):
             )
             return ProjectMR(
                 iid=mr.iid, title=mr.title, description="", target_branch=mr.target_branch, author=mr.author,
-                source_project_id=None, target_project_id=int(mr.target_project_id), web_url=""
+                source_project_id=None, target_project_id=int(mr.target_project_id), web_url="",
+                source_branch=mr.source_branch,
             )
         return None
 
+    @span("gitlab.get_orphaned_branches")
+    def get_orphaned_branches(self, keep: List[str]) -> List[str]:
+        """
+        Gets betka branches which are not a source branch of any opened merge request.
+        :param keep: branches used by the current run, they are never orphaned
+        :return: list of branch names
+        """
+        used = {mr.source_branch for mr in self.get_project_mergerequests()}
+        return [
+            brn.name
+            for brn in self.get_project_branches()
+            if brn.name.startswith("betka-")
+            and not brn.protected
+            and brn.name not in used
+            and brn.name not in keep
+        ]
+
+    @span("gitlab.get_branches")
     def get_branches(self) -> List[str]:
         """
         Gets the valid branches which contains `bot-cfg.yml` file.
@@ -470,6 +659,7 @@ class GitLabAPI(object):
     def get_forked_ssh_url_to_repo(self) -> str:
         return self.forked_ssh_url_to_repo
 
+    @span("gitlab.get_gitlab_fork")
     def get_gitlab_fork(self) -> Any:
         """
         Checks if the fork already exists in the internal GitLab instance
@@ -499,6 +689,7 @@ class GitLabAPI(object):
             f"{self.image}/-/raw/{branch}/{file}?ref_type=heads"
         )
 
+    @span("gitlab.get_bot_cfg_yaml")
     def get_bot_cfg_yaml(self, branch: str) -> Dict:
         """
         :return: bot-cfg.yml config
@@ -516,8 +707,13 @@ class GitLabAPI(object):
                 return None
         return project_fork
 
+    @span("gitlab.get_project_id_from_url")
     def get_project_id_from_url(self):
-        url = "https://gitlab.com/api/v4/projects"
+        snapshot = self.snapshot()
+        if snapshot and snapshot.info is not None:
+            self.project_id = snapshot.info.id
+            return self.project_id
+        url = f"{self.gitlab_api_url.rstrip('/')}/projects"
         headers = {
             "Content-Type": "application/json",
             "PRIVATE-TOKEN": self.betka_config["gitlab_api_token"].strip()
@@ -525,7 +721,12 @@ class GitLabAPI(object):
         url_namespace = f"{self.config_json['gitlab_namespace']}/{self.image}"
         url = f"{url}/{url_namespace.replace('/', '%2F')}"
         logger.debug(f"Get project_id from {url}")
-        ret = requests.get(url=f"{url}", headers=headers, verify=False)
+        ret = requests.get(
+            url=f"{url}",
+            headers=headers,
+            verify=False,
+            hooks={"response": requests_hook("gitlab")},
+        )
         ret.raise_for_status()
         if ret.status_code != 200:
             logger.error(f"Getting project_id failed for reason {ret.reason} {ret.json()} ")
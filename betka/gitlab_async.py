@@ -0,0 +1,304 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import logging
+import aiohttp
+
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from betka.bot_cfg import BOT_CFG_LOADER
+from betka.constants import (
+    DOWNSTREAM_CONFIG_FILE,
+    GITLAB_POOL_SIZE,
+    GITLAB_REQUEST_TIMEOUT,
+)
+from betka.metrics import aiohttp_trace_config
+from betka.named_tuples import (
+    BotCfgBlob,
+    ProjectBranches,
+    ProjectFork,
+    ProjectMR,
+    ForkProtectedBranches,
+    ProjectInfo,
+    ProjectSnapshot,
+)
+from betka.utils import nested_get
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGitLabClient(object):
+    """
+    Minimal asyncio GitLab REST client covering the endpoints betka
+    needs before any git work starts.
+
+    All requests share one aiohttp session, so the number of open
+    connections is bounded by `pool_size`.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        token: str,
+        pool_size: int = GITLAB_POOL_SIZE,
+        timeout: int = GITLAB_REQUEST_TIMEOUT,
+    ):
+        self.api_url = api_url.rstrip("/")
+        self.token = token.strip()
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session: aiohttp.ClientSession = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size, ssl=False),
+            headers={"PRIVATE-TOKEN": self.token},
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            trace_configs=[aiohttp_trace_config("gitlab")],
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    @staticmethod
+    def project_path(full_path: str) -> str:
+        return f"projects/{quote(full_path, safe='')}"
+
+    async def _get(self, path: str, params: Dict = None) -> Tuple[Any, Dict]:
+        async with self.session.get(f"{self.api_url}/{path}", params=params) as resp:
+            resp.raise_for_status()
+            return await resp.json(), dict(resp.headers)
+
+    async def _head(self, path: str, params: Dict = None) -> Dict:
+        async with self.session.head(f"{self.api_url}/{path}", params=params) as resp:
+            resp.raise_for_status()
+            return dict(resp.headers)
+
+    async def _get_text(self, path: str, params: Dict = None) -> str:
+        async with self.session.get(f"{self.api_url}/{path}", params=params) as resp:
+            resp.raise_for_status()
+            return await resp.text()
+
+    async def get_json(self, path: str, params: Dict = None) -> Any:
+        data, _ = await self._get(path, params=params)
+        return data
+
+    async def get_all(self, path: str, params: Dict = None) -> List[Any]:
+        """
+        Follows GitLab `X-Next-Page` pagination and returns all items
+        """
+        params = dict(params or {})
+        params.setdefault("per_page", 100)
+        result = []
+        page = "1"
+        while page:
+            params["page"] = page
+            data, headers = await self._get(path, params=params)
+            result.extend(data)
+            page = headers.get("X-Next-Page")
+        return result
+
+    async def get_project_info(self, full_path: str) -> ProjectInfo:
+        data = await self.get_json(self.project_path(full_path))
+        return ProjectInfo(
+            data["id"], data["name"], data["ssh_url_to_repo"], data["web_url"]
+        )
+
+    async def get_project_branches(self, full_path: str) -> List[ProjectBranches]:
+        data = await self.get_all(f"{self.project_path(full_path)}/repository/branches")
+        return [ProjectBranches(x["name"], x["web_url"], x["protected"]) for x in data]
+
+    async def get_protected_branches(
+        self, full_path: str
+    ) -> List[ForkProtectedBranches]:
+        data = await self.get_all(f"{self.project_path(full_path)}/protected_branches")
+        return [ForkProtectedBranches(x["name"]) for x in data]
+
+    async def get_merge_requests(self, full_path: str) -> List[ProjectMR]:
+        data = await self.get_all(
+            f"{self.project_path(full_path)}/merge_requests", params={"state": "opened"}
+        )
+        return [
+            ProjectMR(
+                x["iid"],
+                x["title"],
+                x["description"],
+                x["target_branch"],
+                nested_get(x, "author", "username"),
+                x["source_project_id"],
+                x["target_project_id"],
+                x["web_url"],
+                x["source_branch"],
+            )
+            for x in data
+        ]
+
+    async def get_project_forks(self, full_path: str) -> List[ProjectFork]:
+        data = await self.get_all(f"{self.project_path(full_path)}/forks")
+        return [
+            ProjectFork(
+                x["id"],
+                x["name"],
+                x["ssh_url_to_repo"],
+                nested_get(x, "owner", "username"),
+                nested_get(x, "forked_from_project", "id"),
+                nested_get(x, "forked_from_project", "ssh_url_to_repo"),
+            )
+            for x in data
+        ]
+
+    async def get_bot_cfg_blob(self, full_path: str, branch: str) -> Optional[BotCfgBlob]:
+        """
+        Reads bot-cfg.yml from the branch through the repository files API.
+        HEAD request returns only the blob SHA, the content is downloaded
+        only if the blob was not parsed yet.
+        :return: BotCfgBlob or None if the branch does not contain bot-cfg.yml.
+                 Content is None if the blob is already parsed by BOT_CFG_LOADER.
+        """
+        file_path = (
+            f"{self.project_path(full_path)}/repository/files/"
+            f"{quote(DOWNSTREAM_CONFIG_FILE, safe='')}"
+        )
+        try:
+            headers = await self._head(file_path, params={"ref": branch})
+        except aiohttp.ClientResponseError as cre:
+            if cre.status == 404:
+                return None
+            raise
+        blob_id = headers.get("X-Gitlab-Blob-Id")
+        if blob_id and blob_id in BOT_CFG_LOADER:
+            return BotCfgBlob(blob_id, None)
+        content = await self._get_text(f"{file_path}/raw", params={"ref": branch})
+        return BotCfgBlob(blob_id, content)
+
+    async def get_bot_cfgs(
+        self, full_paths: Dict[str, str], branches: Dict[str, List[str]]
+    ) -> Dict[str, Dict[str, Optional[BotCfgBlob]]]:
+        """
+        Reads bot-cfg.yml of all candidate branches of all images concurrently.
+        :param full_paths: dict in format image: GitLab project full path
+        :param branches: dict in format image: candidate branches
+        :return: dict in format image: {branch: BotCfgBlob or None}.
+                 Images whose lookups failed are missing in the result.
+        """
+        images = [image for image in full_paths if branches.get(image)]
+        results = await asyncio.gather(
+            *[
+                asyncio.gather(
+                    *[
+                        self.get_bot_cfg_blob(full_paths[image], branch)
+                        for branch in branches[image]
+                    ]
+                )
+                for image in images
+            ],
+            return_exceptions=True,
+        )
+        bot_cfgs = {}
+        for image, result in zip(images, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Reading {DOWNSTREAM_CONFIG_FILE} for {image} failed: {result!r}")
+                continue
+            bot_cfgs[image] = dict(zip(branches[image], result))
+        return bot_cfgs
+
+    async def get_snapshot(self, full_path: str, fork: bool = False) -> ProjectSnapshot:
+        """
+        Runs all pre-flight lookups of one project concurrently.
+        Forks are fetched only when betka works with forks.
+        """
+        lookups = [
+            self.get_project_info(full_path),
+            self.get_project_branches(full_path),
+            self.get_protected_branches(full_path),
+            self.get_merge_requests(full_path),
+        ]
+        if fork:
+            lookups.append(self.get_project_forks(full_path))
+        results = await asyncio.gather(*lookups)
+        forks = results[4] if fork else None
+        return ProjectSnapshot(results[0], results[1], results[2], results[3], forks)
+
+    async def get_snapshots(
+        self, full_paths: Dict[str, str], fork: bool = False
+    ) -> Dict[str, ProjectSnapshot]:
+        """
+        Fetches snapshots for all images concurrently.
+        :param full_paths: dict in format image: GitLab project full path
+        :param fork: fetch also forks of the project
+        :return: dict in format image: ProjectSnapshot.
+                 Images whose lookups failed are missing in the result.
+        """
+        images = list(full_paths)
+        results = await asyncio.gather(
+            *[self.get_snapshot(full_paths[image], fork=fork) for image in images],
+            return_exceptions=True,
+        )
+        snapshots = {}
+        for image, result in zip(images, results):
+            if isinstance(result, Exception):
+                logger.warning(f"GitLab pre-flight for {image} failed: {result!r}")
+                continue
+            snapshots[image] = result
+        return snapshots
+
+
+def fetch_snapshots(
+    api_url: str,
+    token: str,
+    full_paths: Dict[str, str],
+    fork: bool = False,
+    pool_size: int = GITLAB_POOL_SIZE,
+) -> Dict[str, ProjectSnapshot]:
+    """
+    Synchronous entry point for Celery tasks.
+    See AsyncGitLabClient.get_snapshots for details.
+    """
+
+    async def _fetch():
+        async with AsyncGitLabClient(api_url, token, pool_size=pool_size) as client:
+            return await client.get_snapshots(full_paths, fork=fork)
+
+    return asyncio.run(_fetch())
+
+
+def fetch_bot_cfgs(
+    api_url: str,
+    token: str,
+    full_paths: Dict[str, str],
+    branches: Dict[str, List[str]],
+    pool_size: int = GITLAB_POOL_SIZE,
+) -> Dict[str, Dict[str, Optional[BotCfgBlob]]]:
+    """
+    Synchronous entry point for Celery tasks.
+    See AsyncGitLabClient.get_bot_cfgs for details.
+    """
+
+    async def _fetch():
+        async with AsyncGitLabClient(api_url, token, pool_size=pool_size) as client:
+            return await client.get_bot_cfgs(full_paths, branches)
+
+    return asyncio.run(_fetch())
@@ -0,0 +1,247 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import logging
+import re
+import requests
+
+from typing import Dict, List
+
+from betka.constants import DOWNSTREAM_CONFIG_FILE, GITLAB_GRAPHQL_CHUNK
+from betka.exception import BetkaException
+from betka.metrics import requests_hook
+from betka.named_tuples import (
+    BotCfgBlob,
+    ProjectBranches,
+    ProjectMR,
+    ForkProtectedBranches,
+    ProjectInfo,
+    ProjectSnapshot,
+)
+from betka.utils import nested_get
+
+logger = logging.getLogger(__name__)
+
+
+requests.packages.urllib3.disable_warnings()
+
+
+# Limit of branchNames, the listing may be truncated when it is reached
+BRANCH_NAMES_LIMIT = 1000
+
+PROJECT_FIELDS = """
+    id
+    name
+    sshUrlToRepo
+    webUrl
+    repository {{
+      branchNames(searchPattern: "*", offset: 0, limit: {limit})
+      {blobs}
+    }}
+    branchRules {{
+      nodes {{
+        name
+        isProtected
+      }}
+      pageInfo {{
+        hasNextPage
+      }}
+    }}
+    mergeRequests(state: opened, first: 100) {{
+      pageInfo {{
+        hasNextPage
+      }}
+      nodes {{
+        iid
+        title
+        description
+        targetBranch
+        sourceBranch
+        author {{
+          username
+        }}
+        sourceProjectId
+        targetProjectId
+        webUrl
+      }}
+    }}
+"""
+
+BLOB_FIELDS = """{alias}: blobs(ref: {ref}, paths: [{path}]) {{
+        nodes {{
+          oid
+          rawBlob
+        }}
+      }}"""
+
+
+class GitLabGraphQL(object):
+    """
+    Builds GitLab state of several projects with one GraphQL query.
+
+    Each project is aliased as `p<N>` and `bot-cfg.yml` of each candidate
+    branch is aliased as `b<N>` inside the project repository.
+    """
+
+    def __init__(self, graphql_url: str, token: str):
+        self.graphql_url = graphql_url
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {token.strip()}",
+        }
+
+    @staticmethod
+    def _detect_api_errors(response):
+        """Looks for the errors in API response"""
+        msg = "\n".join((err["message"] for err in response.get("errors", [])))
+        if msg:
+            raise BetkaException(msg)
+
+    def send_query(self, query: str) -> Dict:
+        """Sends the query to GitLab GraphQL API and returns the response"""
+        resp = requests.post(
+            url=self.graphql_url,
+            json={"query": query},
+            headers=self.headers,
+            verify=False,
+            hooks={"response": requests_hook("gitlab_graphql")},
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    @staticmethod
+    def build_query(projects: List[str], branches: List[List[str]]) -> str:
+        """
+        :param projects: list of GitLab project full paths
+        :param branches: candidate branches for each project, whose bot-cfg.yml is read
+        :return: GraphQL query
+        """
+        aliased = []
+        for idx, full_path in enumerate(projects):
+            blobs = "\n      ".join(
+                BLOB_FIELDS.format(
+                    alias=f"b{b_idx}",
+                    ref=json.dumps(branch),
+                    path=json.dumps(DOWNSTREAM_CONFIG_FILE),
+                )
+                for b_idx, branch in enumerate(branches[idx])
+            )
+            aliased.append(
+                f"p{idx}: project(fullPath: {json.dumps(full_path)}) {{"
+                f"{PROJECT_FIELDS.format(blobs=blobs, limit=BRANCH_NAMES_LIMIT)}}}"
+            )
+        return "query {\n" + "\n".join(aliased) + "\n}"
+
+    @staticmethod
+    def is_protected(branch: str, rules: List[str]) -> bool:
+        """
+        Protected branch rules can contain `*` wildcards like `rhel-*`
+        """
+        for rule in rules:
+            pattern = ".*".join(re.escape(x) for x in rule.split("*"))
+            if re.fullmatch(pattern, branch):
+                return True
+        return False
+
+    @staticmethod
+    def parse_project(data: Dict, branches: List[str]) -> ProjectSnapshot:
+        """
+        Converts one aliased project from the GraphQL response into ProjectSnapshot.
+        Listings which do not fit into one page are left None,
+        they are fetched completely by REST then.
+        """
+        # GraphQL ids look like gid://gitlab/Project/123
+        project_id = int(data["id"].split("/")[-1])
+        web_url = data["webUrl"]
+        protected = [
+            x["name"]
+            for x in nested_get(data, "branchRules", "nodes", default=[])
+            if x["isProtected"]
+        ]
+        branch_names = nested_get(data, "repository", "branchNames", default=[]) or []
+        branches_truncated = len(branch_names) >= BRANCH_NAMES_LIMIT or nested_get(
+            data, "branchRules", "pageInfo", "hasNextPage", default=False
+        )
+        mrs_truncated = nested_get(
+            data, "mergeRequests", "pageInfo", "hasNextPage", default=False
+        )
+        bot_cfgs = {}
+        for idx, branch in enumerate(branches):
+            nodes = nested_get(data, "repository", f"b{idx}", "nodes", default=[])
+            bot_cfgs[branch] = (
+                BotCfgBlob(nodes[0]["oid"], nodes[0]["rawBlob"]) if nodes else None
+            )
+        return ProjectSnapshot(
+            info=ProjectInfo(project_id, data["name"], data["sshUrlToRepo"], web_url),
+            branches=None if branches_truncated else [
+                ProjectBranches(
+                    x, f"{web_url}/-/tree/{x}", GitLabGraphQL.is_protected(x, protected)
+                )
+                for x in branch_names
+            ],
+            protected_branches=None if branches_truncated else [
+                ForkProtectedBranches(x) for x in protected
+            ],
+            merge_requests=None if mrs_truncated else [
+                ProjectMR(
+                    int(x["iid"]),
+                    x["title"],
+                    x["description"],
+                    x["targetBranch"],
+                    nested_get(x, "author", "username"),
+                    x["sourceProjectId"],
+                    x["targetProjectId"],
+                    x["webUrl"],
+                    x["sourceBranch"],
+                )
+                for x in nested_get(data, "mergeRequests", "nodes", default=[])
+            ],
+            # Forks are not available in GraphQL, they are fetched by REST
+            forks=None,
+            bot_cfgs=bot_cfgs,
+        )
+
+    def get_snapshots(
+        self, full_paths: Dict[str, str], branches: Dict[str, List[str]]
+    ) -> Dict[str, ProjectSnapshot]:
+        """
+        :param full_paths: dict in format image: GitLab project full path
+        :param branches: dict in format image: candidate branches
+        :return: dict in format image: ProjectSnapshot.
+                 Images missing in GitLab are missing in the result.
+        """
+        images = list(full_paths)
+        snapshots = {}
+        for start in range(0, len(images), GITLAB_GRAPHQL_CHUNK):
+            chunk = images[start:start + GITLAB_GRAPHQL_CHUNK]
+            chunk_branches = [branches.get(image, []) for image in chunk]
+            query = self.build_query([full_paths[x] for x in chunk], chunk_branches)
+            response = self.send_query(query)
+            self._detect_api_errors(response)
+            for idx, image in enumerate(chunk):
+                data = nested_get(response, "data", f"p{idx}")
+                if not data:
+                    logger.warning(f"GitLab project for {image} was not found.")
+                    continue
+                snapshots[image] = self.parse_project(data, chunk_branches[idx])
+        return snapshots
@@ -0,0 +1,250 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+import logging
+import threading
+import time
+import requests
+import yaml
+
+from typing import Dict, Optional
+
+from celery.signals import worker_process_init
+
+from betka.celery_app import redis_client, redis_url
+from betka.constants import (
+    GLOBAL_CONFIG_INVALIDATE_CHANNEL,
+    GLOBAL_CONFIG_LISTENER_RETRY,
+    GLOBAL_CONFIG_MAX_STALE,
+    GLOBAL_CONFIG_REDIS_KEY,
+    SYNC_INTERVAL,
+)
+from betka.named_tuples import CachedConfig
+
+logger = logging.getLogger(__name__)
+
+
+requests.packages.urllib3.disable_warnings()
+
+
+class GlobalConfigCache(object):
+    """
+    Keeps parsed betka global configuration (betka-prod.yaml/betka-stage.yaml)
+    in the worker and in Redis, so the configuration is shared by all tasks
+    and all workers.
+
+    Once SYNC_INTERVAL expires the configuration is refreshed by a conditional
+    GET with the stored ETag. When GitHub is not reachable, the cached copy
+    is used until it is older than GLOBAL_CONFIG_MAX_STALE.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        interval: int = SYNC_INTERVAL,
+        max_stale: int = GLOBAL_CONFIG_MAX_STALE,
+    ):
+        self.redis_url = url
+        self.interval = interval
+        self.max_stale = max_stale
+        self.entries: Dict[str, CachedConfig] = {}
+        self._redis = None
+        self.listener: Optional[threading.Thread] = None
+
+    @property
+    def redis(self):
+        """
+        Shared cache of all workers, see redis_client.
+        """
+        if self._redis is None and self.redis_url:
+            self._redis = redis_client(
+                self.redis_url, "global config is cached per worker", socket_timeout=5
+            )
+            if self._redis is None:
+                self.redis_url = None
+        return self._redis
+
+    @staticmethod
+    def redis_key(config_url: str) -> str:
+        return GLOBAL_CONFIG_REDIS_KEY.format(url=config_url)
+
+    def load_shared(self, config_url: str) -> Optional[CachedConfig]:
+        if not self.redis:
+            return None
+        try:
+            data = self.redis.get(self.redis_key(config_url))
+        except Exception as ex:
+            logger.warning(f"Reading global config from Redis failed: {ex!r}")
+            return None
+        if not data:
+            return None
+        return CachedConfig(**json.loads(data))
+
+    def store(self, config_url: str, entry: CachedConfig):
+        self.entries[config_url] = entry
+        if not self.redis:
+            return
+        try:
+            self.redis.set(self.redis_key(config_url), json.dumps(entry._asdict()))
+        except Exception as ex:
+            logger.warning(f"Storing global config to Redis failed: {ex!r}")
+
+    def lookup(self, config_url: str) -> Optional[CachedConfig]:
+        """
+        Returns the newer one from the worker and the Redis copies
+        """
+        entries = [
+            x
+            for x in (self.entries.get(config_url), self.load_shared(config_url))
+            if x is not None
+        ]
+        if not entries:
+            return None
+        entry = max(entries, key=lambda x: x.fetched)
+        self.entries[config_url] = entry
+        return entry
+
+    def invalidate(self, config_url: Optional[str] = None, shared: bool = True):
+        """
+        Drops the cached configuration, next `get` downloads it again.
+        :param config_url: drop only this configuration, all if not specified
+        :param shared: drop also the Redis copy
+        """
+        urls = [config_url] if config_url else list(self.entries)
+        for url in urls:
+            self.entries.pop(url, None)
+        if not shared or not self.redis:
+            return
+        try:
+            keys = [self.redis_key(url) for url in urls] if config_url else list(
+                self.redis.scan_iter(self.redis_key("*"))
+            )
+            if keys:
+                self.redis.delete(*keys)
+        except Exception as ex:
+            logger.warning(f"Invalidating global config in Redis failed: {ex!r}")
+
+    def refresh(self, config_url: str, source_url: str) -> bool:
+        """
+        Downloads the configuration from source_url and stores it as config_url.
+        Used after a push, source_url points to the pushed commit, so the
+        content is not affected by caching of the branch URL on GitHub side.
+        :return: True if the configuration was refreshed
+        """
+        try:
+            result = requests.get(source_url, verify=False)
+            result.raise_for_status()
+        except requests.exceptions.RequestException as ex:
+            logger.warning(f"Downloading {source_url} failed: {ex!r}")
+            self.invalidate(config_url)
+            return False
+        config = yaml.safe_load(result.text)
+        self.store(config_url, CachedConfig(config, None, time.time()))
+        return True
+
+    def publish_invalidate(self, config_url: str = ""):
+        """
+        Tells all workers to drop their worker level copy of the configuration
+        """
+        self.invalidate(config_url or None, shared=False)
+        if not self.redis:
+            return
+        try:
+            self.redis.publish(GLOBAL_CONFIG_INVALIDATE_CHANNEL, config_url)
+        except Exception as ex:
+            logger.warning(f"Publishing global config invalidation failed: {ex!r}")
+
+    def listen(self):
+        """
+        Drops worker level copies for each invalidation message.
+        Runs forever, see start_listener.
+        """
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(GLOBAL_CONFIG_INVALIDATE_CHANNEL)
+        for message in pubsub.listen():
+            config_url = message["data"].decode() if message.get("data") else None
+            logger.info(f"Global configuration {config_url or ''} invalidated.")
+            self.invalidate(config_url, shared=False)
+
+    def _listen_forever(self):
+        while True:
+            try:
+                self.listen()
+            except Exception as ex:
+                logger.warning(f"Global config invalidation listener failed: {ex!r}")
+                # Copies could be missed meanwhile, drop them all
+                self.invalidate(shared=False)
+                time.sleep(GLOBAL_CONFIG_LISTENER_RETRY)
+
+    def start_listener(self):
+        """
+        Starts the invalidation listener thread once per process
+        """
+        if self.listener is not None or not self.redis:
+            return
+        self.listener = threading.Thread(
+            target=self._listen_forever, name="global-config-listener", daemon=True
+        )
+        self.listener.start()
+
+    def get(self, config_url: str, headers: Optional[Dict] = None) -> Dict:
+        """
+        Gets parsed global configuration.
+        :param config_url: URL of betka-prod.yaml or betka-stage.yaml
+        :param headers: additional request headers
+        :return: dict
+        """
+        entry = self.lookup(config_url)
+        now = time.time()
+        if entry and now - entry.fetched < self.interval:
+            return entry.config
+
+        request_headers = dict(headers or {})
+        if entry and entry.etag:
+            request_headers["If-None-Match"] = entry.etag
+        try:
+            result = requests.get(config_url, headers=request_headers, verify=False)
+            if entry and result.status_code == 304:
+                logger.debug(f"Global configuration {config_url} was not changed.")
+                self.store(config_url, entry._replace(fetched=now))
+                return entry.config
+            result.raise_for_status()
+        except requests.exceptions.RequestException as ex:
+            if entry and now - entry.fetched < self.max_stale:
+                logger.warning(
+                    f"Refreshing {config_url} failed: {ex!r}. Using cached configuration."
+                )
+                return entry.config
+            raise
+        config = yaml.safe_load(result.text)
+        self.store(config_url, CachedConfig(config, result.headers.get("ETag"), now))
+        return config
+
+
+GLOBAL_CONFIG = GlobalConfigCache(redis_url())
+
+
+@worker_process_init.connect
+def start_invalidation_listener(**kwargs):
+    GLOBAL_CONFIG.start_listener()
@@ -15,9 +15,104 @@
 
 from celery.utils.log import get_task_logger
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Dict, Tuple
+import atexit
 import json
 import logging
 import os
+import queue
+import threading
+import time
+
+try:
+    # orjson is several times faster than json, it is not available everywhere
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class lazy(object):
+    """
+    Argument of a log message evaluated only when the message is formatted,
+    e.g. self.debug("Remotes: %s", lazy(Git.get_remotes)).
+    Nothing is called when the level is disabled.
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+    def __repr__(self):
+        return repr(self.func(*self.args, **self.kwargs))
+
+
+class DailyFileHandler(TimedRotatingFileHandler):
+    """
+    Writes into {prefix}-{YYYYMMDD} and switches to the file of the new day
+    at midnight. Files are never renamed, so all worker processes
+    can append into the same file.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        super().__init__(self.dated_path(), when="midnight", delay=True, encoding="utf-8")
+
+    def dated_path(self) -> str:
+        return f"{self.prefix}-{datetime.now().strftime('%Y%m%d')}"
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self.baseFilename = os.path.abspath(self.dated_path())
+        self.rolloverAt = self.computeRollover(int(time.time()))
+
+
+# Queue handlers with their background writers, one per log file and process.
+# Forked Celery workers do not inherit the writer thread, so pid is part of the key.
+_FILE_HANDLERS: Dict[Tuple[int, str], Tuple[QueueHandler, QueueListener]] = {}
+_FILE_HANDLERS_LOCK = threading.Lock()
+
+
+def file_queue_handler(path: str, daily: bool = False) -> QueueHandler:
+    """
+    Returns the handler passing records to a background thread,
+    which writes them into the file. Log I/O never blocks the caller.
+    :param path: log file or prefix of daily log files
+    :param daily: write into {path}-{YYYYMMDD}
+    """
+    key = (os.getpid(), path)
+    with _FILE_HANDLERS_LOCK:
+        if key not in _FILE_HANDLERS:
+            if daily:
+                file_handler = DailyFileHandler(path)
+            else:
+                file_handler = logging.FileHandler(path, delay=True, encoding="utf-8")
+            records: queue.SimpleQueue = queue.SimpleQueue()
+            listener = QueueListener(records, file_handler)
+            listener.start()
+            handler = QueueHandler(records)
+            handler.betka_log_file = path
+            handler.betka_file_handler = file_handler
+            _FILE_HANDLERS[key] = (handler, listener)
+        return _FILE_HANDLERS[key][0]
+
+
+@atexit.register
+def stop_file_writers():
+    """
+    Flushes queued records of this process before exit
+    """
+    with _FILE_HANDLERS_LOCK:
+        for (pid, path), (_, listener) in list(_FILE_HANDLERS.items()):
+            if pid == os.getpid():
+                listener.stop()
+                del _FILE_HANDLERS[(pid, path)]
 
 
 class Logger(object):
@@ -51,11 +146,16 @@ class Logger(object):
         self.logger.setLevel(level)
         self.log_file = None
 
-        if not task_name:
+        if not task_name and not any(
+            getattr(h, "betka_stderr", False) for h in self.logger.handlers
+        ):
             # add stderr handler only if there's no task_name since Celery workers already have one
-            self.logger.addHandler(logging.StreamHandler())
+            stream_handler = logging.StreamHandler()
+            stream_handler.betka_stderr = True
+            self.logger.addHandler(stream_handler)
 
         if to_file:
+            daily = not file_path
             if file_path:
                 if additional:
                     raise ValueError("file_path and additional can't be both defined")
@@ -66,14 +166,27 @@ class Logger(object):
                     return
             else:  # file_path not specified, will log to default location
                 try:
-                    file_path = self.file_path(additional=additional)
+                    file_path = self.file_path(additional=additional, date=False)
                 except RuntimeError as exc:
                     # default log dir doesn't exist
                     self.logger.error(exc)
                     return
-            self.log_file = file_path
-            file_handler = logging.FileHandler(file_path)
-            self.logger.addHandler(file_handler)
+            self.add_file_handler(file_path, daily=daily)
+
+    def add_file_handler(self, path: str, daily: bool = False):
+        """
+        Attaches the queue handler of the file to the logger only once.
+        Task loggers are shared by all tasks executed by the worker,
+        the handler of a previous task or of the parent process is replaced.
+        """
+        handler = file_queue_handler(path, daily=daily)
+        for old in list(self.logger.handlers):
+            if getattr(old, "betka_log_file", None) == path and old is not handler:
+                self.logger.removeHandler(old)
+        if handler not in self.logger.handlers:
+            self.logger.addHandler(handler)
+        # current file, daily files are switched at midnight
+        self.log_file = handler.betka_file_handler.baseFilename
 
     def file_path(self, additional=None, date=True):
         """
@@ -87,15 +200,11 @@ class Logger(object):
         if not os.path.isdir(logs_dir):
             raise RuntimeError("{} is not a directory".format(logs_dir))
 
-        return (
-            "{dir}/{task}{additional}.log{date}".format(
-                dir=logs_dir,
-                task=self.task_name,
-                additional="-" + additional if additional else "",
-                date="-" + datetime.now().strftime("%Y%m%d"),
-            )
-            if date
-            else ""
+        return "{dir}/{task}{additional}.log{date}".format(
+            dir=logs_dir,
+            task=self.task_name,
+            additional="-" + additional if additional else "",
+            date="-" + datetime.now().strftime("%Y%m%d") if date else "",
         )
 
     @staticmethod
@@ -105,10 +214,18 @@ class Logger(object):
         :param msg: message to log
         :param args: arguments to msg
         """
+        if isinstance(msg, lazy):
+            msg = str(msg)
         if isinstance(msg, bytes):
             msg = msg.decode("utf-8")
         return msg % args if args else msg
 
+    def is_enabled_for(self, level) -> bool:
+        """
+        Nothing should be formatted or serialized for disabled levels.
+        """
+        return self.logger.isEnabledFor(level)
+
     def log(self, level, report_dict):
         """
         Logging workhorse.
@@ -116,6 +233,8 @@ class Logger(object):
         :param level: logging level as defined in logging module
         :param report_dict: dictionary to be logged, mandatory keys: 'message'
         """
+        if not self.is_enabled_for(level):
+            return
         msg = self.serialize(level, report_dict)
         if level == logging.CRITICAL:
             self.logger.critical(msg)
@@ -143,7 +262,11 @@ class Logger(object):
                 "time": str(datetime.utcnow()),
             }
         )
-        serialized = json.dumps(report_dict, sort_keys=True, indent=2)
-        # HACK: Pretty print newlines in values - strings. Feel free to fix it if you know better.
-        serialized = serialized.replace("\\n", "\n")
-        return serialized
+        # One record per line, newlines in values stay escaped
+        if orjson is not None:
+            return orjson.dumps(
+                report_dict, option=orjson.OPT_SORT_KEYS, default=str
+            ).decode("utf-8")
+        return json.dumps(
+            report_dict, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+        )
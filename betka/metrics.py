@@ -0,0 +1,281 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Prometheus metrics of betka workers.
+
+Celery prefork workers run tasks in several processes, so metrics are
+collected in prometheus_client multiprocess mode. Every process writes
+its samples into PROMETHEUS_MULTIPROC_DIR and one exporter started by
+`python -m betka.metrics` serves the sum over all processes.
+
+prometheus_client is optional, without it all metrics are no-ops.
+"""
+
+import logging
+import os
+import time
+
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Optional
+
+import aiohttp
+
+from betka.constants import (
+    GIT_TIMING_BUCKETS,
+    METRICS_API_BUCKETS,
+    METRICS_LATENCY_BUCKETS,
+    METRICS_PORT,
+    METRICS_STAGE_BUCKETS,
+)
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+# Message header with the time the task was published
+PUBLISHED_HEADER = "betka_published"
+
+
+class NoopMetric(object):
+    """
+    Used instead of prometheus_client metrics if the library is missing.
+    """
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def observe(self, amount: float):
+        pass
+
+
+def counter(name: str, documentation: str, labelnames) -> Any:
+    if prometheus_client is None:
+        return NoopMetric()
+    return prometheus_client.Counter(name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames, buckets) -> Any:
+    if prometheus_client is None:
+        return NoopMetric()
+    return prometheus_client.Histogram(name, documentation, labelnames, buckets=buckets)
+
+
+TASKS = counter(
+    "betka_tasks_total",
+    "Celery tasks by outcome: received, skipped, synced, succeeded, failed",
+    ["task", "outcome"],
+)
+QUEUE_WAIT = histogram(
+    "betka_queue_wait_seconds",
+    "Time between publishing and starting the task",
+    ["task"],
+    METRICS_LATENCY_BUCKETS,
+)
+STAGE_DURATION = histogram(
+    "betka_stage_duration_seconds",
+    "Duration of sync stages",
+    ["stage"],
+    METRICS_STAGE_BUCKETS,
+)
+API_REQUESTS = counter(
+    "betka_api_requests_total",
+    "GitLab, GitHub and Kubernetes API calls by status",
+    ["api", "status"],
+)
+API_DURATION = histogram(
+    "betka_api_request_duration_seconds",
+    "Duration of GitLab, GitHub and Kubernetes API calls",
+    ["api"],
+    METRICS_API_BUCKETS,
+)
+PUSH_TO_MR = histogram(
+    "betka_push_to_merge_request_seconds",
+    "Time between the upstream push and filing the downstream merge request",
+    ["image"],
+    METRICS_LATENCY_BUCKETS,
+)
+GIT_DURATION = histogram(
+    "betka_git_command_duration_seconds",
+    "Duration of git commands",
+    ["subcommand"],
+    GIT_TIMING_BUCKETS,
+)
+LOG_MESSAGES = counter(
+    "betka_log_messages_total",
+    "Messages logged by bots",
+    ["level"],
+)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times a sync stage, usable also as a method decorator:
+    clone, branch_discovery, generator_pod, copy, commit, push, merge_request
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage=name).observe(time.perf_counter() - start)
+
+
+def observe_api(api: str, status: Any, duration: float):
+    API_REQUESTS.labels(api=api, status=str(status)).inc()
+    API_DURATION.labels(api=api).observe(duration)
+
+
+@contextmanager
+def api_call(api: str):
+    """
+    Times an API call done by a client library without request hooks,
+    the status is taken from the `status` attribute of a raised exception.
+    """
+    start = time.perf_counter()
+    status: Any = "ok"
+    try:
+        yield
+    except Exception as ex:
+        status = getattr(ex, "status", None) or "error"
+        raise
+    finally:
+        observe_api(api, status, time.perf_counter() - start)
+
+
+def requests_hook(api: str):
+    """
+    Response hook of the requests library, e.g.
+    requests.get(url, hooks={"response": requests_hook("github")})
+    """
+
+    def hook(response, *args, **kwargs):
+        observe_api(api, response.status_code, response.elapsed.total_seconds())
+
+    return hook
+
+
+def aiohttp_trace_config(api: str) -> aiohttp.TraceConfig:
+    """
+    Records all requests of an aiohttp.ClientSession
+    """
+
+    async def on_request_start(session, ctx, params):
+        ctx.start = time.perf_counter()
+
+    async def on_request_end(session, ctx, params):
+        observe_api(api, params.response.status, time.perf_counter() - ctx.start)
+
+    async def on_request_exception(session, ctx, params):
+        observe_api(api, "error", time.perf_counter() - ctx.start)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """
+    Parses GitHub timestamps, either ISO 8601 strings or epoch seconds.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def observe_push_to_mr(image: str, pushed_at: Any):
+    pushed = parse_timestamp(pushed_at)
+    if pushed is not None:
+        PUSH_TO_MR.labels(image=image).observe(max(time.time() - pushed, 0))
+
+
+def count_task(task: str, outcome: str):
+    TASKS.labels(task=task, outcome=outcome).inc()
+
+
+def count_log(level: int):
+    LOG_MESSAGES.labels(level=logging.getLevelName(level)).inc()
+
+
+def on_before_task_publish(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault(PUBLISHED_HEADER, time.time())
+
+
+def on_task_received(request=None, **kwargs):
+    count_task(request.task_name, "received")
+
+
+def on_task_prerun(task=None, **kwargs):
+    published = getattr(task.request, PUBLISHED_HEADER, None)
+    if published is not None:
+        QUEUE_WAIT.labels(task=task.name).observe(max(time.time() - published, 0))
+
+
+def on_task_success(sender=None, **kwargs):
+    count_task(sender.name, "succeeded")
+
+
+def on_task_failure(sender=None, **kwargs):
+    count_task(sender.name, "failed")
+
+
+def on_worker_process_shutdown(pid=None, **kwargs):
+    if prometheus_client is not None and os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def serve(port: int = METRICS_PORT):
+    """
+    Serves metrics of all worker processes on http://<host>:<port>/metrics
+    """
+    if prometheus_client is None:
+        logger.error("prometheus_client is not installed, metrics are not exported.")
+        return
+    registry = prometheus_client.REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    prometheus_client.start_http_server(port, registry=registry)
+    logger.info(f"Serving metrics on port {port}")
+    while True:
+        time.sleep(3600)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve(int(os.getenv("BETKA_METRICS_PORT", METRICS_PORT)))
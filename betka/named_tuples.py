@@ -36,7 +36,9 @@ ProjectMR = namedtuple(
         "source_project_id",
         "target_project_id",
         "web_url",
+        "source_branch",
     ],
+    defaults=[None],
 )
 ProjectFork = namedtuple(
     "ProjectFork",
@@ -51,3 +53,36 @@ ProjectFork = namedtuple(
 )
 ForkProtectedBranches = namedtuple("ProtectedBranches", ["name"])
 ProjectInfo = namedtuple("ProjectInfo", ["id", "name", "ssh_url_to_repo", "web_url"])
+ProjectSnapshot = namedtuple(
+    "ProjectSnapshot",
+    ["info", "branches", "protected_branches", "merge_requests", "forks", "bot_cfgs"],
+    defaults=[None],
+)
+BotCfgBlob = namedtuple("BotCfgBlob", ["sha", "content"])
+PreparedBranch = namedtuple(
+    "PreparedBranch", ["branch", "origin_branch", "existing_mr", "config"]
+)
+CachedConfig = namedtuple("CachedConfig", ["config", "etag", "fetched"])
+FleetImage = namedtuple(
+    "FleetImage",
+    [
+        "name",
+        "url",
+        "normalized_url",
+        "owner",
+        "repo",
+        "synchronize_branches",
+        "values",
+    ],
+)
+CatFileObject = namedtuple("CatFileObject", ["sha", "type", "size", "data"])
+CommandResult = namedtuple(
+    "CommandResult", ["argv", "returncode", "output", "duration", "timed_out"]
+)
+GitTiming = namedtuple(
+    "GitTiming",
+    ["subcommand", "duration", "returncode", "timed_out", "repo", "image", "branch"],
+)
+DigestEvent = namedtuple(
+    "DigestEvent", ["image", "branch", "subject", "text", "sender", "smtp_server"]
+)
@@ -0,0 +1,326 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import json
+import logging
+import os
+import socket
+
+from smtplib import SMTP, SMTPException, SMTPServerDisconnected
+from typing import Any, Dict, List, Optional, Tuple
+
+from slack_sdk.webhook import WebhookClient
+
+from betka.celery_app import app, redis_client, redis_url
+from betka.constants import (
+    NOTIFICATION_BATCH,
+    NOTIFICATION_CLAIM_IDLE,
+    NOTIFICATION_DEAD_LETTER_MAXLEN,
+    NOTIFICATION_DEAD_LETTER_STREAM,
+    NOTIFICATION_GROUP,
+    NOTIFICATION_MAX_DELIVERIES,
+    NOTIFICATION_QUEUE,
+    NOTIFICATION_RETRY_KEY,
+    NOTIFICATION_STREAM,
+    NOTIFICATION_TASK,
+    SMTP_TIMEOUT,
+)
+from betka.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationSender(object):
+    """
+    Delivers notifications over connections reused by the whole worker:
+    one persistent SMTP connection per server and one webhook client per URL.
+    """
+
+    def __init__(self):
+        self.smtp: Dict[str, SMTP] = {}
+        self.webhooks: Dict[str, WebhookClient] = {}
+
+    def get_smtp(self, smtp_server: str) -> SMTP:
+        smtp = self.smtp.get(smtp_server)
+        if smtp is not None:
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except (SMTPException, OSError):
+                pass
+            self.close_smtp(smtp_server)
+        smtp = SMTP(smtp_server, timeout=SMTP_TIMEOUT)
+        self.smtp[smtp_server] = smtp
+        return smtp
+
+    def close_smtp(self, smtp_server: str):
+        smtp = self.smtp.pop(smtp_server, None)
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except (SMTPException, OSError):
+            smtp.close()
+
+    def send_mail(self, sender: str, receivers: List[str], message: str, smtp_server: str):
+        try:
+            self.get_smtp(smtp_server).sendmail(sender, receivers, message)
+        except SMTPServerDisconnected:
+            # server closed the idle connection between noop and sendmail
+            self.close_smtp(smtp_server)
+            self.get_smtp(smtp_server).sendmail(sender, receivers, message)
+        logger.debug("Email sent")
+
+    def send_webhook(self, url: str, text: str, blocks: List[Dict[str, Any]]):
+        webhook = self.webhooks.get(url)
+        if webhook is None:
+            webhook = self.webhooks[url] = WebhookClient(url)
+        response = webhook.send(text=text, blocks=blocks)
+        if response.status_code != 200:
+            logger.error("Return code is different from 200!!!!!")
+        if response.body != "ok":
+            logger.error("Return body is not 'OK'!!!!!")
+
+    def deliver(self, kind: str, payload: Dict[str, Any]):
+        with span("notification.deliver", kind=kind):
+            if kind == "email":
+                self.send_mail(**payload)
+            elif kind == "slack":
+                self.send_webhook(**payload)
+            else:
+                logger.error(f"Unknown notification {kind}, dropping it.")
+
+    def close(self):
+        for smtp_server in list(self.smtp):
+            self.close_smtp(smtp_server)
+
+
+class NotificationOutbox(object):
+    """
+    Durable outbox of notifications stored in a Redis stream.
+
+    Sync tasks only append entries and wake up the delivery task
+    on NOTIFICATION_QUEUE. Delivery reads entries through a consumer group,
+    so an entry is removed only after it was sent. Entries of a crashed
+    or failed delivery are claimed again after NOTIFICATION_CLAIM_IDLE seconds
+    by a delivery retry scheduled for that time.
+    After NOTIFICATION_MAX_DELIVERIES attempts the entry is moved
+    into NOTIFICATION_DEAD_LETTER_STREAM, so the outbox stream contains
+    only undelivered entries and it is never trimmed.
+    """
+
+    def __init__(self, url: Optional[str] = None, stream: str = NOTIFICATION_STREAM):
+        self.redis_url = url
+        self.stream = stream
+        self.group_created = False
+        self._redis = None
+
+    @property
+    def redis(self):
+        """
+        Outbox stream, notifications are sent directly when it is not available.
+        """
+        if self._redis is None and self.redis_url:
+            self._redis = redis_client(
+                self.redis_url,
+                "notifications are sent directly",
+                socket_timeout=5,
+                socket_connect_timeout=2,
+                decode_responses=True,
+            )
+            if self._redis is None:
+                self.redis_url = None
+        return self._redis
+
+    def publish(self, kind: str, payload: Dict[str, Any]) -> bool:
+        """
+        Appends the notification into the outbox.
+        :return: False if the outbox is not available
+        """
+        if not self.redis:
+            return False
+        try:
+            self.redis.xadd(self.stream, {"kind": kind, "payload": json.dumps(payload)})
+        except Exception as ex:
+            logger.warning(f"Storing notification into the outbox failed: {ex!r}")
+            return False
+        try:
+            app.send_task(NOTIFICATION_TASK, queue=NOTIFICATION_QUEUE)
+        except Exception as ex:
+            # the entry stays in the outbox and it is sent by the next delivery
+            logger.warning(f"Scheduling notification delivery failed: {ex!r}")
+        return True
+
+    def ensure_group(self):
+        if self.group_created:
+            return
+        try:
+            self.redis.xgroup_create(self.stream, NOTIFICATION_GROUP, id="0", mkstream=True)
+        except Exception as ex:
+            if "BUSYGROUP" not in str(ex):
+                raise
+        self.group_created = True
+
+    def read_batch(self, consumer: str, count: int) -> Tuple[List, List]:
+        """
+        :return: entries claimed from crashed or failed deliveries and new entries
+        """
+        _, claimed, *_ = self.redis.xautoclaim(
+            self.stream,
+            NOTIFICATION_GROUP,
+            consumer,
+            min_idle_time=NOTIFICATION_CLAIM_IDLE * 1000,
+            start_id="0-0",
+            count=count,
+        )
+        entries = []
+        for _, new_entries in self.redis.xreadgroup(
+            NOTIFICATION_GROUP, consumer, {self.stream: ">"}, count=count
+        ):
+            entries.extend(new_entries)
+        return claimed, entries
+
+    def drop_undeliverable(self, consumer: str, entries: List) -> List:
+        """
+        Moves claimed entries delivered too many times into the dead-letter stream.
+        :return: entries which should be delivered again
+        """
+        if not entries:
+            return entries
+        pending = self.redis.xpending_range(
+            self.stream,
+            NOTIFICATION_GROUP,
+            min=entries[0][0],
+            max=entries[-1][0],
+            count=len(entries),
+            consumername=consumer,
+        )
+        deliveries = {item["message_id"]: item["times_delivered"] for item in pending}
+        result = []
+        for entry_id, fields in entries:
+            # the current claim is counted as a delivery too
+            if deliveries.get(entry_id, 0) <= NOTIFICATION_MAX_DELIVERIES:
+                result.append((entry_id, fields))
+                continue
+            logger.error(
+                f"Notification {entry_id} was not delivered in "
+                f"{NOTIFICATION_MAX_DELIVERIES} attempts, moving it into "
+                f"{NOTIFICATION_DEAD_LETTER_STREAM}."
+            )
+            self.redis.xadd(
+                NOTIFICATION_DEAD_LETTER_STREAM,
+                dict(fields, id=entry_id),
+                maxlen=NOTIFICATION_DEAD_LETTER_MAXLEN,
+                approximate=True,
+            )
+            self.redis.xack(self.stream, NOTIFICATION_GROUP, entry_id)
+            self.redis.xdel(self.stream, entry_id)
+        return result
+
+    def deliver_entry(self, sender: NotificationSender, entry_id: str, fields: Dict) -> bool:
+        """
+        Sends the entry and removes it from the outbox.
+        Failed entry stays pending and it is claimed by a later delivery.
+        """
+        try:
+            sender.deliver(fields["kind"], json.loads(fields["payload"]))
+        except Exception as ex:
+            logger.warning(f"Delivering notification {entry_id} failed: {ex!r}")
+            return False
+        self.redis.xack(self.stream, NOTIFICATION_GROUP, entry_id)
+        self.redis.xdel(self.stream, entry_id)
+        return True
+
+    def deliver_pending(self, sender: NotificationSender, count: int = NOTIFICATION_BATCH) -> int:
+        """
+        Sends outbox entries in batches until there is nothing to read.
+        :return: number of delivered entries
+        """
+        if not self.redis:
+            return 0
+        self.ensure_group()
+        consumer = f"{socket.gethostname()}-{os.getpid()}"
+        delivered = 0
+        while True:
+            claimed, entries = self.read_batch(consumer, count)
+            if not claimed and not entries:
+                break
+            # entries left behind by a crashed or failed delivery go first
+            for entry_id, fields in self.drop_undeliverable(consumer, claimed) + entries:
+                delivered += self.deliver_entry(sender, entry_id, fields)
+        self.schedule_retry()
+        return delivered
+
+    def schedule_retry(self):
+        """
+        Runs the delivery again once the failed entries can be claimed.
+        Only one retry is scheduled at a time, see clear_retry.
+        """
+        if not self.redis.xpending(self.stream, NOTIFICATION_GROUP)["pending"]:
+            return
+        # the key outlives the countdown in case the retry task is lost
+        if not self.redis.set(
+            NOTIFICATION_RETRY_KEY, 1, nx=True, ex=2 * NOTIFICATION_CLAIM_IDLE
+        ):
+            return
+        try:
+            app.send_task(
+                NOTIFICATION_TASK,
+                kwargs={"retry": True},
+                queue=NOTIFICATION_QUEUE,
+                countdown=NOTIFICATION_CLAIM_IDLE,
+            )
+        except Exception as ex:
+            logger.warning(f"Scheduling notification delivery retry failed: {ex!r}")
+            self.clear_retry()
+
+    def clear_retry(self):
+        if self.redis:
+            self.redis.delete(NOTIFICATION_RETRY_KEY)
+
+
+# Worker wide outbox and connections
+OUTBOX = NotificationOutbox(redis_url())
+SENDER = NotificationSender()
+
+
+def notify(kind: str, payload: Dict[str, Any]):
+    """
+    Queues the notification, it is sent directly when the outbox is not available.
+    :param kind: "email" or "slack", see NotificationSender.deliver
+    """
+    with span("notification.notify", kind=kind):
+        if not OUTBOX.publish(kind, payload):
+            SENDER.deliver(kind, payload)
+
+
+def deliver_outbox(retry: bool = False) -> int:
+    """
+    Entry point of the delivery Celery task, sends all pending entries.
+    :param retry: the task was scheduled by NotificationOutbox.schedule_retry
+    """
+    if retry:
+        OUTBOX.clear_retry()
+    total = OUTBOX.deliver_pending(SENDER)
+    logger.info(f"Delivered {total} notifications from the outbox")
+    return total
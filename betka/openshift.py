@@ -35,6 +35,8 @@ from kubernetes.config import load_incluster_config
 from kubernetes.client.rest import ApiException
 
 from betka.exception import BetkaDeployException
+from betka.metrics import api_call
+from betka.tracing import span
 from betka.constants import NAME, GENERATOR_DIR, RETRY_CREATE_POD
 
 
@@ -66,7 +68,12 @@ class OpenshiftDeployer(object):
     @staticmethod
     def kubernetes_api() -> CoreV1Api:
         configuration = Configuration()
-        load_incluster_config(client_configuration=configuration)
+        api_url = os.getenv("BETKA_KUBERNETES_API_URL")
+        if api_url:
+            # API server outside of the cluster, e.g. the fake one used by benchmarks
+            configuration.host = api_url
+        else:
+            load_incluster_config(client_configuration=configuration)
         return CoreV1Api(ApiClient(configuration=configuration))
 
     def create_manifest_file(self) -> dict:
@@ -102,9 +109,10 @@ class OpenshiftDeployer(object):
 
     def get_pod(self) -> V1Pod:
         logger.debug("Check if pod is already running")
-        return self.api.read_namespaced_pod(
-            name=self.pod_name, namespace=self.project_name
-        )
+        with api_call("kubernetes"):
+            return self.api.read_namespaced_pod(
+                name=self.pod_name, namespace=self.project_name
+            )
 
     def is_pod_already_deployed(self) -> bool:
         """
@@ -131,9 +139,10 @@ class OpenshiftDeployer(object):
         :return: response from the API server
         """
         try:
-            self.api.delete_namespaced_pod(
-                self.pod_name, self.project_name, body=V1DeleteOptions()
-            )
+            with api_call("kubernetes"):
+                self.api.delete_namespaced_pod(
+                    self.pod_name, self.project_name, body=V1DeleteOptions()
+                )
         except ApiException as e:
             logger.debug(e)
             if e.status != 404:
@@ -148,9 +157,10 @@ class OpenshiftDeployer(object):
         for idx in range(1, RETRY_CREATE_POD):
             try:
                 logger.debug(f"Creating sandbox pod via kubernetes API, try {idx}")
-                return self.api.create_namespaced_pod(
-                    body=pod_manifest, namespace=self.project_name
-                )
+                with api_call("kubernetes"):
+                    return self.api.create_namespaced_pod(
+                        body=pod_manifest, namespace=self.project_name
+                    )
             except ApiException as ex:
                 logger.info(f"Unable to create the pod: {ex}")
                 # reproducer for this is to set memory quota for your cluster:
@@ -165,10 +175,12 @@ class OpenshiftDeployer(object):
 
     def get_pod_logs(self) -> str:
         """provide logs from the pod"""
-        return self.api.read_namespaced_pod_log(
-            name=self.pod_name, namespace=self.project_name
-        )
+        with api_call("kubernetes"):
+            return self.api.read_namespaced_pod_log(
+                name=self.pod_name, namespace=self.project_name
+            )
 
+    @span("kubernetes.deploy_pod")
     def deploy_pod(self) -> bool:
         logger.info(
             f"Deploying POD {self.pod_name} in project namespace {self.project_name}"
@@ -217,7 +229,7 @@ class OpenshiftDeployer(object):
 
     def deploy_image(self) -> bool:
         logger.info("Deploying image '%r' into a new POD.", self.image_name)
-        if "KUBERNETES_SERVICE_HOST" in os.environ:
+        if "KUBERNETES_SERVICE_HOST" in os.environ or "BETKA_KUBERNETES_API_URL" in os.environ:
             result = self.deploy_pod()
             if not result:
                 logger.error("Running POD FAILED. Check betka logs for reason.")
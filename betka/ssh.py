@@ -0,0 +1,260 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import atexit
+import logging
+import os
+import re
+import shlex
+import subprocess
+
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from betka.constants import SSH_CONTROL_DIR, SSH_CONTROL_PERSIST, SSH_CONTROL_TIMEOUT
+from betka.utils import run_argv
+
+logger = logging.getLogger(__name__)
+
+# git subcommands which talk to the remote repository
+NETWORK_GIT_COMMANDS = ["clone", "fetch", "push", "pull", "ls-remote", "remote", "submodule"]
+# scp-like git URL, e.g. git@gitlab.com:foo/bar.git
+SCP_URL = re.compile(r"^(?:[^@/]+@)?(?P<host>[^:/]+):")
+
+
+class SSHMultiplexer(object):
+    """
+    Keeps one SSH ControlMaster connection per GitLab host for the whole
+    lifetime of the worker, so git operations over SSH reuse the connection
+    instead of doing a new handshake and key exchange.
+
+    GIT_SSH_COMMAND is extended by ControlMaster options, so git itself
+    connects through the master socket. Before each network git operation
+    the master is checked by `ssh -O check` and started again if it died.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        user: str = "git",
+        control_dir: str = SSH_CONTROL_DIR,
+        persist: str = SSH_CONTROL_PERSIST,
+    ):
+        self.host = host
+        self.user = user
+        self.control_dir = Path(control_dir).expanduser()
+        self.persist = persist
+        self.base_command = os.environ.get("GIT_SSH_COMMAND", "ssh")
+        self.stats: Dict[str, int] = {"handshakes": 0, "operations": 0}
+
+    @property
+    def destination(self) -> str:
+        return f"{self.user}@{self.host}"
+
+    @property
+    def control_options(self) -> str:
+        # %C is a hash of the connection, it keeps the socket path short
+        return (
+            f"-o ControlMaster=auto "
+            f"-o ControlPath={shlex.quote(str(self.control_dir / '%C'))} "
+            f"-o ControlPersist={self.persist}"
+        )
+
+    @property
+    def ssh_command(self) -> str:
+        return f"{self.base_command} {self.control_options}"
+
+    def control(self, operation: str) -> int:
+        """
+        Sends the control command, like check or exit, to the master connection
+        :return: return code of ssh
+        """
+        argv = shlex.split(self.ssh_command) + ["-O", operation, self.destination]
+        return run_argv(argv, timeout=SSH_CONTROL_TIMEOUT).returncode
+
+    def is_multiplexed(self, url: str) -> bool:
+        """
+        :return: True if git connects to the URL over SSH to the multiplexed host
+        """
+        if "://" in url:
+            parsed = urlparse(url)
+            return parsed.scheme in ["ssh", "git+ssh"] and parsed.hostname == self.host
+        match = SCP_URL.match(url)
+        return bool(match) and match.group("host") == self.host
+
+    def enable(self):
+        """
+        Exports GIT_SSH_COMMAND with ControlMaster options
+        """
+        self.control_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        os.environ["GIT_SSH_COMMAND"] = self.ssh_command
+        logger.info(f"SSH multiplexing enabled for {self.destination}")
+
+    def is_alive(self) -> bool:
+        return self.control("check") == 0
+
+    def establish(self) -> bool:
+        """
+        Starts a new master connection in background.
+        A stale control socket is removed by `-O exit` first.
+        """
+        self.control("exit")
+        # the master forked by -f keeps its output open, so it is not captured
+        argv = shlex.split(self.ssh_command) + ["-M", "-N", "-f", self.destination]
+        try:
+            status = subprocess.run(
+                argv,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=SSH_CONTROL_TIMEOUT,
+            ).returncode
+        except subprocess.TimeoutExpired:
+            status = None
+        if status != 0:
+            logger.warning(f"SSH master connection to {self.destination} was not established.")
+            return False
+        self.stats["handshakes"] += 1
+        return True
+
+    def ensure_master(self) -> bool:
+        """
+        Called before each network git operation.
+        :return: True if the operation goes through a live master connection
+        """
+        self.stats["operations"] += 1
+        if self.is_alive():
+            return True
+        logger.info(f"SSH master connection to {self.destination} is down, re-establishing.")
+        return self.establish()
+
+    def close(self):
+        self.control("exit")
+
+    @property
+    def handshakes_saved(self) -> int:
+        return max(self.stats["operations"] - self.stats["handshakes"], 0)
+
+    def report(self) -> str:
+        return (
+            f"SSH multiplexing for {self.destination}: "
+            f"{self.stats['operations']} git operations, "
+            f"{self.stats['handshakes']} handshakes done, "
+            f"{self.handshakes_saved} handshakes saved"
+        )
+
+
+# Worker wide multiplexer, set by enable_multiplexing
+SSH_MULTIPLEXER: Optional[SSHMultiplexer] = None
+
+
+def enable_multiplexing(host: str, user: str = "git") -> SSHMultiplexer:
+    """
+    Enables the multiplexer once per worker.
+    Next calls return the already running one.
+    """
+    global SSH_MULTIPLEXER
+    if SSH_MULTIPLEXER is None or SSH_MULTIPLEXER.host != host:
+        SSH_MULTIPLEXER = SSHMultiplexer(host, user=user)
+        SSH_MULTIPLEXER.enable()
+        atexit.register(SSH_MULTIPLEXER.close)
+    return SSH_MULTIPLEXER
+
+
+def get_multiplexer() -> Optional[SSHMultiplexer]:
+    """
+    Returns the worker wide multiplexer, None if multiplexing is not enabled.
+    """
+    return SSH_MULTIPLEXER
+
+
+def _git_output(argv: List[str], cwd: Optional[str]) -> str:
+    result = run_argv(["git"] + argv, timeout=SSH_CONTROL_TIMEOUT, cwd=cwd)
+    return result.output if result.returncode == 0 else ""
+
+
+def remote_urls(cwd: Optional[str] = None, push: bool = False) -> Dict[str, str]:
+    """
+    :return: dict in format remote name: URL with insteadOf rewrites applied
+    """
+    urls = {}
+    kind = "(push)" if push else "(fetch)"
+    for line in _git_output(["remote", "-v"], cwd).splitlines():
+        fields = line.split()
+        if len(fields) == 3 and fields[2] == kind:
+            urls[fields[0]] = fields[1]
+    return urls
+
+
+def submodule_urls(cwd: Optional[str] = None) -> List[str]:
+    """
+    :return: URLs of submodules, relative ones are resolved against origin
+    """
+    output = _git_output(
+        ["config", "--file", ".gitmodules", "--get-regexp", r"^submodule\..*\.url$"], cwd
+    ) + _git_output(["config", "--get-regexp", r"^submodule\..*\.url$"], cwd)
+    urls = [line.split(" ", 1)[1] for line in output.splitlines() if " " in line]
+    if any(x.startswith("../") or x.startswith("./") for x in urls):
+        urls += list(remote_urls(cwd).values())[:1]
+    return urls
+
+
+def git_command_urls(args: List[str], cwd: Optional[str] = None) -> List[str]:
+    """
+    :param args: git arguments, the first one is the subcommand
+    :return: URLs the network git command talks to
+    """
+    subcommand = args[0]
+    positional = [x for x in args[1:] if not x.startswith("-")]
+    if subcommand == "submodule":
+        return submodule_urls(cwd) if positional[:1] == ["update"] else []
+    if subcommand == "clone":
+        return positional[:1]
+    if subcommand == "remote":
+        if positional[:1] != ["update"]:
+            return []
+        remotes = remote_urls(cwd)
+        return [remotes[x] for x in positional[1:] if x in remotes] or list(remotes.values())
+    remotes = remote_urls(cwd, push=subcommand == "push")
+    for arg in positional:
+        if arg in remotes:
+            return [remotes[arg]]
+        if "://" in arg or SCP_URL.match(arg):
+            return [arg]
+    return [remotes["origin"]] if "origin" in remotes else []
+
+
+def before_git_command(args: List[str], cwd: Optional[str] = None):
+    """
+    Checks the master connection if the git command talks to the multiplexed host over SSH
+    :param args: git arguments, the first one is the subcommand
+    :param cwd: directory of the repository
+    """
+    if SSH_MULTIPLEXER is None:
+        return
+    if not args or args[0] not in NETWORK_GIT_COMMANDS:
+        return
+    # Upstream repositories are cloned over https, the master is not used
+    if any(SSH_MULTIPLEXER.is_multiplexed(x) for x in git_command_urls(args, cwd)):
+        SSH_MULTIPLEXER.ensure_master()
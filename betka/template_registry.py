@@ -0,0 +1,144 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import logging
+import os
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import jinja2
+
+from celery.signals import worker_process_init
+
+from betka.constants import TEMPLATE_BYTECODE_CACHE, TEMPLATES
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateRegistry(object):
+    """
+    Process wide registry of compiled Jinja templates from one directory.
+
+    Templates are compiled once and kept by the environment. Source files
+    are checked for changes only when auto_reload is on, which is the case
+    for dev and test deployments only. Compiled bytecode is stored in
+    a FileSystemBytecodeCache, so a new worker process does not parse
+    the templates again.
+    """
+
+    def __init__(
+        self,
+        template_dir: str = TEMPLATES,
+        auto_reload: Optional[bool] = None,
+        bytecode_cache_dir: Optional[str] = TEMPLATE_BYTECODE_CACHE,
+    ):
+        self.template_dir = str(template_dir)
+        if auto_reload is None:
+            auto_reload = os.getenv("DEPLOYMENT") in ["dev", "test"]
+        bytecode_cache = None
+        if bytecode_cache_dir:
+            try:
+                Path(bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+            except OSError as ex:
+                logger.warning(f"Jinja bytecode cache {bytecode_cache_dir} is not usable: {ex}")
+        self.env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(searchpath=self.template_dir),
+            auto_reload=auto_reload,
+            bytecode_cache=bytecode_cache,
+            trim_blocks=True,
+            lstrip_blocks=True,
+        )
+        self.timings: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def compile_all(self) -> List[str]:
+        """
+        Compiles all templates in the directory, called when a worker starts.
+        :return: names of compiled templates
+        """
+        compiled = []
+        for name in self.env.list_templates():
+            try:
+                self.env.get_template(name)
+            except jinja2.TemplateError as te:
+                logger.error(f"Compiling template {name} failed: {te!r}")
+                continue
+            compiled.append(name)
+        logger.info(f"Compiled templates {compiled} from {self.template_dir}")
+        return compiled
+
+    def render(self, template_name: str, **context) -> str:
+        start = time.perf_counter()
+        output = self.env.get_template(template_name).render(**context)
+        self.record(template_name, time.perf_counter() - start)
+        return output
+
+    def record(self, name: str, duration: float):
+        with self.lock:
+            timing = self.timings.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+            timing["count"] += 1
+            timing["sum"] += duration
+            timing["max"] = max(timing["max"], duration)
+        logger.debug(f"Template {name} rendered in {duration * 1000:.2f}ms")
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Render-timing metric: number of renders, total and maximum seconds per template
+        """
+        with self.lock:
+            return {
+                name: {
+                    "count": x["count"],
+                    "sum": round(x["sum"], 6),
+                    "max": round(x["max"], 6),
+                }
+                for name, x in self.timings.items()
+            }
+
+
+_REGISTRIES: Dict[str, TemplateRegistry] = {}
+_REGISTRIES_LOCK = threading.Lock()
+
+
+def get_registry(template_dir: str = TEMPLATES) -> TemplateRegistry:
+    """
+    Returns the registry of the directory, it is created on the first use.
+    """
+    template_dir = str(template_dir)
+    with _REGISTRIES_LOCK:
+        if template_dir not in _REGISTRIES:
+            _REGISTRIES[template_dir] = TemplateRegistry(template_dir)
+        return _REGISTRIES[template_dir]
+
+
+@worker_process_init.connect
+def compile_templates(**kwargs):
+    """
+    Templates are compiled at worker start, not in the middle of a sync.
+    """
+    if Path(TEMPLATES).is_dir():
+        get_registry().compile_all()
@@ -0,0 +1,227 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+OpenTelemetry tracing of the sync pipeline.
+
+Spans are exported to an OTLP collector if OTEL_EXPORTER_OTLP_ENDPOINT
+is set, otherwise to the JSON lines file BETKA_TRACE_FILE. Without any
+of them, or without opentelemetry installed, spans are no-ops.
+
+Trace context is propagated from the publisher to the Celery task
+in the message headers, see the signal handlers below.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from betka.constants import TRACING_SERVICE_NAME
+
+try:
+    from opentelemetry import context as otel_context, propagate, trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor,
+        SpanExporter,
+        SpanExportResult,
+    )
+except ImportError:
+    trace = None
+    SpanExporter = object
+
+logger = logging.getLogger(__name__)
+
+# Spans of running Celery tasks with tokens of their attached contexts
+_TASK_SPANS: Dict[str, Any] = {}
+
+
+class NoopSpan(object):
+    """
+    Yielded by `span` if opentelemetry is not installed.
+    """
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        pass
+
+    def record_exception(self, exception: BaseException, **kwargs):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class JsonFileSpanExporter(SpanExporter):
+    """
+    Offline exporter, appends one JSON object per finished span to the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, spans) -> "SpanExportResult":
+        lines = "".join(
+            json.dumps(json.loads(x.to_json(indent=None)), separators=(",", ":")) + "\n"
+            for x in spans
+        )
+        try:
+            with self.lock, open(self.path, "a") as trace_file:
+                trace_file.write(lines)
+        except OSError as ex:
+            logger.warning(f"Writing spans into {self.path} failed: {ex!r}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+def span_attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Drops unset attributes, values which are not primitive types are converted to str
+    """
+    return {
+        key: value if isinstance(value, (str, bool, int, float)) else str(value)
+        for key, value in attributes.items()
+        if value is not None
+    }
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Runs the block in a new span, child of the current one.
+    Usable also as a decorator, e.g. @span("gitlab.get_branches")
+    """
+    if trace is None:
+        yield NOOP_SPAN
+        return
+    tracer = trace.get_tracer(__name__)
+    with tracer.start_as_current_span(name, attributes=span_attributes(attributes)) as current:
+        yield current
+
+
+def get_exporter() -> Optional["SpanExporter"]:
+    if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") or os.getenv(
+        "OTEL_EXPORTER_OTLP_TRACES_ENDPOINT"
+    ):
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+        except ImportError:
+            logger.warning("opentelemetry-exporter-otlp-proto-http is not installed.")
+        else:
+            return OTLPSpanExporter()
+    trace_file = os.getenv("BETKA_TRACE_FILE")
+    if trace_file:
+        return JsonFileSpanExporter(trace_file)
+    return None
+
+
+def configure_tracer_provider(**kwargs) -> Optional["TracerProvider"]:
+    """
+    Sets up export of spans, connected to worker_process_init,
+    so the exporting thread is started in each worker process.
+    """
+    if trace is None:
+        return None
+    exporter = get_exporter()
+    if exporter is None:
+        return None
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": TRACING_SERVICE_NAME})
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    try:
+        # python-gitlab and GitHub calls are traced by the requests instrumentation
+        from opentelemetry.instrumentation.requests import RequestsInstrumentor
+    except ImportError:
+        pass
+    else:
+        RequestsInstrumentor().instrument()
+    logger.info(f"Tracing enabled, spans are exported by {type(exporter).__name__}")
+    return provider
+
+
+def on_before_task_publish(headers=None, **kwargs):
+    if trace is not None and headers is not None:
+        propagate.inject(headers)
+
+
+def on_task_prerun(task_id=None, task=None, **kwargs):
+    if trace is None:
+        return
+    carrier = {
+        key: getattr(task.request, key)
+        for key in propagate.get_global_textmap().fields
+        if getattr(task.request, key, None)
+    }
+    task_span = trace.get_tracer(__name__).start_span(
+        f"celery.task {task.name}",
+        context=propagate.extract(carrier),
+        kind=trace.SpanKind.CONSUMER,
+        attributes={"celery.task_id": task_id},
+    )
+    token = otel_context.attach(trace.set_span_in_context(task_span))
+    _TASK_SPANS[task_id] = (task_span, token)
+
+
+def on_task_failure(task_id=None, exception=None, **kwargs):
+    if task_id in _TASK_SPANS and exception is not None:
+        task_span = _TASK_SPANS[task_id][0]
+        task_span.record_exception(exception)
+        task_span.set_status(trace.Status(trace.StatusCode.ERROR, str(exception)))
+
+
+def on_task_postrun(task_id=None, state=None, **kwargs):
+    if task_id not in _TASK_SPANS:
+        return
+    task_span, token = _TASK_SPANS.pop(task_id)
+    otel_context.detach(token)
+    if state:
+        task_span.set_attribute("celery.state", state)
+    task_span.end()
+
+
+def on_worker_process_shutdown(**kwargs):
+    """
+    Exports finished spans before the process exits
+    """
+    if trace is None:
+        return
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "force_flush"):
+        provider.force_flush()
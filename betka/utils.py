@@ -24,15 +24,29 @@
 import logging
 import shutil
 import os
+import codecs
 import json
 import jinja2
+import select
+import signal
 import subprocess
+import threading
+import time
 
-from slack_sdk.webhook import WebhookClient
+from collections import deque
 from contextlib import contextmanager
-from typing import Any
+from typing import Any, Dict, List, Optional
 from pathlib import Path
-from betka.constants import HOME
+from betka.constants import (
+    HOME,
+    COMMAND_OUTPUT_LIMIT,
+    COMMAND_KILL_GRACE,
+    COMMAND_OUTPUT_GRACE,
+)
+from betka.named_tuples import CommandResult
+from betka.digest import DIGEST
+from betka.notifications import notify
+from betka.template_registry import get_registry
 
 logger = logging.getLogger(__name__)
 
@@ -73,6 +87,133 @@ def run_cmd(cmd, return_output=False, ignore_error=False, shell=False, **kwargs)
             raise cpe
 
 
+class BoundedBuffer(object):
+    """
+    Keeps the last `limit` characters of a command output
+    """
+
+    def __init__(self, limit: int = COMMAND_OUTPUT_LIMIT):
+        self.limit = limit
+        self.lines: deque = deque()
+        self.size = 0
+        self.dropped = 0
+
+    def append(self, line: str):
+        self.lines.append(line)
+        self.size += len(line)
+        while self.size > self.limit and len(self.lines) > 1:
+            dropped = self.lines.popleft()
+            self.size -= len(dropped)
+            self.dropped += len(dropped)
+
+    def getvalue(self) -> str:
+        output = "".join(self.lines)
+        if self.dropped:
+            output = f"[... {self.dropped} characters truncated ...]\n" + output
+        return output
+
+
+def _read_lines(stream, buffer: BoundedBuffer, stop: threading.Event):
+    """
+    Reads the output line by line until EOF. Once `stop` is set,
+    the output already written into the pipe is read and the reader ends.
+    """
+    fd = stream.fileno()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    while True:
+        ready, _, _ = select.select([fd], [], [], 0 if stop.is_set() else 0.1)
+        if not ready:
+            if stop.is_set():
+                break
+            continue
+        chunk = os.read(fd, 64 * 1024)
+        if not chunk:
+            break
+        lines = (pending + decoder.decode(chunk)).splitlines(keepends=True)
+        pending = lines.pop() if not lines[-1].endswith("\n") else ""
+        for line in lines:
+            buffer.append(line)
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        buffer.append(pending)
+
+
+def _kill_process_group(process: subprocess.Popen):
+    """
+    Terminates the whole process group, e.g. git and its ssh child,
+    and kills it if it does not exit in COMMAND_KILL_GRACE seconds.
+    """
+    for sig in [signal.SIGTERM, signal.SIGKILL]:
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            process.wait(timeout=COMMAND_KILL_GRACE)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def run_argv(
+    argv: List[str],
+    timeout: Optional[float] = None,
+    cwd: Optional[str] = None,
+    env: Optional[Dict[str, str]] = None,
+    max_output: int = COMMAND_OUTPUT_LIMIT,
+) -> CommandResult:
+    """
+    Executes argv without shell. Merged stdout and stderr is streamed line
+    by line into a buffer keeping only the last `max_output` characters.
+    The command runs in its own process group, which is killed
+    when `timeout` expires.
+
+    :param argv: command and its arguments
+    :param timeout: wall-clock timeout in seconds, None means no timeout
+    :param cwd: working directory
+    :param env: environment of the command
+    :param max_output: maximum number of kept output characters
+    :return: CommandResult, it never raises for nonzero return code
+    """
+    logger.debug("command: %r", argv)
+    start = time.monotonic()
+    process = subprocess.Popen(
+        argv,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        cwd=cwd,
+        env=env,
+        start_new_session=True,
+    )
+    buffer = BoundedBuffer(max_output)
+    stop = threading.Event()
+    reader = threading.Thread(
+        target=_read_lines, args=(process.stdout, buffer, stop), daemon=True
+    )
+    reader.start()
+    timed_out = False
+    try:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        logger.error(f"Command {argv} timed out after {timeout} seconds, killing it.")
+        _kill_process_group(process)
+        returncode = process.wait()
+    reader.join(COMMAND_OUTPUT_GRACE)
+    if reader.is_alive():
+        # The command exited, but its descendant still holds the output pipe
+        logger.warning(f"Output of {argv} is still open after the command exited.")
+        _kill_process_group(process)
+        stop.set()
+        reader.join(COMMAND_OUTPUT_GRACE)
+    process.stdout.close()
+    return CommandResult(
+        argv, returncode, buffer.getvalue(), time.monotonic() - start, timed_out
+    )
+
+
 def text_from_template(template_dir, template_filename, template_data):
     """
     Create text based on template in path template_dir/template_filename
@@ -81,16 +222,13 @@ def text_from_template(template_dir, template_filename, template_data):
     :param template_data: dict, data for substitution in template
     :return: string
     """
-
-    if not os.path.exists(os.path.join(template_dir, template_filename)):
+    try:
+        output_text = get_registry(template_dir).render(
+            template_filename, template_data=template_data
+        )
+    except jinja2.TemplateNotFound:
         raise FileNotFoundError("Path to template not found.")
-
-    template_loader = jinja2.FileSystemLoader(searchpath=template_dir)
-    template_env = jinja2.Environment(loader=template_loader)
-    template = template_env.get_template(template_filename)
-    output_text = template.render(template_data=template_data)
-    logger.debug("Text from template created:")
-    logger.debug(output_text)
+    logger.debug("Text from template created:\n%s", output_text)
 
     return output_text
 
@@ -149,6 +287,9 @@ class FileUtils:
         :param dir_name: Directory for showing files
         """
         logger.info("Look for a content in '%s' directory", str(dir_name))
+        # Walking the whole tree is needed only for debug output
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         for f in dir_name.rglob("*"):
             if str(f).startswith(".git"):
                 continue
@@ -156,7 +297,9 @@ class FileUtils:
 
     @staticmethod
     def load_config_json():
-        with open(f"{HOME}/config.json") as config_file:
+        # BETKA_CONFIG_JSON points to another configuration, e.g. in benchmarks
+        config_path = os.getenv("BETKA_CONFIG_JSON", f"{HOME}/config.json")
+        with open(config_path) as config_file:
             data = json.load(config_file)
         #logger.info(data)
         return data
@@ -199,20 +342,27 @@ def nested_get(d: dict, *keys, default=None) -> Any:
 class SlackNotifications:
     @staticmethod
     def send_webhook_notification(url: str, message: str):
-        webhook = WebhookClient(url)
-        response = webhook.send(
-            text="fallback",
-            blocks=[
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"<upstream2downstream bot>: {message}",
-                    },
-                }
-            ],
+        """
+        Stores the message into the notification outbox,
+        it is sent by the notification worker.
+        During a sync run the message is aggregated into the run digest.
+        """
+        if DIGEST.active:
+            DIGEST.add_slack(url, message)
+            return
+        notify(
+            "slack",
+            {
+                "url": url,
+                "text": "fallback",
+                "blocks": [
+                    {
+                        "type": "section",
+                        "text": {
+                            "type": "mrkdwn",
+                            "text": f"<upstream2downstream bot>: {message}",
+                        },
+                    }
+                ],
+            },
         )
-        if response.status_code != 200:
-            logger.error("Return code is different from 200!!!!!")
-        if response.body != "ok":
-            logger.error("Return body is not 'OK'!!!!!")
@@ -49,4 +49,13 @@ export LC_ALL="C"
 export PATH="/usr/local/oc-v4/bin:$PATH"
 # This part can be used for LOCAL TESTING
 # exec python3 /home/betka/tasks.py
+# Celery worker processes write metrics into PROMETHEUS_MULTIPROC_DIR,
+# one exporter serves the sum over all of them
+export PROMETHEUS_MULTIPROC_DIR=/var/tmp/betka-metrics
+rm -rf "${PROMETHEUS_MULTIPROC_DIR}"
+mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+python3 -m betka.metrics &
+# Emails and Slack messages are sent from the outbox by a dedicated worker,
+# so sync tasks never wait for them
+celery -A tasks worker -Q queue.betka.notifications -n notifications@%h --loglevel=info --concurrency=1 &
 exec celery -A tasks worker -Q queue.betka.fedora --loglevel=debug --concurrency=1
@@ -1,13 +1,26 @@
 from betka.celery_app import app
 
 from betka.core import Betka
+from betka.metrics import count_task
+from betka.notifications import deliver_outbox
 
 
 @app.task(name="task.betka.master_sync")
 def master_sync(message):
     betka = Betka(task_name="task.betka.master_sync")
+    if betka.handle_global_config_push(message):
+        count_task(master_sync.name, "global_config")
+        return
     if betka.get_master_fedmsg_info(message) and betka.prepare():
         betka.run_sync()
+        count_task(master_sync.name, "synced")
+    else:
+        count_task(master_sync.name, "skipped")
+
+
+@app.task(name="task.betka.deliver_notifications")
+def deliver_notifications(retry=False):
+    deliver_outbox(retry=retry)
 
 
 # @app.task(name="task.betka.pr_sync")
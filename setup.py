@@ -15,7 +15,7 @@ def get_requirements():
 setup(
     name="betka",
     version="0.13.2",
-    packages=find_packages(exclude=["examples", "tests"]),
+    packages=find_packages(exclude=["benchmarks", "examples", "tests"]),
     url="https://github.com/sclorg/betka",
     license="GPLv3+",
     author="Petr Hracek",
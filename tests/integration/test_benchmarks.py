@@ -0,0 +1,90 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test end-to-end benchmark harness"""
+
+import copy
+import json
+
+import requests
+
+from benchmarks import compare, replay
+from benchmarks.fake_gitlab import FakeGitLab
+from benchmarks.fixtures import create_fleet
+from betka.gitlab_graphql import GitLabGraphQL
+
+
+class TestBenchmarks(object):
+    def test_fake_gitlab_graphql(self, tmp_path):
+        fleet = create_fleet(tmp_path, images=2, branches=2, files=3, file_size=100)
+        gitlab = FakeGitLab(tmp_path / "downstream", "bench", fleet.images)
+        gitlab.start()
+        try:
+            snapshots = GitLabGraphQL(f"{gitlab.url}/api/graphql", "token").get_snapshots(
+                full_paths={x: f"bench/{x}" for x in fleet.images + ["missing"]},
+                branches={x: fleet.branches + ["main"] for x in fleet.images},
+            )
+            branches = requests.get(
+                f"{gitlab.api_url}projects/bench%2Fbench-001/repository/branches",
+                params={"per_page": 2},
+            )
+        finally:
+            gitlab.stop()
+        assert sorted(snapshots) == fleet.images
+        snapshot = snapshots["bench-001"]
+        assert snapshot.info.id == 1001
+        assert snapshot.info.ssh_url_to_repo == "git@gitlab.com:bench/bench-001.git"
+        assert sorted(x.name for x in snapshot.branches) == ["main"] + fleet.branches
+        assert snapshot.bot_cfgs["main"] is None
+        assert "upstream_branch_name: main" in snapshot.bot_cfgs["rhel-9.0.0"].content
+        assert branches.headers["X-Next-Page"] == "2"
+        assert gitlab.requests["GET /api/v4/projects/{id}/repository/branches"] == 1
+
+    def test_replay(self, tmp_path):
+        args = replay.parse_args(
+            ["--images", "1", "--branches", "2", "--files", "5", "--workdir", str(tmp_path)]
+        )
+        results = replay.run(args)
+        assert results["errors"] == []
+        assert results["sync"]["count"] == 1
+        assert results["merge_requests_created"] == 2
+        assert results["stages"]["push"]["count"] == 2
+        assert results["server_requests"]["FakeGitLab"]["POST /api/graphql"] == 1
+        json.dumps(results)
+
+    def test_compare(self):
+        baseline = {
+            "config": {"images": 1},
+            "throughput": 1.0,
+            "sync": {"count": 1, "mean": 1.0, "p90": 1.0},
+            "push_to_mr": {"count": 0},
+            "stages": {"clone": {"count": 1, "mean": 0.5, "p90": 0.5}},
+            "errors": [],
+        }
+        current = copy.deepcopy(baseline)
+        current["stages"]["clone"].update(mean=0.6, p90=0.52)
+        report, regressions = compare.compare(baseline, current, threshold=0.1)
+        assert len(report) == 5
+        assert report[3].endswith("REGRESSION")
+        assert len(regressions) == 1
+        assert "stages.clone.mean" in regressions[0]
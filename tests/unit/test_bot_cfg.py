@@ -0,0 +1,74 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test bot-cfg.yml loader"""
+
+from pathlib import Path
+
+from flexmock import flexmock
+
+from betka.bot_cfg import BotCfgLoader, git_blob_sha
+from betka.utils import run_cmd
+
+BOT_CFG = Path(__file__).parent.parent / "data/bot-configs/bot-cfg.yml"
+
+
+class TestBotCfgLoader(object):
+    def setup_method(self):
+        self.loader = BotCfgLoader(maxsize=2)
+
+    def test_git_blob_sha(self):
+        assert git_blob_sha(BOT_CFG.read_bytes()) == run_cmd(
+            f"git hash-object {BOT_CFG}", return_output=True, shell=True
+        ).strip()
+
+    def test_parsed_once(self):
+        flexmock(self.loader).should_receive("parse").once().and_return({"version": "1"})
+        content = BOT_CFG.read_text()
+        first = self.loader.load_file(BOT_CFG)
+        assert self.loader.load(content) == first
+        assert self.loader.load(None, sha=git_blob_sha(content.encode())) == first
+        assert self.loader.stats == {"hits": 2, "misses": 1}
+
+    def test_unknown_sha_without_content(self):
+        assert self.loader.load(None, sha="abcd") is None
+
+    def test_lru_bound(self):
+        for version in ["1", "2", "3"]:
+            self.loader.load(f"version: '{version}'\n", sha=version)
+        assert "1" not in self.loader
+        assert "3" in self.loader
+
+    def test_validation_errors(self):
+        assert self.loader.validate({"version": "1"}) == []
+        assert self.loader.validate({"version": 1}) == ["version: 1 is not of type 'string'"]
+        # Config which does not match the schema is rejected, also from the cache
+        assert self.loader.load("version: 1\n", sha="abcd") is None
+        assert self.loader.load(None, sha="abcd") is None
+
+    def test_cached_config_copied(self):
+        first = self.loader.load_file(BOT_CFG)
+        first["upstream-to-downstream"]["upstream_git_path"] = "changed"
+        second = self.loader.load_file(BOT_CFG)
+        assert second is not first
+        assert second["upstream-to-downstream"].get("upstream_git_path") != "changed"
@@ -26,13 +26,19 @@
 import os
 import pytest
 
+from subprocess import CalledProcessError
+
 from flexmock import flexmock
 
 from betka.core import Betka
+from betka.emails import BetkaEmails
+from betka.git import Git
+from betka.global_config import GLOBAL_CONFIG
+from betka.utils import FileUtils
 from betka.utils import SlackNotifications
-from betka.named_tuples import ProjectMR
+from betka.named_tuples import ProjectMR, PreparedBranch
 
-from tests.conftest import betka_yaml, betka_yaml_specific_branches
+from tests.conftest import betka_yaml, betka_yaml_specific_branches, config_json
 
 class TestBetkaDevelMode(object):
     def setup_method(self):
@@ -222,3 +228,182 @@ class TestBetkaCore(object):
         )
         flexmock(SlackNotifications).should_receive("send_webhook_notification").once()
         assert self.betka.slack_notification()
+
+
+class TestBetkaBatchPush(object):
+    def setup_method(self):
+        os.environ["GITHUB_API_TOKEN"] = "aklsdjfh19p3845yrp"
+        os.environ["PAGURE_API_TOKEN"] = "testing"
+        os.environ["GITLAB_USER"] = "testymctestface"
+        self.betka = Betka()
+        self.betka.betka_config = betka_yaml()
+        self.betka.betka_config["devel_mode"] = "false"
+        self.betka.betka_config["use_gitlab_forks"] = "false"
+        self.betka.config_json = {"batch_push": "True"}
+        self.prepared = [
+            PreparedBranch("betka-fc40", "fc40", None, {}),
+            PreparedBranch("betka-fc41", "fc41", None, {}),
+        ]
+
+    def test_batch_push_enabled(self):
+        assert self.betka.is_batch_push_enabled()
+        self.betka.config_json = {}
+        assert not self.betka.is_batch_push_enabled()
+
+    def test_push_prepared_branches(self):
+        flexmock(Git).should_receive("git_push_atomic").with_args(
+            ["betka-fc40", "betka-fc41"], set_upstream=True, leased=[]
+        ).once().and_return(True)
+        flexmock(self.betka).should_receive("file_gitlab_merge_request").with_args(
+            branch="betka-fc40", origin_branch="fc40"
+        ).once()
+        flexmock(self.betka).should_receive("file_gitlab_merge_request").with_args(
+            branch="betka-fc41", origin_branch="fc41"
+        ).once()
+        assert self.betka.push_prepared_branches(self.prepared)
+        assert self.betka.downstream_git_origin_branch == "fc41"
+
+    def test_push_prepared_branches_failed(self):
+        flexmock(Git).should_receive("git_push_atomic").and_return(False)
+        flexmock(BetkaEmails).should_receive("send_email").once()
+        flexmock(self.betka).should_receive("file_gitlab_merge_request").never()
+        assert not self.betka.push_prepared_branches(self.prepared)
+
+
+class TestBetkaReuseMRBranch(object):
+    def setup_method(self):
+        os.environ["GITHUB_API_TOKEN"] = "aklsdjfh19p3845yrp"
+        os.environ["PAGURE_API_TOKEN"] = "testing"
+        os.environ["GITLAB_USER"] = "testymctestface"
+        self.betka = Betka()
+        self.betka.betka_config = betka_yaml()
+        self.betka.config_json = config_json()
+        self.mr = ProjectMR(
+            2, "[betka-master-sync]", "", "fc40", "phracek", None, 1, "",
+            source_branch="betka-20240101000000-fc40",
+        )
+
+    @pytest.mark.parametrize(
+        "source_branch,result",
+        [
+            ("betka-20240101000000-fc40", "betka-20240101000000-fc40"),
+            ("fc40", None),
+            (None, None),
+        ],
+    )
+    def test_get_existing_mr_branch(self, source_branch, result):
+        flexmock(self.betka.gitlab_api).should_receive(
+            "check_gitlab_merge_requests"
+        ).and_return(self.mr._replace(source_branch=source_branch))
+        assert self.betka.get_existing_mr_branch("fc40") == result
+
+    def test_is_reused_branch(self):
+        assert self.betka.is_reused_branch(self.mr, "betka-20240101000000-fc40")
+        assert not self.betka.is_reused_branch(self.mr, "betka-20240202000000-fc40")
+        assert not self.betka.is_reused_branch(None, "betka-20240101000000-fc40")
+
+    def test_delete_orphaned_branches(self):
+        self.betka.betka_config["devel_mode"] = "false"
+        flexmock(self.betka.gitlab_api).should_receive("get_orphaned_branches").with_args(
+            keep=["betka-20240101000000-fc40"]
+        ).and_return(["betka-20230101000000-fc40"])
+        flexmock(Git).should_receive("delete_remote_branches").with_args(
+            ["betka-20230101000000-fc40"]
+        ).once().and_return(True)
+        self.betka.delete_orphaned_branches(keep=["betka-20240101000000-fc40"])
+
+
+class TestBetkaGlobalConfigPush(object):
+    def setup_method(self):
+        os.environ["GITHUB_API_TOKEN"] = "aklsdjfh19p3845yrp"
+        os.environ["PAGURE_API_TOKEN"] = "testing"
+        os.environ["GITLAB_USER"] = "testymctestface"
+        self.betka = Betka()
+        cfg = config_json()
+        cfg["betka_url_base"] = "https://github.com/sclorg/betka/raw/master/"
+        flexmock(FileUtils).should_receive("load_config_json").and_return(cfg)
+
+    @staticmethod
+    def push_message(full_name, ref, modified):
+        return {
+            "body": {
+                "ref": ref,
+                "after": "abcd",
+                "repository": {"full_name": full_name},
+                "commits": [{"added": [], "modified": modified, "removed": []}],
+            }
+        }
+
+    def test_config_push(self):
+        flexmock(GLOBAL_CONFIG).should_receive("refresh").with_args(
+            "https://github.com/sclorg/betka/raw/master/betka-prod.yaml",
+            "https://github.com/sclorg/betka/raw/abcd/betka-prod.yaml",
+        ).once()
+        flexmock(GLOBAL_CONFIG).should_receive("publish_invalidate").once()
+        message = self.push_message(
+            "sclorg/betka", "refs/heads/master", ["betka-prod.yaml", "README.md"]
+        )
+        assert self.betka.handle_global_config_push(message)
+
+    @pytest.mark.parametrize(
+        "full_name,ref,modified",
+        [
+            ("sclorg/betka", "refs/heads/master", ["README.md"]),
+            ("sclorg/betka", "refs/heads/devel", ["betka-prod.yaml"]),
+            ("sclorg/s2i-base-container", "refs/heads/master", ["betka-prod.yaml"]),
+        ],
+    )
+    def test_not_config_push(self, full_name, ref, modified):
+        flexmock(GLOBAL_CONFIG).should_receive("publish_invalidate").never()
+        message = self.push_message(full_name, ref, modified)
+        assert not self.betka.handle_global_config_push(message)
+
+
+class TestBetkaSparseClone(object):
+    def setup_method(self):
+        os.environ["GITHUB_API_TOKEN"] = "aklsdjfh19p3845yrp"
+        os.environ["GITLAB_USER"] = "testymctestface"
+        self.betka = Betka()
+        self.betka.betka_config = {}
+        self.betka.config_json = {"upstream_clone_mode": "sparse"}
+        self.betka.msg_upstream_url = "https://github.com/sclorg/s2i-base-container"
+        self.betka.upstream_hash = "abcd"
+        self.betka.upstream_cloned_dir = "s2i-base-container"
+
+    def test_sparse_clone(self):
+        flexmock(Git).should_receive("sparse_clone_repo").and_return("sparse")
+        flexmock(Git).should_receive("clone_repo").never()
+        assert self.betka.prepare_upstream_git()
+        assert self.betka.upstream_cloned_dir == "sparse"
+
+    def test_sparse_clone_fallback(self):
+        flexmock(Git).should_receive("sparse_clone_repo").and_raise(
+            CalledProcessError(128, "git fetch")
+        )
+        flexmock(Git).should_receive("clone_repo").once().and_return("full")
+        assert self.betka.prepare_upstream_git()
+        assert self.betka.upstream_cloned_dir == "full"
+
+    def test_full_clone(self):
+        self.betka.config_json = {}
+        flexmock(Git).should_receive("sparse_clone_repo").never()
+        flexmock(Git).should_receive("clone_repo").once().and_return("full")
+        assert self.betka.prepare_upstream_git()
+
+    @pytest.mark.parametrize(
+        "config,generator,add,disable",
+        [
+            ({"upstream_git_path": "1.0"}, None, 1, 0),
+            ({}, None, 0, 1),
+            ({"upstream_git_path": "1.0"}, "quay.io/generator", 0, 1),
+        ],
+    )
+    def test_extend_upstream_checkout(self, config, generator, add, disable):
+        self.betka.config = config
+        flexmock(Git).should_receive("is_sparse_checkout").and_return(True)
+        flexmock(self.betka).should_receive("_get_image_url").and_return(generator)
+        flexmock(Git).should_receive("sparse_checkout_add").with_args(
+            "s2i-base-container", ["1.0"]
+        ).times(add)
+        flexmock(Git).should_receive("sparse_checkout_disable").times(disable)
+        self.betka.extend_upstream_checkout()
@@ -0,0 +1,96 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test notification digest of a sync run"""
+
+from pathlib import Path
+
+from flexmock import flexmock
+
+from betka.constants import TEMPLATES
+from betka.digest import DIGEST, NotificationDigest
+from betka.emails import BetkaEmails
+from betka.notifications import OUTBOX, SENDER
+from betka.utils import SlackNotifications
+
+TEMPLATE_DIR = str(Path(__file__).parent.parent.parent / "files/home/templates")
+
+
+class TestNotificationDigest(object):
+    def setup_method(self):
+        self.digest = DIGEST
+        self.digest.template_dir = TEMPLATE_DIR
+        self.digest.start(title="https://github.com/sclorg/s2i-base-container")
+
+    def teardown_method(self):
+        self.digest.stop()
+        self.digest.template_dir = TEMPLATES
+
+    def add_events(self):
+        self.digest.set_context(image="s2i-base", branch="rhel-8.6.0")
+        BetkaEmails.send_email("No changes", ["admin@b"], "[betka-diff] No git changes")
+        self.digest.set_context(branch="rhel-8.8.0")
+        BetkaEmails.send_email("MR created", ["admin@b", "team@b"], "[betka] sync: s2i-base")
+        self.digest.set_context(image="s2i-core", branch=None)
+        BetkaEmails.send_email("Fork failed", ["admin@b"], "[betka-sync] Fork failed")
+
+    def test_emails_collected(self):
+        flexmock(OUTBOX).should_receive("publish").never()
+        flexmock(SENDER).should_receive("deliver").never()
+        self.add_events()
+        SlackNotifications.send_webhook_notification("https://hook", "first")
+        SlackNotifications.send_webhook_notification("https://hook", "second")
+        assert len(self.digest.events) == 3
+        assert list(self.digest.slack_messages()) == [("https://hook", "first\nsecond")]
+
+    def test_digest_per_recipient(self):
+        self.add_events()
+        self.digest.stop()
+        emails = list(self.digest.emails())
+        assert len(emails) == 2
+        admin, receivers = emails[0]
+        assert receivers == ["admin@b"]
+        assert "3 notifications" in admin.subject
+        text = admin.text
+        assert text.index("=== s2i-base ===") < text.index("--- rhel-8.6.0 ---")
+        assert text.index("--- rhel-8.8.0 ---") < text.index("=== s2i-core ===")
+        assert "  MR created" in text
+        # a single notification is sent unchanged
+        team, receivers = emails[1]
+        assert receivers == ["team@b"]
+        assert team.subject == "[betka] sync: s2i-base"
+        assert team.text == "MR created"
+
+    def test_group_events(self):
+        self.add_events()
+        groups = NotificationDigest.group_events(self.digest.events)
+        assert list(groups) == ["s2i-base", "s2i-core"]
+        assert list(groups["s2i-base"]) == ["rhel-8.6.0", "rhel-8.8.0"]
+        assert list(groups["s2i-core"]) == [""]
+
+    def test_missing_template(self):
+        self.digest.template_dir = "/nonexisting"
+        self.add_events()
+        assert "* [betka-sync] Fork failed\nFork failed" in self.digest.render(
+            self.digest.events
+        )
@@ -0,0 +1,71 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test fleet model of dist_git_repos"""
+
+import pytest
+
+from betka.fleet import Fleet, get_fleet, normalize_url
+from tests.conftest import betka_yaml_specific_branches
+
+
+class TestFleet(object):
+    def setup_method(self):
+        self.config = betka_yaml_specific_branches()
+        self.fleet = Fleet(self.config["dist_git_repos"], self.config["synchronize_branches"])
+
+    @pytest.mark.parametrize(
+        "url",
+        [
+            "https://github.com/sclorg/s2i-base-container",
+            "https://github.com/sclorg/s2i-base-container.git",
+            "http://www.github.com/sclorg/s2i-base-container/",
+            "github.com/sclorg/S2I-base-container",
+            "git@github.com:sclorg/s2i-base-container.git",
+            "ssh://git@github.com/sclorg/s2i-base-container",
+        ],
+    )
+    def test_normalize_url(self, url):
+        assert normalize_url(url) == "github.com/sclorg/s2i-base-container"
+
+    def test_get_images(self):
+        images = self.fleet.get_images("git@github.com:sclorg/s2i-base-container.git")
+        assert sorted(images) == ["s2i-base", "s2i-core"]
+        assert images["s2i-core"] is self.config["dist_git_repos"]["s2i-core"]
+        assert self.fleet.get_images("https://github.com/foo/bar") == {}
+
+    def test_resolved_image(self):
+        image = self.fleet.images["s2i-core"]
+        assert (image.owner, image.repo) == ("sclorg", "s2i-base-container")
+        assert self.fleet.get_branches("s2i-core") == ["f40", "f41"]
+        assert self.fleet.get_branches("s2i-base") == ["fc3"]
+
+    def test_get_fleet_rebuilt_on_change(self):
+        fleet = get_fleet(self.config["dist_git_repos"], self.config["synchronize_branches"])
+        assert fleet is get_fleet(
+            self.config["dist_git_repos"], self.config["synchronize_branches"]
+        )
+        reloaded = betka_yaml_specific_branches()
+        assert fleet is not get_fleet(
+            reloaded["dist_git_repos"], reloaded["synchronize_branches"]
+        )
@@ -30,7 +30,9 @@ from os.path import isdir, isfile, join
 
 from flexmock import flexmock
 
-from betka.git import Git
+from betka import git
+from betka.git import Git, SubmoduleCache
+from betka.utils import run_cmd
 
 from tests.conftest import get_all_branches
 
@@ -41,6 +43,20 @@ class TestGit(object):
     def test_call_git_cmd(self):
         assert Git.call_git_cmd("version").startswith("git version")
 
+    def test_call_git_cmd_no_shell(self, tmpdir):
+        Git.call_git_cmd(f"init {tmpdir}")
+        Git.call_git_cmd(["config", "user.name", "Foo 'Bar' $HOME"], git_dir=tmpdir)
+        assert (
+            Git.call_git_cmd("config --get user.name", git_dir=tmpdir).strip()
+            == "Foo 'Bar' $HOME"
+        )
+        status = Git.call_git_cmd(
+            "config --get foo.bar", git_dir=tmpdir, return_output=False, ignore_error=True
+        )
+        assert status == 1
+        with pytest.raises(CalledProcessError):
+            Git.call_git_cmd("config --get foo.bar", git_dir=tmpdir)
+
     @pytest.mark.parametrize(
         "url, ok",
         [
@@ -143,3 +159,210 @@ class TestGit(object):
         assert "rhel-9.5.0" in result_list
         assert "rhel-8.10.0-rhel810-sync" not in result_list
         assert "rhel-9.5.0.0" not in result_list
+
+
+def _git(cwd, cmd):
+    return run_cmd(
+        f"git -c user.name=test -c user.email=test@test {cmd}",
+        return_output=True,
+        shell=True,
+        cwd=str(cwd),
+    )
+
+
+@pytest.fixture()
+def fork_repos(tmp_path, monkeypatch):
+    """
+    Creates upstream and fork bare repositories
+    and fork clone with 'upstream' remote, the clone is the current directory.
+    """
+    work = tmp_path / "work"
+    work.mkdir()
+    _git(work, "init -b main .")
+    _git(work, "commit --allow-empty -m init")
+    _git(work, "branch f40")
+    _git(work, "branch f41")
+    _git(tmp_path, f"clone --bare {work} upstream.git")
+    _git(tmp_path, f"clone --bare {work} fork.git")
+    _git(work, "checkout f41")
+    _git(work, "commit --allow-empty -m update")
+    _git(work, f"push {tmp_path / 'upstream.git'} f41")
+    _git(tmp_path, f"clone {tmp_path / 'fork.git'} clone")
+    clone = tmp_path / "clone"
+    monkeypatch.chdir(clone)
+    _git(clone, f"remote add upstream {tmp_path / 'upstream.git'}")
+    _git(clone, "remote update upstream")
+    return tmp_path
+
+
+class TestGitForkSync(object):
+    def test_get_remote_refs(self, fork_repos):
+        refs = Git.get_remote_refs("upstream")
+        assert sorted(refs) == ["f40", "f41", "main"]
+        assert refs["f40"] == Git.get_ref_sha("refs/remotes/origin/f40")
+        assert Git.get_ref_sha("refs/remotes/origin/missing") is None
+
+    def test_sync_fork_pushes_only_differing(self, fork_repos):
+        pushed = []
+        call_git_cmd = Git.call_git_cmd
+
+        def record(cmd, *args, **kwargs):
+            if cmd.startswith("push"):
+                pushed.append(cmd)
+            return call_git_cmd(cmd, *args, **kwargs)
+
+        flexmock(Git).should_receive("call_git_cmd").replace_with(record)
+        Git.sync_fork_with_upstream(["f40", "f41", "f42"])
+        assert pushed == [
+            "push --force origin refs/remotes/upstream/f41:refs/heads/f41"
+        ]
+        assert Git.get_remote_refs("origin")["f41"] == Git.get_remote_refs("upstream")["f41"]
+        pushed.clear()
+        Git.sync_fork_with_upstream(["f40", "f41"])
+        assert not pushed
+
+
+class TestGitPushAtomic(object):
+    def test_push_atomic(self, fork_repos):
+        _git(fork_repos / "clone", "checkout -b f40 origin/f40")
+        _git(fork_repos / "clone", "commit --allow-empty -m f40")
+        _git(fork_repos / "clone", "checkout -b f41 upstream/f41")
+        assert Git.git_push_atomic(["f40", "f41"])
+        assert Git.get_remote_refs("origin")["f41"] == Git.get_remote_refs("upstream")["f41"]
+
+    def test_push_atomic_rejected(self, fork_repos):
+        clone = fork_repos / "clone"
+        origin_refs = Git.get_remote_refs("origin")
+        _git(clone, "checkout -b f40 origin/f40")
+        _git(clone, "commit --allow-empty -m f40")
+        # main is not a fast-forward, whole push is rejected
+        _git(clone, "checkout main")
+        _git(clone, "commit --amend --allow-empty -m rewritten")
+        assert not Git.git_push_atomic(["f40", "main"])
+        _git(clone, "fetch origin")
+        assert Git.get_remote_refs("origin") == origin_refs
+
+
+class TestGitAddAll(object):
+    @pytest.mark.parametrize("show_diff,diffs", [(False, 0), (True, 1)])
+    def test_git_add_all_show_diff(self, show_diff, diffs):
+        # the module logger is DEBUG in Celery workers, show_diff decides
+        flexmock(git.logger).should_receive("isEnabledFor").and_return(True)
+        flexmock(Git).should_receive("call_git_cmd").with_args(
+            "diff HEAD", ignore_error=True, msg=str
+        ).and_return("").times(diffs)
+        flexmock(Git).should_receive("call_git_cmd").with_args("add -A", msg="Add all").once()
+        flexmock(Git).should_receive("call_git_cmd").with_args(
+            list, msg=str, return_output=False, ignore_error=True
+        ).and_return(0)
+        assert Git.git_add_all("Upstream commit", "Related: RHEL-1", show_diff=show_diff)
+
+
+class TestGitForceWithLease(object):
+    def test_push_with_lease(self, fork_repos):
+        clone = fork_repos / "clone"
+        _git(clone, "checkout -B f40 origin/f40")
+        _git(clone, "commit --amend --allow-empty -m rebuilt")
+        assert Git.git_push(source_branch="f40", force_with_lease=True)
+        assert Git.get_ref_sha("refs/remotes/origin/f40") == Git.get_ref_sha("f40")
+
+    def test_push_with_stale_lease(self, fork_repos):
+        clone = fork_repos / "clone"
+        _git(clone, "checkout -B f40 origin/f40")
+        _git(clone, "commit --amend --allow-empty -m rebuilt")
+        # Somebody else updated the branch since the last fetch
+        _git(clone, "update-ref refs/remotes/origin/f40 refs/remotes/upstream/f41")
+        assert not Git.git_push(source_branch="f40", force_with_lease=True)
+
+
+@pytest.fixture()
+def sparse_upstream(tmp_path, monkeypatch):
+    """
+    Creates upstream repository with two version directories and 'common' submodule
+    """
+    # local submodules are not allowed by default
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv("GIT_CONFIG_KEY_0", "protocol.file.allow")
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", "always")
+    common = tmp_path / "common"
+    common.mkdir()
+    _git(common, "init -b main .")
+    (common / "common.sh").write_text("echo common\n")
+    _git(common, "add -A")
+    _git(common, "commit -m common")
+    upstream = tmp_path / "upstream"
+    upstream.mkdir()
+    _git(upstream, "init -b main .")
+    for version in ["1.0", "2.0"]:
+        (upstream / version).mkdir()
+        (upstream / version / "Dockerfile").write_text(f"FROM {version}\n")
+    (upstream / "README.md").write_text("readme\n")
+    _git(upstream, f"submodule add {common} common")
+    _git(upstream, "add -A")
+    _git(upstream, "commit -m upstream")
+    _git(upstream, "config uploadpack.allowFilter true")
+    return tmp_path
+
+
+class TestGitSparseClone(object):
+    def test_sparse_clone(self, sparse_upstream, tmp_path):
+        upstream = sparse_upstream / "upstream"
+        sha = _git(upstream, "rev-parse HEAD").strip()
+        clone_dir = tmp_path / "clone"
+        clone_dir.mkdir()
+        cloned = Git.sparse_clone_repo(f"file://{upstream}", str(clone_dir), sha)
+        assert cloned == clone_dir / "upstream"
+        assert Git.is_sparse_checkout(cloned)
+        assert (cloned / "README.md").is_file()
+        assert (cloned / "common" / "common.sh").is_file()
+        assert not (cloned / "1.0").exists()
+        Git.sparse_checkout_add(cloned, ["2.0"])
+        assert (cloned / "2.0" / "Dockerfile").read_text() == "FROM 2.0\n"
+        assert not (cloned / "1.0").exists()
+        Git.sparse_checkout_disable(cloned)
+        assert (cloned / "1.0" / "Dockerfile").is_file()
+
+    def test_sparse_checkout_add_fallback(self, sparse_upstream, tmp_path):
+        upstream = sparse_upstream / "upstream"
+        sha = _git(upstream, "rev-parse HEAD").strip()
+        clone_dir = tmp_path / "clone"
+        clone_dir.mkdir()
+        cloned = Git.sparse_clone_repo(f"file://{upstream}", str(clone_dir), sha)
+        flexmock(Git).should_call("call_git_cmd")
+        flexmock(Git).should_receive("call_git_cmd").with_args(
+            ["sparse-checkout", "add", "3.0"], git_dir=cloned
+        ).and_raise(CalledProcessError(1, "git"))
+        Git.sparse_checkout_add(cloned, ["3.0"])
+        assert not Git.is_sparse_checkout(cloned)
+        assert (cloned / "1.0" / "Dockerfile").is_file()
+        assert (cloned / "2.0" / "Dockerfile").is_file()
+
+    def test_submodule_paths(self, sparse_upstream):
+        assert Git.get_submodule_paths(sparse_upstream / "upstream") == ["common"]
+        assert Git.get_submodule_paths(sparse_upstream / "common") == []
+
+
+class TestGitSubmoduleCache(object):
+    def test_clone_with_cache(self, sparse_upstream, tmp_path):
+        cache = SubmoduleCache(str(tmp_path / "cache.git"))
+        flexmock(git, SUBMODULE_CACHE=cache)
+        for name in ["first", "second"]:
+            (tmp_path / name).mkdir()
+            cloned = Git.clone_repo(str(sparse_upstream / "upstream"), str(tmp_path / name))
+            assert (cloned / "common" / "common.sh").is_file()
+            # objects were copied from the cache
+            assert not list((tmp_path / name).glob("**/objects/info/alternates"))
+        assert list(cache.fetched) == [str(sparse_upstream / "common")]
+        key = SubmoduleCache.url_key(str(sparse_upstream / "common"))
+        assert _git(cache.path, f"rev-parse refs/cache/{key}/main").strip()
+
+    def test_clone_without_submodules(self, sparse_upstream, tmp_path):
+        flexmock(git.SUBMODULE_CACHE).should_receive("prepare").never()
+        (tmp_path / "clone").mkdir()
+        cloned = Git.clone_repo(str(sparse_upstream / "common"), str(tmp_path / "clone"))
+        assert (cloned / "common.sh").is_file()
+
+    def test_cache_not_usable(self, tmp_path):
+        (tmp_path / "file").write_text("")
+        cache = SubmoduleCache(str(tmp_path / "file" / "cache.git"))
+        assert cache.prepare(["https://github.com/sclorg/container-common-scripts"]) is None
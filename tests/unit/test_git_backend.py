@@ -0,0 +1,138 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test git backends for read-only repository queries"""
+
+import pytest
+
+from betka import git_backend
+from betka.git_backend import CatFile, CatFileBackend, GitBackend, set_backend
+from betka.utils import run_cmd
+
+
+def _git(cwd, cmd):
+    return run_cmd(
+        f"git -c user.name=test -c user.email=test@test {cmd}",
+        return_output=True,
+        shell=True,
+        cwd=str(cwd),
+    )
+
+
+@pytest.fixture()
+def repo(tmp_path, monkeypatch):
+    """
+    Creates a repository with bot-cfg.yml only in f40 branch
+    and origin remote-tracking branches. The repository is the current directory.
+    """
+    origin = tmp_path / "origin"
+    origin.mkdir()
+    _git(origin, "init -b main .")
+    _git(origin, "commit --allow-empty -m init")
+    _git(origin, "checkout -b f40")
+    (origin / "bot-cfg.yml").write_text("version: '1'\n")
+    _git(origin, "add bot-cfg.yml")
+    _git(origin, "commit -m config")
+    _git(origin, "tag -a v1 -m v1")
+    _git(origin, "checkout main")
+    _git(tmp_path, f"clone {origin} clone")
+    clone = tmp_path / "clone"
+    _git(clone, "remote add upstream https://github.com/sclorg/s2i-base-container")
+    monkeypatch.chdir(clone)
+    return clone
+
+
+def backends():
+    result = [GitBackend(), CatFileBackend()]
+    try:
+        result.append(git_backend.DulwichBackend())
+    except ImportError:
+        pass
+    return result
+
+
+@pytest.mark.parametrize("backend", backends(), ids=lambda x: x.name)
+class TestGitBackend(object):
+    def test_refs(self, repo, backend):
+        refs = backend.get_refs("refs/remotes/origin/")
+        assert set(refs) >= {"main", "f40"}
+        assert backend.get_ref_sha("refs/remotes/origin/f40") == refs["f40"]
+        assert backend.get_ref_sha("v1") == refs["f40"]
+        assert backend.get_ref_sha("HEAD") == refs["main"]
+        assert backend.get_ref_sha("refs/remotes/origin/missing") is None
+
+    def test_config(self, repo, backend):
+        assert (
+            backend.get_config("remote.upstream.url")
+            == "https://github.com/sclorg/s2i-base-container"
+        )
+        assert backend.get_config("remote.foo.url") is None
+        assert sorted(backend.get_remotes()) == ["origin", "upstream"]
+
+    def test_read_blob(self, repo, backend):
+        assert backend.resolve_branch("f40") == "refs/remotes/origin/f40"
+        assert backend.resolve_branch("main") == "refs/heads/main"
+        assert backend.resolve_branch("f41") is None
+        assert backend.read_blob("refs/remotes/origin/f40", "bot-cfg.yml") == b"version: '1'\n"
+        assert not backend.has_file("refs/heads/main", "bot-cfg.yml")
+
+    def test_list_branches(self, repo, backend):
+        assert sorted(backend.list_branches()) == [
+            "main",
+            "remotes/origin/f40",
+            "remotes/origin/main",
+        ]
+
+
+class TestCatFile(object):
+    def test_request_response(self, repo):
+        with CatFile(str(repo), max_size=5) as cat_file:
+            blob = cat_file.info("refs/remotes/origin/f40:bot-cfg.yml")
+            assert (blob.type, blob.size, blob.data) == ("blob", 13, None)
+            # Content bigger than max_size is skipped, the stream stays in sync
+            assert cat_file.contents("refs/remotes/origin/f40:bot-cfg.yml").data is None
+            cat_file.max_size = 1024
+            commit = cat_file.contents("HEAD")
+            assert commit.type == "commit"
+            assert commit.data.startswith(b"tree ")
+            assert cat_file.info("HEAD:missing") is None
+            # plain --batch-check and --batch work with git older than 2.36
+            assert [x.args[2] for x in cat_file.processes.values()] == [
+                "--batch-check",
+                "--batch",
+            ]
+        assert not cat_file.is_alive()
+
+    def test_backend_pool(self, repo, tmp_path, monkeypatch):
+        backend = CatFileBackend(pool_size=1)
+        first = backend.cat_file()
+        assert backend.cat_file() is first
+        monkeypatch.chdir(tmp_path / "origin")
+        assert backend.cat_file() is not first
+        assert not first.is_alive()
+        backend.close()
+        assert not backend.processes
+
+
+def test_set_backend_fallback():
+    assert set_backend("foo").name == "subprocess"
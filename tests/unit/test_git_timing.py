@@ -0,0 +1,102 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test git command timings and the slow-operation report"""
+
+import logging
+
+from betka import git_report
+from betka.git import Git
+from betka.git_timing import GitTimings, GIT_TIMINGS, subcommand_label
+from betka.logger import Logger
+
+
+class TestGitTimings(object):
+    def test_subcommand_label(self):
+        assert subcommand_label(["remote", "update", "upstream"]) == "remote update"
+        assert subcommand_label(["add", "-A"]) == "add"
+        assert subcommand_label(["remote", "-v"]) == "remote"
+        assert subcommand_label([]) == ""
+
+    def test_record(self):
+        timings = GitTimings()
+        timings.set_context(image="s2i-base", branch="rhel-8.8.0")
+        timings.record("push", 12.5, 0, repo="/tmp/foo/s2i-base")
+        timings.record("push", 0.2, 1, repo="/tmp/foo/s2i-base")
+        timings.set_context(branch=None)
+        timings.record("clone", 40.0, 0, repo="/tmp/foo/s2i-base")
+        report = timings.report()
+        push = report["git_timings"]["push"]
+        assert push["count"] == 2
+        assert push["failed"] == 1
+        assert push["max"] == 12.5
+        assert push["buckets"]["0.5"] == 1
+        assert push["buckets"]["30"] == 2
+        assert push["buckets"]["+Inf"] == 2
+        assert [x["subcommand"] for x in report["git_slowest"]] == ["clone", "push", "push"]
+        assert report["git_slowest"][1]["image"] == "s2i-base"
+        assert report["git_slowest"][1]["branch"] == "rhel-8.8.0"
+        assert report["git_slowest"][0]["branch"] is None
+        assert report["git_slowest"][0]["repo"] == "s2i-base"
+
+    def test_call_git_cmd_recorded(self, tmpdir):
+        GIT_TIMINGS.reset()
+        Git.call_git_cmd(f"init {tmpdir}")
+        Git.call_git_cmd("status", git_dir=tmpdir)
+        assert set(GIT_TIMINGS.histograms) == {"init", "status"}
+        assert GIT_TIMINGS.slowest[0].repo is not None
+
+
+class TestGitReport(object):
+    def write_log(self, tmp_path, date):
+        timings = GitTimings()
+        timings.set_context(image="nginx")
+        timings.record("clone", 30.0, 0, repo="nginx")
+        timings.record("push", 5.0, 128, timed_out=True, repo="nginx")
+        logger = Logger(task_name=None, to_file=False)
+        report_dict = {"message": "Git command timings\nfor nginx"}
+        report_dict.update(timings.report())
+        text = "plain text line {not json}\n"
+        text += logger.serialize(logging.INFO, {"message": "multi\nline"}) + "\n"
+        text += logger.serialize(logging.INFO, report_dict) + "\n"
+        (tmp_path / f"task.betka.master_sync.log-{date}").write_text(text * 2, "utf-8")
+
+    def test_summary(self, tmp_path):
+        self.write_log(tmp_path, "20240101")
+        files = git_report.log_files(tmp_path, "20240101")
+        summary = git_report.summarize(files, top=3)
+        assert summary["tasks"] == 2
+        assert summary["git_timings"]["clone"]["count"] == 2
+        assert summary["git_timings"]["clone"]["mean"] == 30.0
+        assert [x["subcommand"] for x in summary["git_slowest"]] == [
+            "clone",
+            "clone",
+            "push",
+        ]
+        assert "TIMEOUT" in git_report.format_summary(summary)
+
+    def test_main(self, tmp_path, capsys):
+        self.write_log(tmp_path, "20240101")
+        assert git_report.main(["--logs-dir", str(tmp_path), "--date", "20240102"]) == 1
+        assert git_report.main(["--logs-dir", str(tmp_path), "--date", "20240101"]) == 0
+        assert "image=nginx" in capsys.readouterr().out
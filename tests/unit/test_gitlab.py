@@ -68,6 +68,10 @@ class TestBetkaGitlab(object):
         self.ga.project_id = PROJECT_ID
         self.ga.set_variables(self.ga.image)
 
+    def test_graphql_api_cached(self):
+        assert self.ga.graphql_api is self.ga.graphql_api
+        assert self.ga.graphql_api.graphql_url == "https://gitlab.com/api/graphql"
+
     def test_get_branches(self):
         flexmock(self.ga).should_receive("get_project_branches").and_return(
             ProjectBranches("rhel-8.6.0", "something", True),
@@ -76,6 +80,48 @@ class TestBetkaGitlab(object):
         flexmock(self.ga).should_receive("get_target_protected_branches").and_return([])
         assert self.ga.get_branches() == ["rhel-8.6.0", "rhel-8.8.0"]
 
+    def test_get_orphaned_branches(self):
+        flexmock(self.ga).should_receive("get_project_branches").and_return(
+            [
+                ProjectBranches("rhel-8.6.0", "something", True),
+                ProjectBranches("betka-20240101000000-rhel-8.6.0", "something", False),
+                ProjectBranches("betka-20240102000000-rhel-8.6.0", "something", False),
+                ProjectBranches("betka-20240103000000-rhel-8.8.0", "something", False),
+            ]
+        )
+        mr = two_mrs_one_valid()[0]._replace(source_branch="betka-20240102000000-rhel-8.6.0")
+        flexmock(self.ga).should_receive("get_project_mergerequests").and_return([mr])
+        assert self.ga.get_orphaned_branches(keep=["betka-20240103000000-rhel-8.8.0"]) == [
+            "betka-20240101000000-rhel-8.6.0"
+        ]
+
+    def test_get_orphaned_branches_all_pages(self):
+        # 25 opened merge requests do not fit into the default page of 20 items
+        mrs = [
+            flexmock(
+                iid=idx,
+                title="[betka-master-sync]",
+                description="",
+                target_branch="rhel-8.6.0",
+                author={"username": "foo_user"},
+                source_project_id=PROJECT_ID,
+                target_project_id=PROJECT_ID,
+                web_url="",
+                source_branch=f"betka-202401010000{idx:02d}-rhel-8.6.0",
+            )
+            for idx in range(25)
+        ]
+        branches = [
+            flexmock(name=x.source_branch, web_url="", protected=False) for x in mrs
+        ] + [flexmock(name="betka-20231231000000-rhel-8.6.0", web_url="", protected=False)]
+        project = flexmock(mergerequests=flexmock(), branches=flexmock())
+        project.mergerequests.should_receive("list").with_args(
+            state="opened", get_all=True
+        ).and_return(mrs)
+        project.branches.should_receive("list").with_args(get_all=True).and_return(branches)
+        self.ga.target_project = project
+        assert self.ga.get_orphaned_branches(keep=[]) == ["betka-20231231000000-rhel-8.6.0"]
+
     @pytest.mark.parametrize(
         "project_mrs,branch,mr_id",
         [
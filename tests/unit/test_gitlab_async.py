@@ -0,0 +1,184 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Test asyncio GitLab client"""
+
+import asyncio
+import os
+import aiohttp
+
+from flexmock import flexmock
+
+from betka import gitlab, gitlab_async
+from betka.gitlab import GitLabAPI
+from betka.bot_cfg import BotCfgLoader
+from betka.gitlab_async import AsyncGitLabClient
+from betka.named_tuples import (
+    BotCfgBlob,
+    ProjectBranches,
+    ProjectInfo,
+    ProjectSnapshot,
+    ForkProtectedBranches,
+)
+from tests.conftest import config_json, two_mrs_both_valid
+from tests.spellbook import PROJECT_ID
+
+PROJECT_PATH = "projects/container%2Fs2i-base"
+
+
+def fake_responses():
+    return {
+        (PROJECT_PATH, None): (
+            {
+                "id": PROJECT_ID,
+                "name": "s2i-base",
+                "ssh_url_to_repo": "git@gitlab.com:container/s2i-base.git",
+                "web_url": "https://gitlab.com/container/s2i-base",
+            },
+            {},
+        ),
+        (f"{PROJECT_PATH}/repository/branches", "1"): (
+            [{"name": "rhel-8.6.0", "web_url": "url", "protected": False}],
+            {"X-Next-Page": "2"},
+        ),
+        (f"{PROJECT_PATH}/repository/branches", "2"): (
+            [{"name": "rhel-8.8.0", "web_url": "url", "protected": True}],
+            {"X-Next-Page": ""},
+        ),
+        (f"{PROJECT_PATH}/protected_branches", "1"): ([{"name": "rhel-8.8.0"}], {}),
+        (f"{PROJECT_PATH}/merge_requests", "1"): ([], {}),
+    }
+
+
+class TestAsyncGitLabClient(object):
+    def setup_method(self):
+        self.responses = fake_responses()
+        self.client = AsyncGitLabClient("https://gitlab.com/api/v4/", "token")
+
+        async def fake_get(path, params=None):
+            page = params.get("page") if params else None
+            return self.responses[(path, page)]
+
+        self.client._get = fake_get
+
+    def test_project_path(self):
+        assert (
+            AsyncGitLabClient.project_path("redhat/rhel/containers/nginx")
+            == "projects/redhat%2Frhel%2Fcontainers%2Fnginx"
+        )
+
+    def test_pagination(self):
+        branches = asyncio.run(self.client.get_project_branches("container/s2i-base"))
+        assert branches == [
+            ProjectBranches("rhel-8.6.0", "url", False),
+            ProjectBranches("rhel-8.8.0", "url", True),
+        ]
+
+    def test_snapshots(self):
+        snapshots = asyncio.run(
+            self.client.get_snapshots(
+                {"s2i-base": "container/s2i-base", "missing": "container/missing"}
+            )
+        )
+        assert list(snapshots) == ["s2i-base"]
+        snapshot = snapshots["s2i-base"]
+        assert snapshot.info.id == PROJECT_ID
+        assert snapshot.protected_branches == [ForkProtectedBranches("rhel-8.8.0")]
+        assert snapshot.merge_requests == []
+        assert snapshot.forks is None
+
+    def test_bot_cfg_blobs_cached(self):
+        heads = {"rhel-8.6.0": "abcd", "rhel-8.8.0": "abcd"}
+        downloads = []
+
+        async def fake_head(path, params=None):
+            if params["ref"] not in heads:
+                raise aiohttp.ClientResponseError(None, (), status=404)
+            return {"X-Gitlab-Blob-Id": heads[params["ref"]]}
+
+        async def fake_get_text(path, params=None):
+            downloads.append(params["ref"])
+            return "version: '1'\n"
+
+        self.client._head = fake_head
+        self.client._get_text = fake_get_text
+        flexmock(gitlab_async, BOT_CFG_LOADER=BotCfgLoader())
+        bot_cfgs = asyncio.run(
+            self.client.get_bot_cfgs(
+                {"s2i-base": "container/s2i-base"},
+                {"s2i-base": ["rhel-8.6.0", "rhel-9.0.0"]},
+            )
+        )
+        assert bot_cfgs["s2i-base"]["rhel-8.6.0"] == BotCfgBlob("abcd", "version: '1'\n")
+        assert bot_cfgs["s2i-base"]["rhel-9.0.0"] is None
+        gitlab_async.BOT_CFG_LOADER.load("version: '1'\n", sha="abcd")
+        bot_cfgs = asyncio.run(
+            self.client.get_bot_cfgs(
+                {"s2i-base": "container/s2i-base"}, {"s2i-base": ["rhel-8.8.0"]}
+            )
+        )
+        # Blob was already parsed, content is not downloaded again
+        assert bot_cfgs["s2i-base"]["rhel-8.8.0"] == BotCfgBlob("abcd", None)
+        assert len(downloads) == 1
+
+
+class TestGitLabAPISnapshot(object):
+    def setup_method(self):
+        os.environ["GITLAB_API_TOKEN"] = "foobar"
+        self.ga = GitLabAPI(
+            betka_config={"gitlab_api_token": "foobar", "use_gitlab_forks": "false"},
+            config_json=config_json(),
+        )
+        self.ga.image = "s2i-base"
+        self.ga.snapshots = {
+            "s2i-base": ProjectSnapshot(
+                ProjectInfo(PROJECT_ID, "s2i-base", "git@gitlab.com:foo/bar.git", "url"),
+                [ProjectBranches("rhel-8.6.0", "url", False)],
+                [ForkProtectedBranches("rhel-8.8.0")],
+                two_mrs_both_valid(),
+                None,
+            )
+        }
+
+    def test_served_from_snapshot(self):
+        assert self.ga.get_project_id_from_url() == PROJECT_ID
+        assert self.ga.get_project_info().ssh_url_to_repo == "git@gitlab.com:foo/bar.git"
+        assert self.ga.get_branches() == ["rhel-8.6.0", "rhel-8.8.0"]
+        assert self.ga.get_project_mergerequests() == two_mrs_both_valid()
+
+    def test_preflight_disabled(self):
+        flexmock(gitlab).should_receive("fetch_snapshots").never()
+        self.ga.load_preflight({"s2i-base": ["rhel-8.6.0"]})
+        assert self.ga.snapshot() is None
+
+    def test_eligible_branches(self):
+        assert self.ga.get_eligible_branches(["rhel-8.6.0"]) is None
+        self.ga.bot_cfgs = {
+            "s2i-base": {
+                "rhel-8.6.0": BotCfgBlob("abcd", "version: '1'\n"),
+                "rhel-8.8.0": None,
+            }
+        }
+        assert self.ga.get_eligible_branches(["rhel-8.6.0", "rhel-8.8.0"]) == ["rhel-8.6.0"]
+        assert self.ga.get_eligible_branches(["rhel-9.0.0"]) is None
+        assert self.ga.get_prefetched_bot_cfg("rhel-8.6.0") == {"version": "1"}
+        assert self.ga.get_prefetched_bot_cfg("rhel-8.8.0") is None
@@ -0,0 +1,129 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Test GitLab GraphQL snapshot"""
+
+import pytest
+
+from flexmock import flexmock
+
+from betka.exception import BetkaException
+from betka.gitlab_graphql import GitLabGraphQL
+from betka.named_tuples import BotCfgBlob
+from tests.spellbook import PROJECT_ID
+
+
+def graphql_project():
+    return {
+        "id": f"gid://gitlab/Project/{PROJECT_ID}",
+        "name": "s2i-base",
+        "sshUrlToRepo": "git@gitlab.com:container/s2i-base.git",
+        "webUrl": "https://gitlab.com/container/s2i-base",
+        "repository": {
+            "branchNames": ["rhel-8.6.0", "rhel-8.8.0"],
+            "b0": {"nodes": [{"oid": "abcd", "rawBlob": "version: '1'\n"}]},
+            "b1": {"nodes": []},
+        },
+        "branchRules": {
+            "nodes": [
+                {"name": "rhel-8.8.0", "isProtected": True},
+                {"name": "All branches", "isProtected": False},
+            ]
+        },
+        "mergeRequests": {
+            "nodes": [
+                {
+                    "iid": "3",
+                    "title": "[betka-master-sync]",
+                    "description": "",
+                    "targetBranch": "rhel-8.6.0",
+                    "sourceBranch": "betka-20240101-rhel-8.6.0",
+                    "author": {"username": "phracek"},
+                    "sourceProjectId": PROJECT_ID,
+                    "targetProjectId": PROJECT_ID,
+                    "webUrl": "https://gitlab.com/container/s2i-base/-/merge_requests/3",
+                }
+            ]
+        },
+    }
+
+
+class TestGitLabGraphQL(object):
+    def setup_method(self):
+        self.api = GitLabGraphQL("https://gitlab.com/api/graphql", "token")
+
+    def test_build_query(self):
+        query = self.api.build_query(
+            ["container/s2i-base", "container/s2i-core"], [["rhel-8.6.0"], []]
+        )
+        assert 'p0: project(fullPath: "container/s2i-base")' in query
+        assert 'p1: project(fullPath: "container/s2i-core")' in query
+        assert 'b0: blobs(ref: "rhel-8.6.0", paths: ["bot-cfg.yml"])' in query
+        assert query.count("blobs(") == 1
+        assert query.count("{") == query.count("}")
+
+    def test_parse_project(self):
+        snapshot = self.api.parse_project(graphql_project(), ["rhel-8.6.0", "rhel-8.8.0"])
+        assert snapshot.info.id == PROJECT_ID
+        assert [x.name for x in snapshot.branches] == ["rhel-8.6.0", "rhel-8.8.0"]
+        assert [x.name for x in snapshot.protected_branches] == ["rhel-8.8.0"]
+        assert snapshot.merge_requests[0].iid == 3
+        assert snapshot.forks is None
+        assert snapshot.bot_cfgs == {
+            "rhel-8.6.0": BotCfgBlob("abcd", "version: '1'\n"),
+            "rhel-8.8.0": None,
+        }
+
+    def test_parse_project_wildcard_rule(self):
+        data = graphql_project()
+        data["branchRules"]["nodes"][0]["name"] = "rhel-8.*"
+        snapshot = self.api.parse_project(data, [])
+        assert [x.protected for x in snapshot.branches] == [True, True]
+        assert not self.api.is_protected("rhel-9.0.0", ["rhel-8.*"])
+        assert not self.api.is_protected("rhel-8x6.0", ["rhel-8.6.0"])
+
+    def test_parse_project_truncated(self):
+        data = graphql_project()
+        data["mergeRequests"]["pageInfo"] = {"hasNextPage": True}
+        data["branchRules"]["pageInfo"] = {"hasNextPage": True}
+        snapshot = self.api.parse_project(data, [])
+        # incomplete listings are fetched by REST
+        assert snapshot.merge_requests is None
+        assert snapshot.branches is None
+        assert snapshot.protected_branches is None
+
+    def test_get_snapshots(self):
+        flexmock(self.api).should_receive("send_query").once().and_return(
+            {"data": {"p0": graphql_project(), "p1": None}}
+        )
+        snapshots = self.api.get_snapshots(
+            {"s2i-base": "container/s2i-base", "s2i-core": "container/s2i-core"},
+            {"s2i-base": ["rhel-8.6.0"]},
+        )
+        assert list(snapshots) == ["s2i-base"]
+
+    def test_api_errors(self):
+        flexmock(self.api).should_receive("send_query").and_return(
+            {"errors": [{"message": "Query has complexity of 300"}]}
+        )
+        with pytest.raises(BetkaException):
+            self.api.get_snapshots({"s2i-base": "container/s2i-base"}, {})
@@ -0,0 +1,101 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test global configuration cache"""
+
+import time
+import pytest
+import requests
+
+from flexmock import flexmock
+
+from betka.global_config import GlobalConfigCache
+from betka.named_tuples import CachedConfig
+
+CONFIG_URL = "https://github.com/sclorg/betka/raw/master/betka-prod.yaml"
+
+
+def response(status_code, text="", etag=None):
+    resp = flexmock(status_code=status_code, text=text, headers={"ETag": etag})
+    if status_code >= 400:
+        resp.should_receive("raise_for_status").and_raise(requests.exceptions.HTTPError)
+    else:
+        resp.should_receive("raise_for_status")
+    return resp
+
+
+class TestGlobalConfigCache(object):
+    def setup_method(self):
+        self.cache = GlobalConfigCache(url=None, interval=100, max_stale=1000)
+
+    def test_downloaded_once(self):
+        flexmock(requests).should_receive("get").once().and_return(
+            response(200, "version: '1'\n", etag='"abcd"')
+        )
+        assert self.cache.get(CONFIG_URL) == {"version": "1"}
+        assert self.cache.get(CONFIG_URL) == {"version": "1"}
+        assert self.cache.entries[CONFIG_URL].etag == '"abcd"'
+
+    def test_conditional_refresh(self):
+        self.cache.entries[CONFIG_URL] = CachedConfig({"version": "1"}, '"abcd"', 0)
+        flexmock(requests).should_receive("get").with_args(
+            CONFIG_URL, headers={"If-None-Match": '"abcd"'}, verify=False
+        ).once().and_return(response(304))
+        assert self.cache.get(CONFIG_URL) == {"version": "1"}
+        assert self.cache.entries[CONFIG_URL].fetched > 0
+
+    @pytest.mark.parametrize("age,served", [(500, True), (5000, False)])
+    def test_github_outage(self, age, served):
+        self.cache.entries[CONFIG_URL] = CachedConfig(
+            {"version": "1"}, '"abcd"', time.time() - age
+        )
+        flexmock(requests).should_receive("get").and_raise(
+            requests.exceptions.ConnectionError
+        )
+        if served:
+            assert self.cache.get(CONFIG_URL) == {"version": "1"}
+        else:
+            with pytest.raises(requests.exceptions.ConnectionError):
+                self.cache.get(CONFIG_URL)
+
+    def test_invalidate(self):
+        self.cache.entries[CONFIG_URL] = CachedConfig({"version": "1"}, None, 0)
+        self.cache.invalidate()
+        assert not self.cache.entries
+
+    def test_refresh_from_commit(self):
+        flexmock(requests).should_receive("get").with_args(
+            "https://github.com/sclorg/betka/raw/abcd/betka-prod.yaml", verify=False
+        ).once().and_return(response(200, "version: '2'\n"))
+        assert self.cache.refresh(
+            CONFIG_URL, "https://github.com/sclorg/betka/raw/abcd/betka-prod.yaml"
+        )
+        assert self.cache.get(CONFIG_URL) == {"version": "2"}
+
+    def test_listener_invalidates_local_copy(self):
+        messages = [{"type": "message", "data": CONFIG_URL.encode()}]
+        pubsub = flexmock(subscribe=lambda channel: None, listen=lambda: iter(messages))
+        self.cache._redis = flexmock(pubsub=lambda **kwargs: pubsub)
+        self.cache.entries[CONFIG_URL] = CachedConfig({"version": "1"}, None, 0)
+        self.cache.listen()
+        assert CONFIG_URL not in self.cache.entries
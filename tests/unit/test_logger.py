@@ -24,10 +24,17 @@
 
 """Test Logger class."""
 
+import json
 import logging
 import pytest
 
-from betka.logger import Logger
+from datetime import datetime
+
+from flexmock import flexmock
+
+from betka.bot import Bot
+from betka import logger as betka_logger
+from betka.logger import DailyFileHandler, Logger, lazy
 
 logger = logging.getLogger(__name__)
 
@@ -46,3 +53,60 @@ class TestLogger(object):
     )
     def test_format(self, msg, args, fmsg):
         assert Logger.format(msg, args) == fmsg
+
+    def test_format_lazy(self):
+        assert Logger.format("remotes: %s", (lazy(lambda: ["origin"]),)) == (
+            "remotes: ['origin']"
+        )
+        assert Logger.format(lazy(str.upper, "hello"), None) == "HELLO"
+
+    def test_disabled_level_is_not_formatted(self):
+        bot = Bot(logger=Logger(task_name=None, level=logging.INFO, to_file=False))
+        calls = []
+
+        def expensive():
+            calls.append(1)
+            return "result"
+
+        flexmock(bot.logger).should_receive("serialize").once().and_return("")
+        bot.debug("expensive %s", lazy(expensive))
+        assert not calls
+        bot.info("expensive %s", lazy(expensive))
+        assert calls == [1]
+
+    def test_serialize_single_line(self):
+        serialized = Logger(task_name=None, to_file=False).serialize(
+            logging.INFO, {"message": "first\nsecond"}
+        )
+        assert "\n" not in serialized
+        assert json.loads(serialized)["message"] == "first\nsecond"
+
+    def test_file_handler_added_once(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("LOGS_DIR", str(tmp_path))
+        loggers = [Logger(task_name="task.betka.test", level=logging.DEBUG) for _ in range(3)]
+        handlers = [
+            h for h in loggers[0].logger.handlers if getattr(h, "betka_log_file", None)
+        ]
+        assert len(handlers) == 1
+        date = datetime.now().strftime("%Y%m%d")
+        assert loggers[2].log_file == str(tmp_path / f"task.betka.test.log-{date}")
+        loggers[2].log(logging.INFO, {"message": "once"})
+        betka_logger.stop_file_writers()
+        lines = (tmp_path / f"task.betka.test.log-{date}").read_text().splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])["message"] == "once"
+        for handler in handlers:
+            loggers[0].logger.removeHandler(handler)
+
+    def test_daily_file_handler(self, tmp_path):
+        handler = DailyFileHandler(str(tmp_path / "task.log"))
+        date = datetime.now().strftime("%Y%m%d")
+        handler.emit(logging.makeLogRecord({"msg": "first"}))
+        flexmock(handler).should_receive("dated_path").and_return(
+            str(tmp_path / "task.log-20240102")
+        )
+        handler.doRollover()
+        handler.emit(logging.makeLogRecord({"msg": "second"}))
+        handler.close()
+        assert (tmp_path / f"task.log-{date}").read_text() == "first\n"
+        assert (tmp_path / "task.log-20240102").read_text() == "second\n"
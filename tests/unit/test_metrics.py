@@ -0,0 +1,100 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test Prometheus metrics"""
+
+import pytest
+
+from datetime import timedelta
+
+from flexmock import flexmock
+
+from betka import metrics
+
+
+class TestMetrics(object):
+    @pytest.mark.parametrize(
+        "value,expected",
+        [
+            ("2019-08-04T21:45:40+03:00", 1564944340.0),
+            ("2019-08-04T18:45:40Z", 1564944340.0),
+            (1564944342, 1564944342.0),
+            ("yesterday", None),
+            (None, None),
+        ],
+    )
+    def test_parse_timestamp(self, value, expected):
+        assert metrics.parse_timestamp(value) == expected
+
+    def test_stage(self):
+        flexmock(metrics).should_receive("time.perf_counter").and_return(10).and_return(12.5)
+        flexmock(metrics.STAGE_DURATION).should_receive("labels").with_args(
+            stage="clone"
+        ).and_return(flexmock().should_receive("observe").with_args(2.5).once().mock())
+
+        @metrics.stage("clone")
+        def clone():
+            return "cloned"
+
+        assert clone() == "cloned"
+
+    def test_requests_hook(self):
+        response = flexmock(status_code=404, elapsed=timedelta(seconds=0.5))
+        flexmock(metrics).should_receive("observe_api").with_args("github", 404, 0.5).once()
+        metrics.requests_hook("github")(response)
+
+    def test_api_call_failed(self):
+        class ApiException(Exception):
+            status = 403
+
+        flexmock(metrics).should_receive("observe_api").with_args(
+            "kubernetes", 403, float
+        ).once()
+        with pytest.raises(ApiException):
+            with metrics.api_call("kubernetes"):
+                raise ApiException
+
+    def test_queue_wait(self):
+        headers = {}
+        metrics.on_before_task_publish(headers=headers)
+        task = flexmock(name="task.betka.master_sync", request=flexmock(**headers))
+        flexmock(metrics.QUEUE_WAIT).should_receive("labels").with_args(
+            task="task.betka.master_sync"
+        ).and_return(flexmock().should_receive("observe").once().mock())
+        metrics.on_task_prerun(task=task)
+
+    def test_push_to_mr(self):
+        flexmock(metrics.PUSH_TO_MR).should_receive("labels").never()
+        metrics.observe_push_to_mr("s2i-base", None)
+
+    def test_exported(self):
+        prometheus_client = pytest.importorskip("prometheus_client")
+        labels = {"api": "gitlab", "status": "200"}
+        before = prometheus_client.REGISTRY.get_sample_value(
+            "betka_api_requests_total", labels
+        ) or 0
+        metrics.observe_api("gitlab", 200, 0.1)
+        assert (
+            prometheus_client.REGISTRY.get_sample_value("betka_api_requests_total", labels)
+            == before + 1
+        )
@@ -0,0 +1,231 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test notification outbox and delivery"""
+
+import json
+
+from smtplib import SMTPServerDisconnected
+
+from flexmock import flexmock
+
+from betka import notifications
+from betka.emails import BetkaEmails
+from betka.notifications import NotificationOutbox, NotificationSender
+from betka.utils import SlackNotifications
+
+
+class FakeSMTP(object):
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.sent = []
+
+    def noop(self):
+        if not self.alive:
+            raise SMTPServerDisconnected()
+        return 250, b"OK"
+
+    def sendmail(self, sender, receivers, message):
+        self.sent.append((sender, receivers, message))
+
+    def quit(self):
+        pass
+
+
+class TestNotificationSender(object):
+    def test_smtp_connection_reused(self):
+        smtp = FakeSMTP()
+        flexmock(notifications).should_receive("SMTP").once().and_return(smtp)
+        sender = NotificationSender()
+        for _ in range(3):
+            sender.deliver(
+                "email",
+                {
+                    "sender": "a@b",
+                    "receivers": ["c@d"],
+                    "message": "text",
+                    "smtp_server": "smtp",
+                },
+            )
+        assert len(smtp.sent) == 3
+
+    def test_smtp_reconnect(self):
+        new_smtp = FakeSMTP()
+        flexmock(notifications).should_receive("SMTP").once().and_return(new_smtp)
+        sender = NotificationSender()
+        sender.smtp["smtp"] = FakeSMTP(alive=False)
+        sender.send_mail("a@b", ["c@d"], "text", "smtp")
+        assert new_smtp.sent == [("a@b", ["c@d"], "text")]
+
+    def test_webhook_client_reused(self):
+        response = flexmock(status_code=200, body="ok")
+        client = flexmock()
+        client.should_receive("send").twice().and_return(response)
+        flexmock(notifications).should_receive("WebhookClient").once().and_return(client)
+        sender = NotificationSender()
+        sender.send_webhook("https://hook", "fallback", [])
+        sender.send_webhook("https://hook", "fallback", [])
+
+
+class TestNotificationOutbox(object):
+    def test_direct_delivery_without_redis(self):
+        flexmock(notifications.OUTBOX).should_receive("publish").and_return(False)
+        flexmock(notifications.SENDER).should_receive("deliver").with_args(
+            "slack", dict
+        ).once()
+        SlackNotifications.send_webhook_notification("https://hook", "synced")
+
+    def test_email_published(self):
+        published = []
+        flexmock(notifications.OUTBOX).should_receive("publish").replace_with(
+            lambda kind, payload: published.append((kind, payload)) or True
+        )
+        flexmock(notifications.SENDER).should_receive("deliver").never()
+        BetkaEmails.send_email("text", ["c@d"], "subject")
+        kind, payload = published[0]
+        assert kind == "email"
+        assert payload["receivers"] == ["c@d"]
+        assert "Subject: subject" in payload["message"]
+
+    def test_publish(self):
+        outbox = NotificationOutbox()
+        outbox._redis = flexmock()
+        outbox._redis.should_receive("xadd").with_args(
+            "betka:notifications", dict
+        ).once()
+        flexmock(notifications.app).should_receive("send_task").with_args(
+            "task.betka.deliver_notifications", queue="queue.betka.notifications"
+        ).once()
+        assert outbox.publish("slack", {"url": "https://hook"})
+
+    def test_deliver_pending(self):
+        outbox = NotificationOutbox()
+        outbox.group_created = True
+        payload = {"kind": "slack", "payload": json.dumps({"url": "u"})}
+        outbox._redis = flexmock(
+            xpending_range=lambda *args, **kwargs: [
+                {"message_id": "1-0", "times_delivered": 2}
+            ],
+        )
+        outbox._redis.should_receive("xautoclaim").and_return(
+            ["0-0", [("1-0", payload)], []]
+        ).and_return(["0-0", [], []]).and_return(["0-0", [], []])
+        # more entries than one batch, the delivery reads until nothing is left
+        outbox._redis.should_receive("xreadgroup").and_return(
+            [("betka:notifications", [("2-0", payload)])]
+        ).and_return([("betka:notifications", [("3-0", payload)])]).and_return([])
+        outbox._redis.should_receive("xack").with_args(
+            "betka:notifications", "betka-notifiers", str
+        ).twice()
+        outbox._redis.should_receive("xdel").with_args("betka:notifications", str).twice()
+        flexmock(outbox).should_receive("schedule_retry").once()
+        sender = flexmock()
+        sender.should_receive("deliver").and_raise(OSError).and_return(None).and_return(
+            None
+        )
+        # the first entry fails and stays pending in the group
+        assert outbox.deliver_pending(sender, count=1) == 2
+
+    def test_schedule_retry(self):
+        outbox = NotificationOutbox()
+        outbox._redis = flexmock(xpending=lambda *args: {"pending": 1})
+        outbox._redis.should_receive("set").with_args(
+            "betka:notifications:retry", 1, nx=True, ex=600
+        ).and_return(True).and_return(None)
+        flexmock(notifications.app).should_receive("send_task").with_args(
+            "task.betka.deliver_notifications",
+            kwargs={"retry": True},
+            queue="queue.betka.notifications",
+            countdown=300,
+        ).once()
+        outbox.schedule_retry()
+        # the retry is already scheduled
+        outbox.schedule_retry()
+
+    def test_schedule_retry_nothing_pending(self):
+        outbox = NotificationOutbox()
+        outbox._redis = flexmock(xpending=lambda *args: {"pending": 0})
+        outbox._redis.should_receive("set").never()
+        flexmock(notifications.app).should_receive("send_task").never()
+        outbox.schedule_retry()
+
+    def test_deliver_outbox_retry(self):
+        flexmock(notifications.OUTBOX).should_receive("clear_retry").once()
+        flexmock(notifications.OUTBOX).should_receive("deliver_pending").with_args(
+            notifications.SENDER
+        ).and_return(3).once()
+        assert notifications.deliver_outbox(retry=True) == 3
+
+    def test_dead_letter(self):
+        outbox = NotificationOutbox()
+        outbox.group_created = True
+        payload = {"kind": "slack", "payload": json.dumps({"url": "u"})}
+        outbox._redis = flexmock(
+            xreadgroup=lambda *args, **kwargs: [],
+        )
+        outbox._redis.should_receive("xautoclaim").and_return(
+            ["0-0", [("1-0", payload), ("2-0", payload)], []]
+        ).and_return(["0-0", [], []])
+        flexmock(outbox).should_receive("schedule_retry")
+        outbox._redis.should_receive("xpending_range").with_args(
+            "betka:notifications",
+            "betka-notifiers",
+            min="1-0",
+            max="2-0",
+            count=2,
+            consumername=str,
+        ).and_return(
+            [
+                {"message_id": "1-0", "times_delivered": 6},
+                {"message_id": "2-0", "times_delivered": 5},
+            ]
+        )
+        outbox._redis.should_receive("xadd").with_args(
+            "betka:notifications:dead",
+            dict(payload, id="1-0"),
+            maxlen=10000,
+            approximate=True,
+        ).once()
+        outbox._redis.should_receive("xack").with_args(
+            "betka:notifications", "betka-notifiers", str
+        ).twice()
+        outbox._redis.should_receive("xdel").with_args(
+            "betka:notifications", str
+        ).twice()
+        sender = flexmock()
+        sender.should_receive("deliver").with_args("slack", {"url": "u"}).once()
+        # the first entry exceeded NOTIFICATION_MAX_DELIVERIES, the second one is sent
+        assert outbox.deliver_pending(sender) == 1
+
+    def test_redis_not_installed(self):
+        flexmock(notifications).should_receive("redis_client").with_args(
+            "redis://redis:6379/0",
+            str,
+            socket_timeout=5,
+            socket_connect_timeout=2,
+            decode_responses=True,
+        ).and_return(None).once()
+        outbox = NotificationOutbox("redis://redis:6379/0")
+        assert outbox.redis is None
+        assert outbox.redis is None
+        assert not outbox.publish("slack", {"url": "https://hook"})
@@ -0,0 +1,134 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test SSH multiplexing"""
+
+import os
+import pytest
+
+from flexmock import flexmock
+
+from betka import ssh
+from betka.ssh import SSHMultiplexer
+
+
+class TestSSHMultiplexer(object):
+    def setup_method(self):
+        os.environ["GIT_SSH_COMMAND"] = "ssh -i id_rsa"
+        self.mux = SSHMultiplexer("gitlab.com", control_dir="/tmp/betka-control")
+
+    def teardown_method(self):
+        ssh.SSH_MULTIPLEXER = None
+
+    def test_enable_multiplexing(self):
+        assert ssh.get_multiplexer() is None
+        flexmock(SSHMultiplexer).should_receive("enable").once()
+        flexmock(ssh.atexit).should_receive("register").once()
+        mux = ssh.enable_multiplexing("gitlab.com")
+        assert ssh.get_multiplexer() is mux
+        assert ssh.enable_multiplexing("gitlab.com") is mux
+
+    def test_ssh_command(self):
+        assert self.mux.ssh_command == (
+            "ssh -i id_rsa -o ControlMaster=auto "
+            "-o ControlPath=/tmp/betka-control/%C -o ControlPersist=yes"
+        )
+
+    def test_ensure_master(self):
+        flexmock(self.mux).should_receive("is_alive").and_return(False).and_return(
+            True
+        ).and_return(True)
+        flexmock(self.mux).should_receive("control").and_return(0)
+        flexmock(ssh.subprocess).should_receive("run").and_return(flexmock(returncode=0))
+        for _ in range(3):
+            assert self.mux.ensure_master()
+        assert self.mux.stats == {"handshakes": 1, "operations": 3}
+        assert self.mux.handshakes_saved == 2
+
+    def test_establish_failed(self):
+        flexmock(self.mux).should_receive("control").with_args("exit").and_return(255)
+        flexmock(ssh.subprocess).should_receive("run").and_return(flexmock(returncode=255))
+        assert not self.mux.establish()
+        assert self.mux.stats["handshakes"] == 0
+
+    def test_control(self):
+        flexmock(ssh).should_receive("run_argv").with_args(
+            [
+                "ssh", "-i", "id_rsa", "-o", "ControlMaster=auto",
+                "-o", "ControlPath=/tmp/betka-control/%C", "-o", "ControlPersist=yes",
+                "-O", "check", "git@gitlab.com",
+            ],
+            timeout=int,
+        ).and_return(flexmock(returncode=0))
+        assert self.mux.is_alive()
+
+    @pytest.mark.parametrize(
+        "url,multiplexed",
+        [
+            ("git@gitlab.com:foo/bar.git", True),
+            ("ssh://git@gitlab.com/foo/bar.git", True),
+            ("git@github.com:foo/bar.git", False),
+            ("https://gitlab.com/foo/bar.git", False),
+            ("/tmp/bar", False),
+        ],
+    )
+    def test_is_multiplexed(self, url, multiplexed):
+        assert self.mux.is_multiplexed(url) == multiplexed
+
+    @pytest.mark.parametrize(
+        "args,checked",
+        [
+            (["push", "-u", "origin", "betka-fc40"], True),
+            (["push", "upstream", "betka-fc40"], False),
+            (["fetch", "--depth", "1", "origin", "abcd"], True),
+            (["fetch"], True),
+            (["remote", "update", "upstream"], False),
+            (["remote", "update"], True),
+            (["clone", "git@gitlab.com:foo/bar.git", "/tmp/bar"], True),
+            (["clone", "https://github.com/sclorg/s2i-base", "/tmp/bar"], False),
+            (["remote", "add", "upstream", "git@gitlab.com:foo/bar.git"], False),
+            (["submodule", "update", "--init"], True),
+            (["submodule", "init"], False),
+            (["commit", "-m", "foo"], False),
+        ],
+    )
+    def test_before_git_command(self, args, checked):
+        ssh.SSH_MULTIPLEXER = self.mux
+        flexmock(ssh).should_receive("remote_urls").and_return(
+            {"origin": "git@gitlab.com:foo/bar.git", "upstream": "https://github.com/foo/bar"}
+        )
+        flexmock(ssh).should_receive("submodule_urls").and_return(
+            ["https://github.com/foo/common", "git@gitlab.com:foo/common.git"]
+        )
+        flexmock(self.mux).should_receive("ensure_master").times(int(checked))
+        ssh.before_git_command(args, cwd="/tmp/bar")
+
+    def test_remote_urls(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+        monkeypatch.setenv("GIT_CONFIG_KEY_0", "url.git@gitlab.com:foo/.insteadOf")
+        monkeypatch.setenv("GIT_CONFIG_VALUE_0", "https://gitlab.com/foo/")
+        ssh.run_argv(["git", "init", "-q", str(tmp_path)])
+        ssh.run_argv(
+            ["git", "remote", "add", "origin", "https://gitlab.com/foo/bar.git"], cwd=str(tmp_path)
+        )
+        assert ssh.remote_urls(str(tmp_path)) == {"origin": "git@gitlab.com:foo/bar.git"}
@@ -0,0 +1,66 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test registry of compiled templates"""
+
+import pytest
+
+from pathlib import Path
+
+from flexmock import flexmock
+
+from betka.template_registry import TemplateRegistry, get_registry
+from betka.utils import text_from_template
+
+TEMPLATE_DIR = str(Path(__file__).parent.parent.parent / "files/home/templates")
+
+
+class TestTemplateRegistry(object):
+    def test_compile_all(self, tmp_path):
+        registry = TemplateRegistry(TEMPLATE_DIR, bytecode_cache_dir=str(tmp_path))
+        compiled = registry.compile_all()
+        assert "digest_template" in compiled
+        assert "email_template" in compiled
+        # compiled bytecode is stored for other worker processes
+        assert list(tmp_path.iterdir())
+
+    def test_compiled_once(self, tmp_path):
+        (tmp_path / "hello").write_text("Hello {{ name }}!")
+        registry = TemplateRegistry(str(tmp_path), auto_reload=False, bytecode_cache_dir=None)
+        assert registry.render("hello", name="betka") == "Hello betka!"
+        flexmock(registry.env.loader).should_receive("get_source").never()
+        assert registry.render("hello", name="world") == "Hello world!"
+        assert registry.report()["hello"]["count"] == 2
+
+    def test_auto_reload(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("DEPLOYMENT", "prod")
+        assert not TemplateRegistry(str(tmp_path), bytecode_cache_dir=None).env.auto_reload
+        monkeypatch.setenv("DEPLOYMENT", "test")
+        assert TemplateRegistry(str(tmp_path), bytecode_cache_dir=None).env.auto_reload
+
+    def test_registry_shared(self):
+        assert get_registry(TEMPLATE_DIR) is get_registry(Path(TEMPLATE_DIR))
+
+    def test_missing_template(self):
+        with pytest.raises(FileNotFoundError):
+            text_from_template(TEMPLATE_DIR, "missing_template", {})
@@ -0,0 +1,92 @@
+# MIT License
+#
+# Copyright (c) 2020 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""Test OpenTelemetry tracing"""
+
+import json
+import pytest
+
+from flexmock import flexmock
+
+from betka import tracing
+
+
+@pytest.fixture()
+def trace_file(tmp_path):
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+
+    path = tmp_path / "spans.json"
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(tracing.JsonFileSpanExporter(str(path))))
+    flexmock(tracing.trace).should_receive("get_tracer").and_return(provider.get_tracer("test"))
+    return path
+
+
+def read_spans(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+class TestTracing(object):
+    def test_without_opentelemetry(self):
+        flexmock(tracing, trace=None)
+        with tracing.span("git clone", subcommand="clone") as git_span:
+            git_span.set_attributes({"returncode": 0})
+        assert git_span is tracing.NOOP_SPAN
+
+    def test_span_attributes(self):
+        assert tracing.span_attributes({"image": "s2i-base", "branch": None, "retries": 2}) == {
+            "image": "s2i-base",
+            "retries": 2,
+        }
+
+    def test_nested_spans_exported(self, trace_file):
+        @tracing.span("betka.branch")
+        def sync_branch():
+            with tracing.span("git checkout", subcommand="checkout"):
+                pass
+
+        with tracing.span("betka.image", image="s2i-base"):
+            sync_branch()
+        spans = {x["name"]: x for x in read_spans(trace_file)}
+        assert list(spans) == ["git checkout", "betka.branch", "betka.image"]
+        assert spans["betka.image"]["attributes"] == {"image": "s2i-base"}
+        assert spans["git checkout"]["parent_id"] == spans["betka.branch"]["context"]["span_id"]
+        assert spans["betka.branch"]["parent_id"] == spans["betka.image"]["context"]["span_id"]
+
+    def test_celery_propagation(self, trace_file):
+        headers = {}
+        with tracing.span("publish"):
+            tracing.on_before_task_publish(headers=headers)
+        assert "traceparent" in headers
+        task = flexmock(name="task.betka.master_sync", request=flexmock(**headers))
+        tracing.on_task_prerun(task_id="1234", task=task)
+        with tracing.span("betka.sync"):
+            pass
+        tracing.on_task_postrun(task_id="1234", state="SUCCESS")
+        spans = {x["name"]: x for x in read_spans(trace_file)}
+        task_span = spans["celery.task task.betka.master_sync"]
+        assert task_span["context"]["trace_id"] == spans["publish"]["context"]["trace_id"]
+        assert task_span["attributes"]["celery.state"] == "SUCCESS"
+        assert spans["betka.sync"]["parent_id"] == task_span["context"]["span_id"]
@@ -25,7 +25,7 @@
 import pytest
 from subprocess import CalledProcessError
 
-from betka.utils import run_cmd
+from betka.utils import BoundedBuffer, run_argv, run_cmd
 
 
 class TestUtils(object):
@@ -44,3 +44,37 @@ class TestUtils(object):
                 run_cmd(cmd, ignore_error=False)
             assert run_cmd(cmd, ignore_error=True, return_output=True)
             assert run_cmd(cmd, ignore_error=True, return_output=False) > 0
+
+    def test_run_argv(self):
+        result = run_argv(["sh", "-c", "echo out; echo err >&2; exit 3"])
+        assert result.returncode == 3
+        assert "out\n" in result.output and "err\n" in result.output
+        assert not result.timed_out
+        assert result.duration >= 0
+
+    def test_run_argv_timeout(self):
+        result = run_argv(["sh", "-c", "sleep 30 & wait"], timeout=0.5)
+        assert result.timed_out
+        assert result.returncode != 0
+        assert result.duration < 10
+
+    def test_run_argv_background_descendant(self):
+        # the background sleep keeps the output pipe open after sh exits
+        result = run_argv(["sh", "-c", "sleep 8 & echo hi"], timeout=3)
+        assert result.returncode == 0
+        assert result.output == "hi\n"
+        assert not result.timed_out
+        assert result.duration < 3
+
+    def test_run_argv_bounded_output(self):
+        result = run_argv(["seq", "1", "10000"], max_output=100)
+        assert result.output.startswith("[... ")
+        assert result.output.endswith("9999\n10000\n")
+        assert len(result.output) < 200
+
+    def test_bounded_buffer(self):
+        buffer = BoundedBuffer(10)
+        buffer.append("12345\n")
+        assert buffer.getvalue() == "12345\n"
+        buffer.append("67890\n")
+        assert buffer.getvalue() == "[... 6 characters truncated ...]\n67890\n"